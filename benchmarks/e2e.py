@@ -0,0 +1,98 @@
+"""Measure a full history sync and live event latency against the fake server
+
+Run from the repository root with:
+
+    python -m benchmarks.e2e [--trades 100000] [--events 10000] [--rate 1000]
+
+The sync reports wall time, requests and request weight spent per trade. The
+listener reports the latency from each event's timestamp until it was handled.
+"""
+import argparse
+import asyncio
+import time
+from typing import Dict, List
+
+from benchmarks import generators
+from benchmarks.fake_binance import FakeBinance
+from benchmarks.scratch import use_scratch_folder
+from binance.client import Client
+from binance_monitor.listener import UserStreamListener
+from binance_monitor.monitor import AccountMonitor
+
+
+def percentiles(values: List[float], points=(50, 90, 99, 100)) -> Dict[int, float]:
+    ordered = sorted(values)
+    return {
+        point: ordered[min(len(ordered) - 1, len(ordered) * point // 100)]
+        for point in points
+    }
+
+
+def measure_sync(fake: FakeBinance, monitor: AccountMonitor) -> None:
+    start = time.perf_counter()
+    monitor.get_trade_history_for(fake.symbols, full=True)
+    monitor.trade_store.flush()
+    elapsed = time.perf_counter() - start
+
+    trades = sum(len(trades) for trades in fake.trades.values())
+    requests = fake.requests["/api/v3/myTrades"]
+    print(f"sync: {trades} trades in {elapsed:.2f}s ({trades / elapsed:.0f}/s)")
+    print(
+        f"      {requests} myTrades requests, {trades / max(requests, 1):.0f} "
+        f"trades/request, {fake.weight} weight, {fake.rejected} rejected"
+    )
+
+
+def measure_listener(
+    fake: FakeBinance, monitor: AccountMonitor, count: int, rate: float
+) -> None:
+    events = generators.execution_reports(count)
+    fills = sum(1 for event in events if event["t"] != -1)
+    latencies: List[float] = []
+
+    def handle(event):
+        monitor.handle_event(event)
+        latencies.append(time.time() - event.event_timestamp / 1000)
+
+    async def run():
+        loop = asyncio.get_event_loop()
+        listener = UserStreamListener(
+            monitor.client, handle, stream_url=fake.stream_url
+        )
+        task = asyncio.ensure_future(listener.run())
+        while fake.connections == 0:
+            await asyncio.sleep(0.01)
+
+        sent = await loop.run_in_executor(None, fake.replay, events, rate)
+        while len(latencies) < fills:
+            await asyncio.sleep(0.01)
+        listener.stop()
+        await task
+        return sent, listener.metrics
+
+    sent, metrics = asyncio.get_event_loop().run_until_complete(run())
+    print(f"listen: {count} events ({fills} fills) sent in {sent:.2f}s")
+    latency = ", ".join(
+        f"p{point}={value * 1000:.1f}ms"
+        for point, value in percentiles(latencies).items()
+    )
+    print(f"        latency {latency}, max queue {metrics['max_queue_depth']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trades", type=int, default=100000)
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--rate", type=float, default=1000, help="events per second")
+    args = parser.parse_args()
+
+    use_scratch_folder()
+    with FakeBinance(generators.my_trades(args.trades)) as fake:
+        Client.API_URL = fake.rest_url
+        monitor = AccountMonitor(credentials=("key", "secret"), name="e2e")
+        measure_sync(fake, monitor)
+        measure_listener(fake, monitor, args.events, args.rate)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""Local stand-in for the Binance REST API and user data stream
+
+Serves the endpoints used by binance-monitor from synthetic data, so that history
+syncs and the live listener can be exercised and measured without an account:
+
+- GET /api/v1/ping, /api/v1/time and /api/v1/exchangeInfo
+- GET /api/v3/myTrades, with the `limit`, `fromId`, `startTime` and `endTime`
+  semantics of the real endpoint
+- GET /api/v3/openOrders
+- POST/PUT/DELETE /api/v1/userDataStream
+- a websocket at /ws/<listenKey> which replays events at a chosen rate
+
+Every REST response carries the X-MBX-USED-WEIGHT headers. Requests over the
+REQUEST_WEIGHT limit, or forced with `reject_next`, get HTTP 429 and Retry-After.
+"""
+import asyncio
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import websockets
+
+from benchmarks import generators
+from binance_monitor.ratelimit import INTERVAL_SECONDS
+
+RATE_LIMITS = [
+    {
+        "rateLimitType": "REQUEST_WEIGHT",
+        "interval": "MINUTE",
+        "intervalNum": 1,
+        "limit": 1200,
+    },
+    {"rateLimitType": "ORDERS", "interval": "SECOND", "intervalNum": 10, "limit": 100},
+    {"rateLimitType": "ORDERS", "interval": "DAY", "intervalNum": 1, "limit": 200000},
+    {
+        "rateLimitType": "RAW_REQUESTS",
+        "interval": "MINUTE",
+        "intervalNum": 5,
+        "limit": 5000,
+    },
+]
+
+# Request weight of each endpoint, by path
+WEIGHTS = {
+    "/api/v1/ping": 1,
+    "/api/v1/time": 1,
+    "/api/v1/exchangeInfo": 1,
+    "/api/v3/myTrades": 5,
+    "/api/v3/openOrders": 40,
+    "/api/v1/userDataStream": 1,
+}
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 1000
+
+
+def exchange_info(
+    symbols: List[str], rate_limits: List[Dict] = RATE_LIMITS
+) -> Dict[str, Any]:
+    """exchangeInfo listing *symbols*, all trading, and publishing *rate_limits*"""
+
+    return {
+        "timezone": "UTC",
+        "serverTime": int(time.time() * 1000),
+        "rateLimits": rate_limits,
+        "exchangeFilters": [],
+        "symbols": [
+            {
+                "symbol": symbol,
+                "status": "TRADING",
+                "baseAsset": base,
+                "baseAssetPrecision": 8,
+                "quoteAsset": quote,
+                "quotePrecision": 8,
+                "filters": [],
+            }
+            for symbol, (base, quote) in _split_symbols(symbols).items()
+        ],
+    }
+
+
+def _split_symbols(symbols: List[str]) -> Dict[str, tuple]:
+    quotes = ["USDT", "BTC", "ETH", "BNB"]
+    split = {}
+    for symbol in symbols:
+        quote = next(q for q in quotes if symbol.endswith(q))
+        split[symbol] = (symbol[: -len(quote)], quote)
+    return split
+
+
+class FakeBinance:
+    """REST and websocket servers on localhost, run from background threads"""
+
+    def __init__(
+        self,
+        trades: Optional[List[Dict]] = None,
+        symbols: List[str] = generators.SYMBOLS,
+        host: str = "127.0.0.1",
+        rate_limits: List[Dict] = RATE_LIMITS,
+    ):
+        """Create the servers, which start listening on `start`
+
+        :param trades: results to serve from myTrades, e.g. from
+            `generators.my_trades`. Default is no trades
+        :param symbols: symbols listed in exchangeInfo
+        :param host: interface to listen on. Ports are picked by the OS
+        :param rate_limits: limits published in exchangeInfo. The first
+            REQUEST_WEIGHT limit is enforced, e.g. a limit per SECOND lets tests
+            run into it quickly
+        """
+
+        self.host = host
+        self.symbols = symbols
+        self.rate_limits = rate_limits
+        weight_limit = next(
+            limit for limit in rate_limits if limit["rateLimitType"] == "REQUEST_WEIGHT"
+        )
+        self.weight_limit = int(weight_limit["limit"])
+        interval_num = int(weight_limit.get("intervalNum", 1))
+        self._interval = interval_num * INTERVAL_SECONDS[weight_limit["interval"]]
+        self._weight_header = (
+            f"X-MBX-USED-WEIGHT-{interval_num}{weight_limit['interval'][0]}"
+        )
+        self.trades: Dict[str, List[Dict]] = {}
+        for trade in sorted(trades or [], key=lambda t: t["id"]):
+            self.trades.setdefault(trade["symbol"], []).append(trade)
+        self.open_orders: List[Dict] = []
+
+        self.requests: Counter = Counter()
+        # Parameters of every myTrades request, in the order received
+        self.trade_queries: List[Dict[str, str]] = []
+        self.weight = 0
+        # Most weight used in any one window of the enforced limit
+        self.peak_weight = 0
+        self.rejected = 0
+        self.listen_keys = set()
+
+        self._lock = threading.Lock()
+        self._window = 0
+        self._used_weight = 0
+        self._reject = 0
+        self._retry_after = 1
+
+        self._http = ThreadingHTTPServer((host, 0), self._handler_class())
+        self._http.daemon_threads = True
+        self._http_thread = threading.Thread(
+            target=self._http.serve_forever, name="fake-binance-rest", daemon=True
+        )
+
+        self._loop = asyncio.new_event_loop()
+        self._ws_thread = threading.Thread(
+            target=self._loop.run_forever, name="fake-binance-ws", daemon=True
+        )
+        self._ws_server = None
+        self._sockets = set()
+        self.ws_port: Optional[int] = None
+
+    @property
+    def rest_url(self) -> str:
+        """Base URL to use as `Client.API_URL`"""
+
+        return f"http://{self.host}:{self._http.server_port}/api"
+
+    @property
+    def stream_url(self) -> str:
+        """Base URL to use as `UserStreamListener` *stream_url*"""
+
+        return f"ws://{self.host}:{self.ws_port}/ws/"
+
+    def start(self) -> "FakeBinance":
+        self._http_thread.start()
+        self._ws_thread.start()
+        self._ws_server = self._run(self._start_ws())
+        self.ws_port = next(iter(self._ws_server.sockets)).getsockname()[1]
+        return self
+
+    async def _start_ws(self):
+        return await websockets.serve(self._serve, self.host, 0)
+
+    def stop(self) -> None:
+        self._http.shutdown()
+        self._http.server_close()
+        if self._ws_server is not None:
+            self._ws_server.close()
+            self._run(self._ws_server.wait_closed())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._ws_thread.join()
+
+    def __enter__(self) -> "FakeBinance":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    # REST API
+
+    def reject_next(self, count: int = 1, retry_after: int = 1) -> None:
+        """Answer the next *count* requests with HTTP 429"""
+
+        with self._lock:
+            self._reject = count
+            self._retry_after = retry_after
+
+    def _charge(self, path: str) -> Optional[int]:
+        """Account for a request, returning Retry-After seconds if it is rejected"""
+
+        with self._lock:
+            self.requests[path] += 1
+            window = int(time.time() // self._interval)
+            if window != self._window:
+                self._window = window
+                self._used_weight = 0
+            self._used_weight += WEIGHTS.get(path, 1)
+            self.weight += WEIGHTS.get(path, 1)
+            self.peak_weight = max(self.peak_weight, self._used_weight)
+
+            if self._reject:
+                self._reject -= 1
+                self.rejected += 1
+                return self._retry_after
+            if self._used_weight > self.weight_limit:
+                self.rejected += 1
+                return int(self._interval - time.time() % self._interval) + 1
+            return None
+
+    def _headers(self) -> Dict[str, str]:
+        used = str(self._used_weight)
+        return {"X-MBX-USED-WEIGHT": used, self._weight_header: used}
+
+    def my_trades(self, params: Dict[str, str]) -> List[Dict]:
+        """Trades of one symbol, as selected by the real myTrades endpoint
+
+        With `fromId`, trades from that id on. With `startTime`, the oldest trades
+        from that time on (up to `endTime`). Otherwise, the newest trades up to
+        `endTime`. At most `limit` trades are returned, oldest first
+        """
+
+        with self._lock:
+            self.trade_queries.append(params)
+        trades = self.trades.get(params["symbol"], [])
+        limit = min(int(params.get("limit", DEFAULT_LIMIT)), MAX_LIMIT)
+
+        if "fromId" in params:
+            from_id = int(params["fromId"])
+            return [t for t in trades if t["id"] >= from_id][:limit]
+
+        end_time = int(params["endTime"]) if "endTime" in params else None
+        if end_time is not None:
+            trades = [t for t in trades if t["time"] <= end_time]
+        if "startTime" in params:
+            start_time = int(params["startTime"])
+            return [t for t in trades if t["time"] >= start_time][:limit]
+        return trades[-limit:]
+
+    def _handle(self, method: str, url: str):
+        parsed = urlparse(url)
+        path = parsed.path
+        params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+
+        retry_after = self._charge(path)
+        if retry_after is not None:
+            body = {"code": -1003, "msg": "Too many requests."}
+            return 429, body, dict(self._headers(), **{"Retry-After": str(retry_after)})
+
+        if path == "/api/v1/ping":
+            body: Any = {}
+        elif path == "/api/v1/time":
+            body = {"serverTime": int(time.time() * 1000)}
+        elif path == "/api/v1/exchangeInfo":
+            body = exchange_info(self.symbols, self.rate_limits)
+        elif path == "/api/v3/myTrades":
+            body = self.my_trades(params)
+        elif path == "/api/v3/openOrders":
+            body = self.open_orders
+        elif path == "/api/v1/userDataStream":
+            body = self._user_data_stream(method, params)
+        else:
+            return 404, {"code": -1, "msg": f"Unknown path {path}"}, self._headers()
+        return 200, body, self._headers()
+
+    def _user_data_stream(self, method: str, params: Dict[str, str]) -> Dict:
+        if method == "POST":
+            # Like Binance, hand out the active key again while there is one
+            if not self.listen_keys:
+                self.listen_keys.add(uuid.uuid4().hex)
+            return {"listenKey": next(iter(self.listen_keys))}
+        if method == "DELETE":
+            self.listen_keys.discard(params.get("listenKey"))
+        return {}
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self):
+                # Signed requests may send their parameters in the body
+                length = int(self.headers.get("Content-Length") or 0)
+                query = self.rfile.read(length).decode() if length else ""
+                url = self.path if not query else f"{self.path}?{query}"
+                status, body, headers = fake._handle(self.command, url)
+
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for header, value in headers.items():
+                    self.send_header(header, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _respond
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    # User data stream
+
+    async def _serve(self, socket, path: Optional[str] = None) -> None:
+        # websockets < 10 passes the path; later versions attach the request
+        path = path or socket.request.path
+        if path.rsplit("/", 1)[-1] not in self.listen_keys:
+            await socket.close(code=4001, reason="Invalid listenKey")
+            return
+        self._sockets.add(socket)
+        try:
+            await socket.wait_closed()
+        finally:
+            self._sockets.discard(socket)
+
+    def replay(self, events: List[Dict], rate: Optional[float] = None) -> float:
+        """Send *events* to every connected stream, blocking until all are sent
+
+        Each event's "E" (and "T", for fills) is set to the time it is sent, so
+        that the receiver can measure its latency from the event time
+
+        :param events: events such as from `generators.execution_reports`
+        :param rate: events per second. Default is as fast as possible
+        :return: seconds taken
+        """
+
+        return self._run(self._replay(events, rate))
+
+    async def _replay(self, events: List[Dict], rate: Optional[float]) -> float:
+        start = time.perf_counter()
+        for num, event in enumerate(events):
+            if rate:
+                delay = start + num / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            now_ms = int(time.time() * 1000)
+            event = dict(event, E=now_ms)
+            if event.get("t", -1) != -1:
+                event["T"] = now_ms
+            message = json.dumps(event)
+            for socket in list(self._sockets):
+                await socket.send(message)
+        return time.perf_counter() - start
+
+    def disconnect(self) -> None:
+        """Drop every user data stream connection, e.g. to test reconnecting"""
+
+        async def close_all():
+            for socket in list(self._sockets):
+                await socket.close(code=1011, reason="Dropped by test")
+
+        self._run(close_all())
+
+    @property
+    def connections(self) -> int:
+        return len(self._sockets)
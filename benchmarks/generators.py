@@ -0,0 +1,110 @@
+"""Synthetic Binance payloads for benchmarks
+
+Payloads follow the shape of the real API responses closely enough to exercise the
+same code paths, and are reproducible for a given *seed*.
+"""
+import json
+import random
+from typing import Any, Dict, List
+
+START_MS = 1546300800000
+
+SYMBOLS = ["ETHBTC", "BNBBTC", "LTCBTC", "XRPETH", "ADAETH", "BTCUSDT", "BNBUSDT"]
+
+COMMISSION_ASSETS = ["BNB", "BTC", "ETH", "USDT"]
+
+
+def _amount(rng: random.Random, low: float, high: float) -> str:
+    return f"{rng.uniform(low, high):.8f}"
+
+
+def my_trades(count: int, symbols: List[str] = SYMBOLS, seed: int = 0) -> List[Dict]:
+    """Results of `myTrades` across *symbols*, one trade every few seconds
+
+    :param count: number of trades
+    :param symbols: symbols the trades are spread over
+    :param seed: random seed
+    :return: list of trade dicts, in time order
+    """
+
+    rng = random.Random(seed)
+    trades = []
+    time_ms = START_MS
+    for trade_id in range(count):
+        time_ms += rng.randint(100, 10000)
+        is_buyer = rng.random() < 0.5
+        trades.append(
+            {
+                "symbol": rng.choice(symbols),
+                "id": trade_id,
+                "orderId": trade_id // 3,
+                "price": _amount(rng, 0.001, 0.1),
+                "qty": _amount(rng, 0.01, 100),
+                "commission": _amount(rng, 0.0, 0.01),
+                "commissionAsset": rng.choice(COMMISSION_ASSETS),
+                "time": time_ms,
+                "isBuyer": is_buyer,
+                "isMaker": rng.random() < 0.5,
+                "isBestMatch": True,
+            }
+        )
+    return trades
+
+
+def execution_reports(
+    count: int,
+    trade_fraction: float = 0.25,
+    symbols: List[str] = SYMBOLS,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    """User data stream `executionReport` events
+
+    Most execution reports are not trades (new orders, cancels), so only about
+    *trade_fraction* of the events are fills, as from a grid bot
+
+    :param count: number of events
+    :param trade_fraction: fraction of events which are fills
+    :param symbols: symbols the events are spread over
+    :param seed: random seed
+    :return: list of event dicts, in time order
+    """
+
+    rng = random.Random(seed)
+    events = []
+    time_ms = START_MS
+    for event_id in range(count):
+        time_ms += rng.randint(1, 1000)
+        is_fill = rng.random() < trade_fraction
+        price = _amount(rng, 0.001, 0.1)
+        qty = _amount(rng, 0.01, 100)
+        events.append(
+            {
+                "e": "executionReport",
+                "E": time_ms,
+                "s": rng.choice(symbols),
+                "c": f"bench{event_id}",
+                "S": "BUY" if rng.random() < 0.5 else "SELL",
+                "o": "LIMIT",
+                "f": "GTC",
+                "q": qty,
+                "p": price,
+                "x": "TRADE" if is_fill else rng.choice(["NEW", "CANCELED"]),
+                "X": "FILLED" if is_fill else "NEW",
+                "i": event_id,
+                "l": qty if is_fill else "0.00000000",
+                "z": qty if is_fill else "0.00000000",
+                "L": price if is_fill else "0.00000000",
+                "n": _amount(rng, 0.0, 0.01) if is_fill else "0",
+                "N": rng.choice(COMMISSION_ASSETS) if is_fill else None,
+                "T": time_ms,
+                "t": event_id if is_fill else -1,
+                "Y": f"{float(qty) * float(price):.8f}" if is_fill else "0.00000000",
+            }
+        )
+    return events
+
+
+def raw_messages(events: List[Dict[str, Any]]) -> List[str]:
+    """Encode events as the JSON text frames received from the websocket"""
+
+    return [json.dumps(event) for event in events]
@@ -0,0 +1,305 @@
+"""Time the ingestion, store and event hot paths and compare against baselines
+
+Run from the repository root with:
+
+    python -m benchmarks.run [--scales 1000 10000] [--cases NAME ...]
+    python -m benchmarks.run --save-baseline
+
+Each case is timed at every scale (number of trades or events), and the best of
+several runs is compared with `baselines.json`. The exit status is 1 if any case is
+slower than its baseline by more than the threshold, and 2 if there is no baselines
+file at all. Cases without a baseline are reported but do not fail the run.
+
+The committed baselines were recorded on the reference machine that runs the
+comparison. Timings are only comparable on the machine they were recorded on, so
+after changing that machine, record them again with `--save-baseline` and commit
+the file.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from benchmarks import generators
+from benchmarks.scratch import use_scratch_folder
+from binance_monitor import costbasis, store
+from binance_monitor.trade import TaxTrade
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+SCALES = [1000, 10000, 100000]
+
+# A case is slower than its baseline if it takes more than (1 + THRESHOLD) times as long
+THRESHOLD = 0.25
+
+REPEAT = 3
+
+use_scratch_folder()
+
+_store_count = 0
+
+
+def new_store(**kwargs) -> store.TradeStore:
+    """Create an empty store with a name not used before in this run"""
+
+    global _store_count
+    _store_count += 1
+    return store.TradeStore(f"bench{_store_count}", **kwargs)
+
+
+def stored(trades: List[Dict]) -> store.TradeStore:
+    """Create a store holding *trades* on disk"""
+
+    trade_store = new_store()
+    trade_store.update(TaxTrade.frame_from_historic_trades(trades))
+    trade_store.flush()
+    return trade_store
+
+
+# Each case takes the scale and returns (setup, run). `setup` is called before every
+# timed run and its result is passed to `run`
+Case = Callable[[int], Tuple[Callable[[], Any], Callable[[Any], Any]]]
+
+
+def case_frame_from_historic_trades(scale: int):
+    trades = generators.my_trades(scale)
+    return lambda: trades, TaxTrade.frame_from_historic_trades
+
+
+def case_from_historic_trades(scale: int):
+    trades = generators.my_trades(scale)
+    return lambda: trades, lambda t: [TaxTrade.from_historic_trades(r) for r in t]
+
+
+def case_update(scale: int):
+    frame = TaxTrade.frame_from_historic_trades(generators.my_trades(scale))
+    return new_store, lambda trade_store: trade_store.update(frame)
+
+
+def case_save(scale: int):
+    frame = TaxTrade.frame_from_historic_trades(generators.my_trades(scale))
+
+    def setup():
+        trade_store = new_store()
+        trade_store.update(frame)
+        return trade_store
+
+    return setup, lambda trade_store: trade_store.flush()
+
+
+def case_resync(scale: int):
+    trades = generators.my_trades(scale)
+    frame = TaxTrade.frame_from_historic_trades(trades)
+
+    def run(trade_store):
+        # A full re-download of history which is already stored
+        trade_store.update(frame)
+        trade_store.flush()
+
+    return lambda: stored(trades), run
+
+
+def case_compact(scale: int):
+    trades = generators.my_trades(scale)
+    return lambda: stored(trades), lambda trade_store: trade_store.compact()
+
+
+def case_to_csv(scale: int):
+    trades = generators.my_trades(scale)
+    return lambda: stored(trades), lambda trade_store: trade_store.to_csv()
+
+
+def case_cost_basis(scale: int):
+    trades = generators.my_trades(scale)
+
+    def run(trade_store):
+        costbasis.CostBasis(trade_store, "FIFO").rebuild()
+
+    return lambda: stored(trades), run
+
+
+def fills(scale: int) -> List[Dict]:
+    """Execution reports of trades only"""
+
+    return [
+        event
+        for event in generators.execution_reports(scale, trade_fraction=1.0)
+        if event["t"] != -1
+    ]
+
+
+def case_taxtrade_init(scale: int):
+    # The validating constructor, as used for manual trades, with string arguments
+    kwargs = [
+        {name: str(value) for name, value in trade.as_dict.items()}
+        for trade in map(TaxTrade.from_order_update, fills(scale))
+    ]
+    return lambda: kwargs, lambda k: [TaxTrade(**trade_kwargs) for trade_kwargs in k]
+
+
+def case_from_order_update(scale: int):
+    reports = fills(scale)
+    return lambda: reports, lambda r: [TaxTrade.from_order_update(e) for e in r]
+
+
+def case_as_dict(scale: int):
+    live_trades = [TaxTrade.from_order_update(event) for event in fills(scale)]
+    return lambda: live_trades, lambda trades: [trade.as_dict for trade in trades]
+
+
+def case_to_csv_line(scale: int):
+    live_trades = [TaxTrade.from_order_update(event) for event in fills(scale)]
+    return lambda: live_trades, lambda trades: [t.to_csv_line() for t in trades]
+
+
+def case_add_trade(scale: int):
+    live_trades = [TaxTrade.from_order_update(event) for event in fills(scale)]
+
+    def run(trade_store):
+        for trade in live_trades:
+            trade_store.add_trade(trade)
+
+    # Keep the checkpointer from flushing while the calls are being timed
+    return lambda: new_store(flush_count=scale + 1, flush_interval=3600), run
+
+
+def case_process_user_update(scale: int):
+    from binance_monitor.monitor import AccountMonitor
+    from binance_monitor.events import EventDecoder
+    from logbook import Logger
+
+    messages = generators.raw_messages(generators.execution_reports(scale))
+
+    def setup():
+        # A monitor without a client, since only the stream handling is timed
+        monitor = AccountMonitor.__new__(AccountMonitor)
+        monitor.log = Logger("bench")
+        monitor.decoder = EventDecoder()
+        monitor.trade_store = new_store(flush_count=scale + 1, flush_interval=3600)
+        monitor.cost_basis = None
+        return monitor
+
+    def run(monitor):
+        for message in messages:
+            monitor.process_user_update(message)
+
+    return setup, run
+
+
+CASES: Dict[str, Case] = {
+    "frame_from_historic_trades": case_frame_from_historic_trades,
+    "from_historic_trades": case_from_historic_trades,
+    "update": case_update,
+    "save": case_save,
+    "resync": case_resync,
+    "compact": case_compact,
+    "to_csv": case_to_csv,
+    "cost_basis": case_cost_basis,
+    "taxtrade_init": case_taxtrade_init,
+    "from_order_update": case_from_order_update,
+    "as_dict": case_as_dict,
+    "to_csv_line": case_to_csv_line,
+    "add_trade": case_add_trade,
+    "process_user_update": case_process_user_update,
+}
+
+
+def time_case(case: Case, scale: int, repeat: int = REPEAT) -> float:
+    """Best wall-clock time of *repeat* runs of *case* at *scale*"""
+
+    setup, run = case(scale)
+    best = float("inf")
+    for _ in range(repeat):
+        arg = setup()
+        start = time.perf_counter()
+        run(arg)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def load_baselines(path: str = BASELINE_FILE) -> Dict[str, float]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baselines(results: Dict[str, float], path: str = BASELINE_FILE) -> None:
+    baselines = load_baselines(path)
+    baselines.update(results)
+    with open(path, "w") as baseline_file:
+        json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write("\n")
+
+
+def compare(
+    name: str, seconds: float, baseline: Optional[float], threshold: float
+) -> bool:
+    """Print a result line, returning True if it is a regression"""
+
+    line = f"{name:>36}: {seconds:10.4f}s"
+    if baseline is None:
+        print(f"{line}  (no baseline)")
+        return False
+    change = seconds / baseline - 1
+    regressed = change > threshold
+    flag = "  REGRESSION" if regressed else ""
+    print(f"{line}  {change:+7.1%} vs {baseline:.4f}s{flag}")
+    return regressed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES)
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=None)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument(
+        "--save-baseline",
+        help=f"Record the results in {os.path.basename(BASELINE_FILE)}",
+        action="store_true",
+    )
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(BASELINE_FILE) and not args.save_baseline:
+        print(
+            f"No baselines in {BASELINE_FILE}, "
+            f"record them on this machine with --save-baseline",
+            file=sys.stderr,
+        )
+        return 2
+
+    baselines = load_baselines()
+    results: Dict[str, float] = {}
+    regressions = []
+
+    for case_name in args.cases or list(CASES):
+        for scale in args.scales:
+            name = f"{case_name}@{scale}"
+            try:
+                seconds = time_case(CASES[case_name], scale, args.repeat)
+            except ImportError as exc:
+                print(f"{name:>36}: skipped ({exc})")
+                break
+            results[name] = seconds
+            if compare(name, seconds, baselines.get(name), args.threshold):
+                regressions.append(name)
+
+    if args.save_baseline:
+        save_baselines(results)
+        print(f"Saved {len(results)} baselines to {BASELINE_FILE}")
+        return 0
+
+    missing = [name for name in results if name not in baselines]
+    if missing:
+        print(f"No baseline for {len(missing)} cases: {', '.join(missing)}")
+    if regressions:
+        print(f"{len(regressions)} regressions beyond {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+"""Keep benchmark data out of the user's ~/.binance-monitor folder"""
+import atexit
+import os
+import shutil
+import tempfile
+
+from binance_monitor import settings, store
+
+
+def use_scratch_folder() -> str:
+    """Redirect stores, preferences and the exchange info cache to a temp folder
+
+    The folder is removed at exit, after every store has saved
+
+    :return: path of the folder
+    """
+
+    scratch = tempfile.mkdtemp(prefix="binance-monitor-bench-")
+    # Registered before any store, so that it runs after every store has saved
+    atexit.register(shutil.rmtree, scratch, True)
+    store.ACCOUNT_STORE_FOLDER = os.path.join(scratch, "account_data")
+    settings.EXCHANGE_INFO_CACHE = os.path.join(scratch, "exchange_info.json.gz")
+    settings._preferences = settings.Preferences(os.path.join(scratch, "prefs.toml"))
+    return scratch
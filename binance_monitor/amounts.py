@@ -0,0 +1,173 @@
+# MIT License
+#
+# Copyright (C) 2019 Anson VanDoren
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+# to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next paragraph) shall
+# be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Exact fixed-point amounts
+
+Trade amounts are stored as int64 counts of the smallest unit of their asset, e.g.
+satoshis for BTC, so that sums and totals are exact and still vectorized. The number
+of decimal places (scale) of each asset comes from exchangeInfo, and is fixed once
+an asset is first stored. Amounts only become Decimal again when exported.
+"""
+from decimal import ROUND_HALF_EVEN, Decimal
+from typing import Iterable, List, Mapping, Optional
+
+import numpy as np
+import pandas as pd
+
+# Scale of an asset for which exchangeInfo gives no precision
+DEFAULT_SCALE = 8
+
+# Larger scales would leave an int64 room for fewer than 9,223,372 whole units
+MAX_SCALE = 12
+
+# Below this many units, a float differs from the exact amount by under half a unit
+EXACT_FLOAT_UNITS = 2.0**51
+
+# Column holding the currency of each amount column
+CURRENCY_OF = {
+    "buy_amount": "buy_currency",
+    "sell_amount": "sell_currency",
+    "fee_amount": "fee_currency",
+}
+AMOUNT_COLS = list(CURRENCY_OF)
+
+
+class AssetScales(dict):
+    """Decimal places stored for each asset. Looking up an asset not seen before
+    fixes its scale at its exchange precision (or *DEFAULT_SCALE*)
+    """
+
+    def __init__(
+        self,
+        scales: Optional[Mapping[str, int]] = None,
+        precisions: Optional[Mapping[str, int]] = None,
+    ):
+        """
+        :param scales: scales already in use, e.g. loaded from a store
+        :param precisions: decimal places of each asset, see
+            `exchange.Exchange.asset_precisions`
+        """
+
+        super().__init__({asset: int(scale) for asset, scale in (scales or {}).items()})
+        self.precisions = precisions or {}
+
+    def __missing__(self, asset: str) -> int:
+        scale = min(int(self.precisions.get(asset, DEFAULT_SCALE)), MAX_SCALE)
+        self[asset] = scale
+        return scale
+
+    def of(self, currencies: pd.Series) -> np.ndarray:
+        """Scale of each currency in *currencies*"""
+
+        lookup = {currency: self[currency] for currency in pd.unique(currencies)}
+        return pd.Series(currencies).map(lookup).values.astype(np.int64)
+
+
+def to_units(values: Iterable, scales: Iterable[int]) -> np.ndarray:
+    """Convert amounts to int64 units, exactly
+
+    :param values: amounts as strings, Decimals or anything Decimal accepts. Digits
+        beyond the scale are rounded half to even
+    :param scales: scale of each amount
+    :return: array of units
+    """
+
+    return np.array(
+        [
+            int(Decimal(value).scaleb(scale).to_integral_value(ROUND_HALF_EVEN))
+            for value, scale in zip(values, map(int, scales))
+        ],
+        dtype=np.int64,
+    )
+
+
+def strings_to_units(values: pd.Series, scales: np.ndarray) -> np.ndarray:
+    """Vectorized `to_units` for decimal strings such as the API returns
+
+    A string with no more decimal places than its scale is parsed as a float and
+    rounded, which is exact while the float error stays below half a unit. Other
+    strings go through `to_units`
+    """
+
+    strings = pd.Series(values, dtype=object).reset_index(drop=True)
+    chars = strings.values.astype("U")
+    point = np.char.find(chars, ".")
+    places = np.where(point < 0, 0, np.char.str_len(chars) - point - 1)
+    units = np.rint(strings.values.astype(float) * 10.0**scales)
+
+    exact = (places <= scales) & (np.abs(units) < EXACT_FLOAT_UNITS)
+    result = units.astype(np.int64)
+    if not exact.all():
+        inexact = ~exact
+        result[inexact] = to_units(strings[inexact], scales[inexact])
+    return result
+
+
+def to_strings(units: Iterable[int], scales: Iterable[int]) -> List[str]:
+    """Format units as exact decimal strings with *scale* decimal places"""
+
+    strings = []
+    for unit, scale in zip(map(int, units), map(int, scales)):
+        whole, fraction = divmod(abs(unit), 10**scale)
+        sign = "-" if unit < 0 else ""
+        strings.append(
+            f"{sign}{whole}.{fraction:0{scale}d}" if scale else f"{sign}{whole}"
+        )
+    return strings
+
+
+def frame_to_units(frame: pd.DataFrame, scales: AssetScales) -> pd.DataFrame:
+    """Convert the amount columns of a trade frame to units in place
+
+    Integer columns are taken to be units already. Float columns, as written by
+    versions before amounts were stored as units, are rounded to the nearest unit
+
+    :return: *frame*
+    """
+
+    for col, currency_col in CURRENCY_OF.items():
+        values = frame[col]
+        if pd.api.types.is_integer_dtype(values):
+            continue
+        col_scales = scales.of(frame[currency_col])
+        if pd.api.types.is_float_dtype(values):
+            frame[col] = np.rint(values.values * 10.0**col_scales).astype(np.int64)
+        else:
+            frame[col] = to_units(values, col_scales)
+    return frame
+
+
+def frame_to_strings(frame: pd.DataFrame, scales: AssetScales) -> pd.DataFrame:
+    """Copy of a trade frame with amounts as exact decimal strings, e.g. for CSV"""
+
+    frame = frame.copy()
+    for col, currency_col in CURRENCY_OF.items():
+        frame[col] = to_strings(frame[col], scales.of(frame[currency_col]))
+    return frame
+
+
+def frame_to_decimals(frame: pd.DataFrame, scales: AssetScales) -> pd.DataFrame:
+    """Copy of a trade frame with amounts as Decimal objects"""
+
+    frame = frame_to_strings(frame, scales)
+    for col in AMOUNT_COLS:
+        frame[col] = [Decimal(value) for value in frame[col]]
+    return frame
@@ -1,15 +1,72 @@
+from typing import Dict, Iterable
+
+
 class Symbol:
-    QUOTE_ASSETS = ["BTC", "ETH", "USDT", "TUSD", "PAX", "BNB"]
-
-    def __init__(self, symbol: str):
-        for quote in self.QUOTE_ASSETS:
-            quote_start = symbol.find(quote)
-            if len(symbol) == quote_start + len(quote):  # Quote asset is right-most
-                self.base = symbol[:quote_start]
-                self.quote = symbol[quote_start:]
-                return
+    """Immutable symbol pair such as ETHBTC, split into *base* and *quote* assets
+
+    Instances are interned: constructing the same symbol twice returns the same
+    object from a registry loaded from exchangeInfo with `Symbol.load`. Symbols not
+    in the registry are split using *QUOTE_ASSETS* and then registered
+    """
+
+    __slots__ = ("name", "base", "quote")
+
+    # Only used for symbols missing from exchangeInfo
+    QUOTE_ASSETS = ["BTC", "ETH", "USDT", "TUSD", "PAX", "BNB", "USDC", "USDS"]
+
+    _registry: Dict[str, "Symbol"] = {}
+
+    def __new__(cls, symbol: str):
+        try:
+            return cls._registry[symbol]
+        except KeyError:
+            pass
+
+        for quote in cls.QUOTE_ASSETS:
+            if symbol.endswith(quote) and len(symbol) > len(quote):
+                return cls._registry.setdefault(
+                    symbol, cls._create(symbol, symbol[: -len(quote)], quote)
+                )
         raise KeyError(f"Could not find a quote asset for '{symbol}'")
 
+    @classmethod
+    def _create(cls, name: str, base: str, quote: str) -> "Symbol":
+        instance = object.__new__(cls)
+        object.__setattr__(instance, "name", name)
+        object.__setattr__(instance, "base", base)
+        object.__setattr__(instance, "quote", quote)
+        return instance
+
+    @classmethod
+    def load(cls, exchange_symbols: Iterable[Dict]) -> None:
+        """Register every symbol in the `symbols` list of exchangeInfo
+
+        :param exchange_symbols: dicts with `symbol`, `baseAsset` and `quoteAsset`
+        :return: None
+        """
+
+        registry = dict(cls._registry)
+        for info in exchange_symbols:
+            registry[info["symbol"]] = cls._create(
+                info["symbol"], info["baseAsset"], info["quoteAsset"]
+            )
+        cls._registry = registry
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Symbol is immutable")
+
+    def __eq__(self, other):
+        return isinstance(other, Symbol) and self.name == other.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return f"Symbol({self.name!r}, base={self.base!r}, quote={self.quote!r})"
+
 
 class Asset:
     def __init__(self, api_asset: dict):
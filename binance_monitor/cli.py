@@ -20,22 +20,37 @@
 
 """CLI argument parsing for Binance Monitor"""
 import argparse
+import atexit
 import sys
-import time
 
 import logbook
-from twisted.internet import reactor
-
-from binance_monitor import monitor, settings, util
+from logbook.queues import ThreadedWrapperHandler
+
+from binance_monitor import (
+    costbasis,
+    metrics,
+    monitor,
+    profiling,
+    settings,
+    supervisor,
+    util,
+)
 from binance_monitor.settings import LOG_FILENAME
 from binance_monitor.util import is_yes_response
 
 
 def main():
-    # Set up logging for the whole app
+    # Set up logging for the whole app. Records are written from background threads
+    # so that the socket thread never waits on the console or the log file
     util.ensure_dir(LOG_FILENAME)
-    logbook.TimedRotatingFileHandler(LOG_FILENAME, bubble=True).push_application()
-    logbook.StreamHandler(sys.stdout, level="NOTICE", bubble=True).push_application()
+    for handler in [
+        logbook.TimedRotatingFileHandler(LOG_FILENAME, bubble=True),
+        logbook.StreamHandler(sys.stdout, level="NOTICE", bubble=True),
+    ]:
+        sink = ThreadedWrapperHandler(handler)
+        sink.push_application()
+        # Drain queued records before exit
+        atexit.register(sink.close)
     log = logbook.Logger(__name__.split(".", 1)[-1])
 
     log.info("*" * 80)
@@ -53,18 +68,99 @@ def main():
         help="Update trades for all symbols, regardless of blacklist",
         action="store_true",
     )
+    parser.add_argument(
+        "--rebuild",
+        help="With --update, re-download full history instead of only new trades",
+        action="store_true",
+    )
     parser.add_argument("--listen", help="Listen for new trades", action="store_true")
+    parser.add_argument(
+        "--cost-basis",
+        help="Report open lots and realized profit by lot matching METHOD (default "
+        "FIFO), and with --listen keep them current as trades arrive",
+        nargs="?",
+        const="FIFO",
+        type=str.upper,
+        choices=costbasis.METHODS,
+        metavar="METHOD",
+    )
     parser.add_argument("--blacklist", help="Add symbol(s) to blacklist", nargs="*")
     parser.add_argument(
         "--whitelist", help="Remove symbol(s) from blacklist", nargs="*"
     )
+    parser.add_argument(
+        "--compact",
+        help="Rewrite the trade cache sorted and de-duplicated to reclaim space",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--migrate-parquet",
+        help="Copy the trade cache into a Parquet dataset and use that from now on",
+        action="store_true",
+    )
     parser.add_argument(
         "--csv", help="Write out CSV file of trades (from cache)", action="store_true"
     )
+    export = parser.add_argument_group("CSV export options")
+    export.add_argument("--symbols", help="Only export these symbols", nargs="+")
+    export.add_argument("--since", help="Only export trades from this time on")
+    export.add_argument("--until", help="Only export trades before this time")
+    export.add_argument("--gzip", help="Compress the CSV file", action="store_true")
+    export.add_argument(
+        "--incremental",
+        help="Append trades newer than the last export instead of rewriting the file",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="Serve runtime metrics on localhost:PORT/metrics and log a summary "
+        f"every {metrics.SUMMARY_INTERVAL:.0f}s (default port {metrics.PORT})",
+        nargs="?",
+        const=metrics.PORT,
+        type=int,
+        metavar="PORT",
+    )
+    parser.add_argument(
+        "--accounts",
+        help="Monitor the named credential profiles (all profiles if none are named)",
+        nargs="*",
+    )
+    parser.add_argument(
+        "--profile",
+        help="Report the time spent in each phase at exit, and with FILE also write "
+        "cProfile stats there (for pstats, snakeviz or flameprof)",
+        nargs="?",
+        const="",
+        metavar="FILE",
+    )
 
     args = parser.parse_args()
 
-    acct_monitor = monitor.AccountMonitor()
+    if args.profile is not None:
+        profiling.enable()
+        if args.profile:
+            profiling.start_cprofile(args.profile)
+        # Registered after the log sinks, so it runs before they are closed
+        atexit.register(profiling.finish)
+
+    if args.metrics is not None:
+        metrics.serve(args.metrics)
+        metrics.log_periodically()
+
+    if args.accounts is not None:
+        acct_monitor = supervisor.Supervisor(args.accounts or None)
+        monitors = list(acct_monitor.monitors.values())
+    else:
+        acct_monitor = monitor.AccountMonitor()
+        monitors = [acct_monitor]
+
+    if args.migrate_parquet:
+        from binance_monitor import parquet_store
+
+        for acct in monitors:
+            acct.trade_store.close()
+            acct.trade_store = parquet_store.migrate(acct.name)
+        settings.set_store_backend("parquet")
 
     blacklist_from_cli(args.blacklist or None)
     whitelist_from_cli(args.whitelist or None)
@@ -72,24 +168,39 @@ def main():
     force_all = True if args.force else False
 
     if args.update:
-        acct_monitor.get_all_trades(force_all=force_all)
-        acct_monitor.trade_store.save()
+        for acct in monitors:
+            acct.get_all_trades(force_all=force_all, full=args.rebuild)
+            acct.trade_store.save()
+
+    if args.cost_basis:
+        for acct in monitors:
+            acct.cost_basis = costbasis.CostBasis(acct.trade_store, args.cost_basis)
+            # A full re-download may add trades older than those already booked
+            if args.update and args.rebuild:
+                acct.cost_basis.rebuild()
+            else:
+                acct.cost_basis.catch_up()
+            summary = acct.cost_basis.summary().to_string(index=False)
+            log.notice(f"Cost basis of {acct.name} by {args.cost_basis}:\n{summary}")
 
     if args.listen:
-        acct_monitor.start_user_monitor()
-
-        while True:
-            try:
-                time.sleep(60 * 60 * 24)
-            except KeyboardInterrupt:
-                print("\nExit requested...")
-                break
-
-    if args.csv:
-        acct_monitor.trade_store.to_csv()
-
-    if reactor.running:
-        reactor.callFromThread(reactor.stop)
+        if isinstance(acct_monitor, supervisor.Supervisor):
+            acct_monitor.run()
+        else:
+            acct_monitor.run_user_monitor()
+
+    for acct in monitors:
+        if args.compact:
+            acct.trade_store.compact()
+
+        if args.csv:
+            acct.trade_store.to_csv(
+                symbol=args.symbols,
+                start=args.since,
+                end=args.until,
+                compress=args.gzip,
+                incremental=args.incremental,
+            )
 
 
 def blacklist_from_cli(blacklist):
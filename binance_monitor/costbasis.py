@@ -0,0 +1,507 @@
+# MIT License
+#
+# Copyright (C) 2019 Anson VanDoren
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+# to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next paragraph) shall
+# be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Cost basis and realized profit and loss by lot matching (FIFO, LIFO or HIFO)
+
+Each market (symbol) is booked separately: buys open lots of the base asset at a
+cost in the quote asset, and sells close lots, realizing proceeds minus the cost of
+the lots matched. Lots are matched oldest first (FIFO), newest first (LIFO) or
+highest unit cost first (HIFO). Fees paid in the base or quote asset adjust the
+quantity, cost or proceeds; fees paid in another asset (e.g. BNB) are not included.
+Sells of more than is held in a market (e.g. of deposits, or of coins bought in
+another market) are counted as *unmatched*, and only the matched part of the
+proceeds is realized.
+
+`CostBasis.rebuild` books the whole store, with FIFO vectorized over each symbol.
+LIFO and HIFO are booked one trade at a time, as the lots a sale closes depend on
+every sale before it. The open lots are then saved, and trades added later are booked one at a time by
+`CostBasis.add` (amortized O(1) for FIFO/LIFO, O(log lots) for HIFO) or
+`CostBasis.catch_up`. Trades older than the last one booked cannot be booked in
+order that way, e.g. a fill recovered by `reconcile` after a later one was seen on
+the user data stream, so `catch_up` books the whole store again when it holds any
+that are not in the books.
+
+All quantities are int64 units of the store's `scales`, see `amounts`.
+"""
+import atexit
+import heapq
+import json
+import os
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+from logbook import Logger
+
+from binance_monitor import amounts
+from binance_monitor.store import KEY_COL, SYMBOL_COL, TradeStore
+from binance_monitor.trade import TaxTrade
+
+METHODS = ["FIFO", "LIFO", "HIFO"]
+
+# A lot is [time (ns since Epoch), quantity, cost, quantity used], in units. The cost
+# of the first n units used is cost * n // quantity, however many sales they took
+Lot = List[int]
+
+
+class Book:
+    """Open lots of one market, matched by one of *METHODS*"""
+
+    def __init__(self, method: str, base: str, quote: str):
+        self.method = method
+        self.base = base
+        self.quote = quote
+        self.realized = 0
+        self.unmatched = 0
+        # FIFO takes from the left of a deque and LIFO from the end of a list. HIFO
+        # keeps a heap of (-unit cost, sequence number, lot)
+        self._lots = deque() if method == "FIFO" else []
+        self._count = 0
+
+    def acquire(self, time_ns: int, qty: int, cost: int, used: int = 0) -> None:
+        if qty <= used:
+            return
+        lot = [time_ns, qty, cost, used]
+        if self.method == "HIFO":
+            self._count += 1
+            heapq.heappush(self._lots, (-cost / qty, self._count, lot))
+        else:
+            self._lots.append(lot)
+
+    def _next_lot(self) -> Lot:
+        if self.method == "FIFO":
+            return self._lots[0]
+        if self.method == "LIFO":
+            return self._lots[-1]
+        return self._lots[0][2]
+
+    def _drop_lot(self) -> None:
+        if self.method == "FIFO":
+            self._lots.popleft()
+        elif self.method == "LIFO":
+            self._lots.pop()
+        else:
+            heapq.heappop(self._lots)
+
+    def dispose(self, qty: int, proceeds: int) -> int:
+        """Close lots for a sale of *qty* units, returning the profit realized"""
+
+        remaining = qty
+        cost = 0
+        while remaining > 0 and self._lots:
+            lot_time, lot_qty, lot_cost, used = lot = self._next_lot()
+            take = min(remaining, lot_qty - used)
+            # Python ints, so the products cannot overflow
+            cost += lot_cost * (used + take) // lot_qty - lot_cost * used // lot_qty
+            lot[3] += take
+            remaining -= take
+            if lot[3] == lot_qty:
+                self._drop_lot()
+
+        if remaining and qty:
+            self.unmatched += remaining
+            proceeds = proceeds * (qty - remaining) // qty
+        profit = proceeds - cost
+        self.realized += profit
+        return profit
+
+    @property
+    def lots(self) -> List[Lot]:
+        """Open lots, oldest first"""
+
+        if self.method == "HIFO":
+            return sorted((entry[2] for entry in self._lots), key=lambda lot: lot[0])
+        return list(self._lots)
+
+    def open_position(self) -> Tuple[int, int]:
+        """Total quantity and cost of what is left of the open lots"""
+
+        qty = cost = 0
+        for _, lot_qty, lot_cost, used in self.lots:
+            qty += lot_qty - used
+            cost += lot_cost - lot_cost * used // lot_qty
+        return qty, cost
+
+    def to_dict(self) -> Dict:
+        return {
+            "base": self.base,
+            "quote": self.quote,
+            "realized": self.realized,
+            "unmatched": self.unmatched,
+            "lots": self.lots,
+        }
+
+    @classmethod
+    def from_dict(cls, method: str, state: Dict) -> "Book":
+        book = cls(method, state["base"], state["quote"])
+        book.realized = int(state["realized"])
+        book.unmatched = int(state["unmatched"])
+        for lot in state["lots"]:
+            book.acquire(*(int(value) for value in lot))
+        return book
+
+
+class CostBasis:
+    log = Logger(__name__.split(".", 1)[-1])
+
+    def __init__(self, trade_store: TradeStore, method: str = "FIFO"):
+        """Cost basis of the trades in *trade_store*, loading any saved lots
+
+        :param trade_store: store of the account's trades
+        :param method: one of *METHODS*
+        """
+
+        method = method.upper()
+        if method not in METHODS:
+            raise ValueError(f"method must be one of {METHODS}: {method}")
+        self.method = method
+        self.store = trade_store
+        self.path = (
+            os.path.splitext(trade_store.file_path)[0] + f".{method.lower()}.lots.json"
+        )
+        self.books: Dict[str, Book] = {}
+        # Time of the latest trade booked, and the keys of the trades at that time
+        self._watermark: Optional[pd.Timestamp] = None
+        self._watermark_keys: Set[str] = set()
+        # Number of trades booked, to tell whether the store holds any others
+        self._booked = 0
+        # Live trades are booked on the event loop, reconciled ones from a worker
+        self._lock = threading.RLock()
+        self._load()
+        atexit.register(self.save)
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r") as lots_file:
+                state = json.load(lots_file)
+        except (IOError, ValueError):
+            self.log.info(f"No saved lots in {self.path}")
+            return
+        self.books = {
+            symbol: Book.from_dict(self.method, book)
+            for symbol, book in state["books"].items()
+        }
+        if state["watermark"] is not None:
+            self._watermark = pd.Timestamp(state["watermark"])
+            self._watermark_keys = set(state["watermark_keys"])
+        self._booked = int(state.get("booked", 0))
+
+    def save(self) -> None:
+        """Write the open lots and realized totals"""
+
+        with self._lock:
+            watermark = self._watermark
+            state = {
+                "method": self.method,
+                "watermark": None if watermark is None else watermark.isoformat(),
+                "watermark_keys": sorted(self._watermark_keys),
+                "booked": self._booked,
+                "books": {
+                    symbol: book.to_dict() for symbol, book in self.books.items()
+                },
+            }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as lots_file:
+            # `json.dump` encodes in pure Python, `dumps` in C
+            lots_file.write(json.dumps(state))
+        os.replace(tmp_path, self.path)
+
+    def rebuild(self) -> int:
+        """Book every trade in the store from scratch
+
+        :return: number of trades booked
+        """
+
+        trades = self.store.query()
+        with self._lock:
+            self.books = {}
+            self._watermark, self._watermark_keys = None, set()
+            self._booked = 0
+            self._book_frame(trades, vectorized=True)
+        self.save()
+        self.log.notice(
+            f"Booked {len(trades)} trades in {len(self.books)} symbols by {self.method}"
+        )
+        return len(trades)
+
+    def catch_up(self) -> int:
+        """Book the trades stored since the last one booked
+
+        If no lots have been saved yet, or trades older than the last one booked
+        have been stored since, the whole store is booked instead
+
+        :return: number of trades booked
+        """
+
+        if self._watermark is None:
+            return self.rebuild()
+        with self._lock:
+            trades = self.store.query(start=self._watermark)
+            trades = trades[~trades[KEY_COL].isin(self._watermark_keys)]
+            unbooked = self.store.trade_count - self._booked - len(trades)
+            if unbooked > 0:
+                self.log.notice(
+                    f"{unbooked} trades older than the last booked were stored, "
+                    f"booking all trades again"
+                )
+                return self.rebuild()
+            self._book_frame(trades, vectorized=False)
+        self.save()
+        return len(trades)
+
+    def add(self, trade: TaxTrade) -> int:
+        """Book a single new trade, e.g. from the user data stream
+
+        :return: profit realized by the trade, in units of its quote asset
+        """
+
+        key = trade.key
+        scales = self.store.scales
+        is_buy = "BUY" in trade.kind.upper()
+        base, quote = (
+            (trade.buycur, trade.sellcur) if is_buy else (trade.sellcur, trade.buycur)
+        )
+        base_amount, quote_amount = (
+            (trade.buyval, trade.sellval) if is_buy else (trade.sellval, trade.buyval)
+        )
+        base_units, quote_units, fee_units = amounts.to_units(
+            [base_amount, quote_amount, trade.feeval],
+            [scales[base], scales[quote], scales[trade.feecur]],
+        ).tolist()
+        qty, value = _with_fee(
+            is_buy, base_units, quote_units, trade.feecur, fee_units, base, quote
+        )
+
+        with self._lock:
+            if key in self._watermark_keys or (
+                self._watermark is not None and trade.dtime < self._watermark
+            ):
+                self.log.info(
+                    f"Trade {key} is older than the last booked, see catch_up"
+                )
+                return 0
+            profit = self._book(
+                trade.symbol,
+                base,
+                quote,
+                is_buy,
+                trade.dtime.value,
+                int(qty),
+                int(value),
+            )
+            self._advance_watermark(trade.dtime, {key})
+            self._booked += 1
+
+        if not is_buy:
+            realized = _to_string(profit, scales[quote])
+            self.log.notice(f"Realized {realized} {quote} on {trade.symbol}")
+        return profit
+
+    def _book(
+        self,
+        symbol: str,
+        base: str,
+        quote: str,
+        is_buy: bool,
+        time_ns: int,
+        qty: int,
+        value: int,
+    ) -> int:
+        book = self.books.get(symbol)
+        if book is None:
+            book = self.books[symbol] = Book(self.method, base, quote)
+        if is_buy:
+            book.acquire(time_ns, qty, value)
+            return 0
+        return book.dispose(qty, value)
+
+    def _advance_watermark(self, dtime: pd.Timestamp, keys: Set[str]) -> None:
+        if self._watermark is None or dtime > self._watermark:
+            self._watermark, self._watermark_keys = dtime, set(keys)
+        elif dtime == self._watermark:
+            self._watermark_keys |= keys
+
+    def _book_frame(self, trades: pd.DataFrame, vectorized: bool) -> None:
+        """Book a frame of stored trades in time order"""
+
+        if trades.empty:
+            return
+        trades = trades.sort_values("dtime", kind="mergesort")
+        if SYMBOL_COL not in trades:
+            trades = trades.assign(**{SYMBOL_COL: TaxTrade.symbols_for(trades)})
+
+        is_buy = trades["kind"].astype(str).str.upper().str.contains("BUY").values
+        buy_cur = trades["buy_currency"].astype(object).values
+        sell_cur = trades["sell_currency"].astype(object).values
+        base = np.where(is_buy, buy_cur, sell_cur)
+        quote = np.where(is_buy, sell_cur, buy_cur)
+        buy_amount = trades["buy_amount"].values.astype(np.int64)
+        sell_amount = trades["sell_amount"].values.astype(np.int64)
+        qty, value = _with_fee(
+            is_buy,
+            np.where(is_buy, buy_amount, sell_amount),
+            np.where(is_buy, sell_amount, buy_amount),
+            trades["fee_currency"].astype(object).values,
+            trades["fee_amount"].values.astype(np.int64),
+            base,
+            quote,
+        )
+        times = trades["dtime"].values.astype("datetime64[ns]").astype(np.int64)
+        symbols = trades[SYMBOL_COL].astype(object).values
+
+        for symbol in pd.unique(symbols):
+            rows = np.flatnonzero(symbols == symbol)
+            if vectorized and self.method == "FIFO" and symbol not in self.books:
+                first = rows[0]
+                self._fifo(
+                    symbol,
+                    base[first],
+                    quote[first],
+                    is_buy[rows],
+                    times[rows],
+                    qty[rows],
+                    value[rows],
+                )
+                continue
+            for row in rows:
+                self._book(
+                    symbol,
+                    base[row],
+                    quote[row],
+                    bool(is_buy[row]),
+                    int(times[row]),
+                    int(qty[row]),
+                    int(value[row]),
+                )
+
+        latest = trades["dtime"].iloc[-1]
+        at_latest = trades.loc[trades["dtime"] == latest, KEY_COL]
+        self._advance_watermark(latest, set(at_latest))
+        self._booked += len(trades)
+
+    def _fifo(
+        self,
+        symbol: str,
+        base: str,
+        quote: str,
+        is_buy: np.ndarray,
+        times: np.ndarray,
+        qty: np.ndarray,
+        value: np.ndarray,
+    ) -> None:
+        """Book the time-ordered trades of one symbol by FIFO without a loop
+
+        The position never goes below zero: what a sale takes beyond it is unmatched,
+        so the total unmatched is the deepest the unclamped running position has
+        gone below zero. Sales use lots strictly in order, so with the cumulative
+        sums of lot quantities the lot holding the last unit used by each sale is
+        found with `searchsorted`, as in `Book.dispose`.
+        """
+
+        buys = np.flatnonzero(is_buy & (qty > 0))
+        sells = np.flatnonzero(~is_buy)
+        position = np.cumsum(np.where(is_buy, np.maximum(qty, 0), -qty))
+        unmatched = np.maximum(0, -np.minimum.accumulate(position))
+        # Units used from the lots, in total, by the end of each sale
+        used = np.cumsum(qty[sells]) - unmatched[sells]
+        bought = np.concatenate([[0], np.cumsum(qty[buys])])
+        spent = np.concatenate([[0], np.cumsum(value[buys])])
+
+        def cost_of_first(units: int) -> int:
+            lot = min(int(np.searchsorted(bought, units, side="left")), len(buys))
+            if lot == 0:
+                return 0
+            row = buys[lot - 1]
+            into = units - int(bought[lot - 1])
+            return int(spent[lot - 1]) + int(value[row]) * into // int(qty[row])
+
+        book = Book("FIFO", base, quote)
+        self.books[symbol] = book
+        total_used = int(used[-1]) if len(sells) else 0
+        book.unmatched = int(unmatched[-1]) if len(sells) else 0
+
+        # Proceeds of sales which were partly unmatched are cut to the matched part
+        proceeds = value[sells].astype(object)
+        shortfalls = np.diff(np.concatenate([[0], unmatched[sells]]))
+        for sale in np.flatnonzero(shortfalls):
+            sale_qty = int(qty[sells][sale])
+            matched = sale_qty - int(shortfalls[sale])
+            proceeds[sale] = proceeds[sale] * matched // sale_qty
+        book.realized = int(proceeds.sum()) - cost_of_first(total_used)
+
+        first_open = int(np.searchsorted(bought[1:], total_used, side="right"))
+        for lot in range(first_open, len(buys)):
+            row = buys[lot]
+            lot_used = max(0, total_used - int(bought[lot]))
+            book.acquire(int(times[row]), int(qty[row]), int(value[row]), lot_used)
+
+    def summary(self) -> pd.DataFrame:
+        """Open position, realized profit and unmatched sales of each symbol, as
+        decimal strings in the base (quantities) or quote (cost, profit) asset
+        """
+
+        scales = self.store.scales
+        rows = []
+        for symbol, book in sorted(self.books.items()):
+            open_qty, open_cost = book.open_position()
+            base_scale, quote_scale = scales[book.base], scales[book.quote]
+            rows.append(
+                {
+                    "symbol": symbol,
+                    "base": book.base,
+                    "quote": book.quote,
+                    "open_qty": _to_string(open_qty, base_scale),
+                    "open_cost": _to_string(open_cost, quote_scale),
+                    "realized": _to_string(book.realized, quote_scale),
+                    "unmatched": _to_string(book.unmatched, base_scale),
+                }
+            )
+        return pd.DataFrame(
+            rows,
+            columns=[
+                "symbol",
+                "base",
+                "quote",
+                "open_qty",
+                "open_cost",
+                "realized",
+                "unmatched",
+            ],
+        )
+
+
+def _with_fee(is_buy, base_units, quote_units, fee_currency, fee_units, base, quote):
+    """Quantity of base and cost (buys) or proceeds (sells) in quote, after fees
+
+    Works on scalars or arrays
+    """
+
+    fee_in_base = np.where(fee_currency == base, fee_units, 0)
+    fee_in_quote = np.where(fee_currency == quote, fee_units, 0)
+    qty = np.where(is_buy, base_units - fee_in_base, base_units + fee_in_base)
+    value = np.where(is_buy, quote_units + fee_in_quote, quote_units - fee_in_quote)
+    return qty, value
+
+
+def _to_string(units: int, scale: int) -> str:
+    return amounts.to_strings([units], [scale])[0]
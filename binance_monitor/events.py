@@ -0,0 +1,184 @@
+# MIT License
+#
+# Copyright (C) 2019 Anson VanDoren
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+# to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next paragraph) shall
+# be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Decoding of user data stream events
+
+Each message is decoded once by an `EventDecoder`, which looks up the handler for its
+event type and lets the handler reject messages it has no use for (e.g. execution
+reports for new or cancelled orders) before any event object is created.
+"""
+import json
+from typing import Callable, Dict, Optional, Type, Union
+
+from logbook import Logger
+
+from binance_monitor.base import Asset
+from binance_monitor.trade import TaxTrade
+
+# Use a faster JSON parser if one is installed
+try:
+    import orjson
+
+    loads: Callable = orjson.loads
+except ImportError:
+    try:
+        import ujson
+
+        loads = ujson.loads
+    except ImportError:
+        loads = json.loads
+
+log = Logger(__name__.split(".", 1)[-1])
+
+# Execution report order statuses that carry a fill
+TRADE_STATUSES = frozenset(["PARTIALLY_FILLED", "FILLED"])
+
+
+class EventUpdate:
+    def __init__(self, api_payload: Dict):
+        if not isinstance(api_payload, dict):
+            raise ValueError(
+                f"EventUpdate expected as a dict but got {type(api_payload)}"
+            )
+        self.payload = api_payload
+        self.event_timestamp = int(api_payload["E"])
+        self.event_type = self.__class__.__name__
+
+    @staticmethod
+    def accepts(api_payload: Dict) -> bool:
+        """Cheap check of a raw payload, before an event object is created for it"""
+
+        return True
+
+    @staticmethod
+    def create(api_payload: Dict) -> Optional["EventUpdate"]:
+        """Create the event for a payload, or None if its event type is not handled"""
+
+        handler = EVENT_TYPES.get(api_payload.get("e"))
+        return None if handler is None else handler(api_payload)
+
+
+class AccountUpdate(EventUpdate):
+    def __init__(self, api_payload: Dict):
+        super().__init__(api_payload)
+
+        self.last_updated_timestamp = int(api_payload["u"])
+        self.balances = [Asset(asset) for asset in api_payload["B"]]
+
+
+class OrderUpdate(EventUpdate):
+    def __init__(self, api_payload: Dict, is_trade_event: Optional[bool] = None):
+        """Order execution report
+
+        :param api_payload: decoded executionReport event
+        :param is_trade_event: result of `accepts` for *api_payload*, if already
+            known (optional)
+        """
+
+        super().__init__(api_payload)
+
+        self.symbol = api_payload["s"]
+        self.is_trade_event = (
+            self.accepts(api_payload) if is_trade_event is None else is_trade_event
+        )
+        log.debug(
+            f"OrderUpdate: executionType={api_payload['x']}\t"
+            f"executionStatus={api_payload['X']}"
+        )
+
+    @staticmethod
+    def accepts(api_payload: Dict) -> bool:
+        """Whether the execution report is for a trade (a partial or complete fill)
+
+        String fields are compared first, so that most non-trade reports are
+        rejected without parsing any numbers
+        """
+
+        return (
+            api_payload["x"] == "TRADE"
+            and api_payload["X"] in TRADE_STATUSES
+            and api_payload["t"] != -1
+            and float(api_payload["l"]) > 0
+            and float(api_payload["L"]) > 0
+        )
+
+    @property
+    def trade(self) -> TaxTrade:
+        if not self.is_trade_event:
+            raise AttributeError("This order update is not a trade event")
+
+        return TaxTrade.from_order_update(self.payload)
+
+
+# Handlers for each event type ("e" field) of the user data stream
+EVENT_TYPES: Dict[str, Type[EventUpdate]] = {
+    "outboundAccountInfo": AccountUpdate,
+    "executionReport": OrderUpdate,
+}
+
+
+class EventDecoder:
+    """Turn raw user data stream messages into events
+
+    Only execution reports for trades are decoded into `OrderUpdate` by default;
+    other handled event types are passed through their handler's `accepts` check.
+    Messages that are rejected or of an unknown type decode to None.
+    """
+
+    def __init__(self, handlers: Optional[Dict[str, Type[EventUpdate]]] = None):
+        self.handlers: Dict[str, Type[EventUpdate]] = dict(
+            EVENT_TYPES if handlers is None else handlers
+        )
+        self.stats = {"decoded": 0, "rejected": 0, "unknown": 0}
+
+    def register(self, event_type: str, handler: Type[EventUpdate]) -> None:
+        """Handle events of *event_type* with *handler*, replacing any existing one
+
+        :param event_type: value of the "e" field, e.g. "executionReport"
+        :param handler: EventUpdate subclass
+        :return: None
+        """
+
+        self.handlers[event_type] = handler
+
+    def decode(self, message: Union[str, bytes, Dict]) -> Optional[EventUpdate]:
+        """Decode a single message
+
+        :param message: raw JSON text, or an already decoded payload
+        :return: the event, or None if the message was rejected or is not handled
+        """
+
+        payload = message if isinstance(message, dict) else loads(message)
+
+        handler = self.handlers.get(payload.get("e"))
+        if handler is None:
+            self.stats["unknown"] += 1
+            log.debug(f"Ignoring unhandled event type {payload.get('e')}")
+            return None
+
+        if not handler.accepts(payload):
+            self.stats["rejected"] += 1
+            return None
+
+        self.stats["decoded"] += 1
+        if issubclass(handler, OrderUpdate):
+            return handler(payload, is_trade_event=True)
+        return handler(payload)
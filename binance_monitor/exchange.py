@@ -18,58 +18,205 @@
 # OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
-from typing import List
+import gzip
+import json
+import os
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
 
 import pandas as pd
 from binance.client import Client
 from logbook import Logger
 
-from binance_monitor import settings
+from binance_monitor import settings, util
+from binance_monitor.base import Symbol
+from binance_monitor.ratelimit import INTERVAL_SECONDS
 
-pd.set_option("precision", 9)
+pd.set_option("display.precision", 9)
+
+# Bump whenever the layout written by `_compact` changes, to discard old caches
+CACHE_VERSION = 1
+
+# Fields kept from each exchangeInfo symbol; everything else is dropped from cache
+SYMBOL_FIELDS = [
+    "symbol",
+    "status",
+    "baseAsset",
+    "baseAssetPrecision",
+    "quoteAsset",
+    "quotePrecision",
+    "filters",
+]
 
 
 class Exchange:
-    def __init__(self, client: Client):
-        self.log = Logger(__name__.split(".", 1)[-1])
+    def __init__(
+        self,
+        client: Client,
+        ttl: Optional[int] = None,
+        cache_path: Optional[str] = None,
+    ):
+        """Exchange metadata (rate limits, filters and symbols)
+
+        Metadata is served from an on-disk cache when one exists. A cache older than
+        *ttl* seconds is still used, but refreshed from the server in a background
+        thread. The server is only queried before returning if there is no cache,
+        and a stale cache is used if the server cannot be reached
+
+        :param client: Binance client used to fetch exchangeInfo
+        :param ttl: seconds before the cache is refreshed. Default is the
+            `exchange_info_ttl` preference
+        :param cache_path: location of the cache file. Default is
+            *EXCHANGE_INFO_CACHE*
+        """
 
-        exchange_info = client.get_exchange_info()
+        self.log = Logger(__name__.split(".", 1)[-1])
+        self.client = client
+        self.ttl = settings.exchange_info_ttl() if ttl is None else ttl
+        self.cache_path = cache_path or settings.EXCHANGE_INFO_CACHE
+        self._refresh_thread: Optional[threading.Thread] = None
+
+        cached, fetched = self._read_cache()
+        if cached is None:
+            try:
+                self._apply(self._refresh())
+            except Exception as exc:
+                raise IOError(
+                    f"Could not get exchange info from server: {exc}"
+                ) from exc
+        else:
+            self._apply(cached)
+            age = time.time() - fetched
+            if age > self.ttl:
+                self.log.info(f"Exchange info is {age:.0f}s old, refreshing")
+                self._refresh_thread = threading.Thread(
+                    target=self._background_refresh, name="exchange-info", daemon=True
+                )
+                self._refresh_thread.start()
+
+    def _apply(self, exchange_info: Dict[str, Any]) -> None:
         self.last_updated_time = exchange_info.get("serverTime", None)
         self.rate_limits = exchange_info.get("rateLimits", None)
         self.filters = exchange_info.get("exchangeFilters", None)
         self.symbols = exchange_info.get("symbols", None)
+        Symbol.load(self.symbols)
+
+        # Decimal places of each asset, as the exchange keeps its balances. The
+        # symbol filters (stepSize, tickSize) only bound order quantities and prices,
+        # while fees and quote totals may have more places
+        self.asset_precisions: Dict[str, int] = {}
+        for symbol in self.symbols:
+            for asset_key, precision_key in [
+                ("baseAsset", "baseAssetPrecision"),
+                ("quoteAsset", "quotePrecision"),
+            ]:
+                if precision_key in symbol:
+                    asset = symbol[asset_key]
+                    self.asset_precisions[asset] = max(
+                        self.asset_precisions.get(asset, 0), int(symbol[precision_key])
+                    )
         active_symbols = [
             symbol["symbol"] for symbol in self.symbols if symbol["status"] == "TRADING"
         ]
         inactive_symbols = [
             symbol["symbol"] for symbol in self.symbols if symbol["status"] != "TRADING"
         ]
-        settings.write_symbols(active_symbols, inactive_symbols)
+        try:
+            unchanged = settings.read_symbols("active") == active_symbols
+            unchanged &= settings.read_symbols("inactive") == inactive_symbols
+        except KeyError:
+            unchanged = False
+        if not unchanged:
+            settings.write_symbols(active_symbols, inactive_symbols)
+
+        # Requests/second permitted by each REQUEST limit, e.g. 1200 / 60 sec
+        self._request_freqs: List[Tuple[str, float]] = []
+        for rate in self._req_limits():
+            interval = int(rate["intervalNum"]) * INTERVAL_SECONDS[rate["interval"]]
+            self._request_freqs.append(
+                (rate["rateLimitType"], int(rate["limit"]) / interval)
+            )
+
+    def _refresh(self) -> Dict[str, Any]:
+        """Download exchangeInfo and write it to the cache
+
+        :return: compacted exchangeInfo
+        """
+
+        exchange_info = self._compact(self.client.get_exchange_info())
+        self._write_cache(exchange_info)
+        return exchange_info
+
+    def _background_refresh(self) -> None:
+        try:
+            self._apply(self._refresh())
+            self.log.info("Exchange info refreshed from server")
+        except Exception as exc:
+            self.log.warning(f"Could not refresh exchange info, using cache: {exc}")
+
+    @staticmethod
+    def _compact(exchange_info: Dict[str, Any]) -> Dict[str, Any]:
+        symbols = [
+            {key: symbol[key] for key in SYMBOL_FIELDS if key in symbol}
+            for symbol in exchange_info.get("symbols", [])
+        ]
+        return {
+            "serverTime": exchange_info.get("serverTime", None),
+            "rateLimits": exchange_info.get("rateLimits", []),
+            "exchangeFilters": exchange_info.get("exchangeFilters", []),
+            "symbols": symbols,
+        }
+
+    def _read_cache(self) -> Tuple[Optional[Dict[str, Any]], float]:
+        """Load cached exchangeInfo
+
+        :return: tuple (compacted exchangeInfo, time it was fetched). The first
+            element is None if there is no usable cache
+        """
+
+        try:
+            with gzip.open(self.cache_path, "rt", encoding="utf-8") as cache_file:
+                cache = json.load(cache_file)
+            version = cache.get("version")
+            if version == CACHE_VERSION:
+                return cache["data"], float(cache["fetched"])
+        # A cache cut short or corrupted, e.g. by a crash while it was written
+        except (IOError, EOFError, KeyError, ValueError, zlib.error) as exc:
+            self.log.info(f"No usable exchange info cache at {self.cache_path}: {exc}")
+            return None, 0.0
+
+        self.log.info(f"Ignoring exchange info cache version {version}")
+        return None, 0.0
+
+    def _write_cache(self, exchange_info: Dict[str, Any]) -> None:
+        cache = {
+            "version": CACHE_VERSION,
+            "fetched": time.time(),
+            "data": exchange_info,
+        }
+        tmp_path = util.ensure_dir(self.cache_path) + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as cache_file:
+            json.dump(cache, cache_file, separators=(",", ":"))
+        os.replace(tmp_path, self.cache_path)
 
     def max_request_freq(self, req_weight: int = 1) -> float:
         """Get smallest allowable frequency for API calls.
-        The return value is the maximum number of calls allowed per second
+        The return value is the maximum number of calls allowed per second, based
+        only on the published limits. See `ratelimit.RateLimiter.budget` for the
+        budget actually left according to the server
         :param req_weight: (int) weight assigned to this type of request
             Default: 1-weight
         :return: float of the maximum calls permitted per second
         """
 
-        # Pull Binance exchange metadata (including limits) either from cached value, or
-        # from the server if cached data is too old
-        request_limits = self._req_limits()
-
-        for rate in request_limits:
-            # Convert JSON response components (e.g.) "5" "minutes" to a Timedelta
-            interval = pd.Timedelta(f"{rate['intervalNum']} {rate['interval']}")
-            # Frequency (requests/second) is, e.g., 5000 / 300 sec or 1200 / 60 sec
-            rate["req_freq"] = int(rate["limit"]) / interval.total_seconds()
-
         max_allowed_freq = None
 
-        for limit in request_limits:
+        for limit_type, req_freq in self._request_freqs:
             # RAW_REQUESTS type should be treated as a request weight of 1
-            weight = req_weight if limit["rateLimitType"] == "REQUEST_WEIGHT" else 1
-            this_allowed_freq = limit["req_freq"] / weight
+            weight = req_weight if limit_type == "REQUEST_WEIGHT" else 1
+            this_allowed_freq = req_freq / weight
 
             if max_allowed_freq is None:
                 max_allowed_freq = this_allowed_freq
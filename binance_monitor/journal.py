@@ -0,0 +1,162 @@
+# MIT License
+#
+# Copyright (C) 2019 Anson VanDoren
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+# to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next paragraph) shall
+# be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""Write-ahead journal for live trades, and the thread that checkpoints it"""
+import json
+import os
+import shutil
+import threading
+from typing import Callable, Dict, List, Sequence, Union
+
+from logbook import Logger
+
+# Number of records written before the journal is fsync'd to the device. Every
+# record is flushed to the OS immediately, so a killed process loses nothing; only
+# an OS crash or power loss can lose records since the last fsync
+SYNC_COUNT = 20
+
+log = Logger(__name__.split(".", 1)[-1])
+
+
+class TradeJournal:
+    """Append-only file of trade records, one JSON object per line
+
+    On checkpoint the records written so far are moved aside to a checkpoint
+    segment with `rotate`, folded into the store, and then deleted with
+    `discard_checkpoint`. Anything left in either file is replayed on the next open.
+    """
+
+    def __init__(self, path: str, sync_count: int = SYNC_COUNT):
+        self.path = path
+        self.checkpoint_path = path + ".ckpt"
+        self.sync_count = sync_count
+        self._file = open(path, "a", encoding="utf-8")
+        # Records left by an earlier process are moved aside by the next `rotate` too
+        self._records = int(os.path.getsize(path) > 0)
+        self._unsynced = 0
+
+    def append(self, record: Union[Dict, Sequence]) -> None:
+        """Write a single record, e.g. `TaxTrade.as_tuple`
+
+        Values which are not JSON types (Decimal, Timestamp) are written as strings
+        """
+
+        self._file.write(json.dumps(record, default=str) + "\n")
+        self._file.flush()
+        self._records += 1
+        self._unsynced += 1
+        if self._unsynced >= self.sync_count:
+            self.sync()
+
+    def sync(self) -> None:
+        if self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def rotate(self) -> None:
+        """Move all records written so far into the checkpoint segment
+
+        If a previous checkpoint segment was never discarded (the checkpoint failed),
+        the new records are added to it rather than replacing it
+        """
+
+        if not self._records:
+            return
+
+        self.sync()
+        self._file.close()
+        if os.path.exists(self.checkpoint_path):
+            with open(self.path, "r", encoding="utf-8") as current, open(
+                self.checkpoint_path, "a", encoding="utf-8"
+            ) as checkpoint:
+                shutil.copyfileobj(current, checkpoint)
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.checkpoint_path)
+
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._records = 0
+
+    def discard_checkpoint(self) -> None:
+        """Delete the checkpoint segment once its records are safely in the store"""
+
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def close(self) -> None:
+        self.sync()
+        self._file.close()
+
+    @staticmethod
+    def replay(path: str) -> List[Union[Dict, List]]:
+        """Read back all records left in a journal and its checkpoint segment
+
+        A partially written final line (e.g. the process was killed mid-write) is
+        skipped
+
+        :param path: path of the journal file
+        :return: list of records in the order they were written
+        """
+
+        records = []
+        for segment in [path + ".ckpt", path]:
+            if not os.path.exists(segment):
+                continue
+            with open(segment, "r", encoding="utf-8") as journal:
+                for line_num, line in enumerate(journal, start=1):
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        log.warning(f"Skipping corrupt record {segment}:{line_num}")
+        return records
+
+
+class Checkpointer(threading.Thread):
+    """Daemon thread which calls *checkpoint* every *interval* seconds, or sooner
+    when woken with `wake`
+    """
+
+    def __init__(self, checkpoint: Callable[[], None], interval: float):
+        super().__init__(name="checkpointer", daemon=True)
+        self.checkpoint = checkpoint
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopping.is_set():
+                break
+            try:
+                self.checkpoint()
+            except Exception as exc:
+                log.error(f"Checkpoint failed, will retry: {exc}")
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wake.set()
+        self.join()
@@ -0,0 +1,330 @@
+# MIT License
+#
+# Copyright (C) 2019 Anson VanDoren
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+# to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next paragraph) shall
+# be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Asyncio listener for the Binance user data stream
+
+The listener owns the stream's listenKey (creating it, keeping it alive and closing
+it), reads frames from the websocket and reconnects with jittered exponential
+backoff. Decoded events are handed to consumer tasks over a bounded queue, and the
+consumers run the handler in a thread pool, so that slow disk or settings I/O never
+delays reading frames.
+"""
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import websockets
+from logbook import Logger
+
+from binance_monitor import metrics
+from binance_monitor.events import EventDecoder, EventUpdate, OrderUpdate, loads
+
+STREAM_URL = "wss://stream.binance.com:9443/ws/"
+
+# listenKeys expire after 60 minutes without a keepalive
+KEEPALIVE_INTERVAL = 30 * 60
+
+# Maximum number of decoded events waiting for a consumer
+QUEUE_SIZE = 1000
+
+# Reconnect delays grow from BACKOFF_BASE, doubling up to BACKOFF_MAX seconds
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+# Seconds before a drop is noticed in which events may already have been lost. The
+# websockets library pings every 20s and waits 20s for the pong
+GAP_MARGIN = 60
+
+# Callback for fills missed while disconnected: receives the time (ms since Epoch)
+# from which events may have been lost, and the last (trade id, trade time in ms)
+# seen on the stream for each symbol
+Reconciler = Callable[[int, Dict[str, Tuple[int, int]]], Any]
+
+
+def backoff_delay(
+    attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_MAX
+) -> float:
+    """Seconds to wait before reconnect *attempt* (0-based), with full jitter
+
+    :param attempt: number of consecutive failed attempts so far
+    :param base: delay before the first retry, before jitter
+    :param cap: maximum delay, before jitter
+    :return: random delay between 0 and min(cap, base * 2 ** attempt)
+    """
+
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class ListenKeyExpired(Exception):
+    """The server closed the stream because its listenKey expired"""
+
+
+class UserStreamListener:
+    """Read the user data stream of one account and dispatch its events"""
+
+    def __init__(
+        self,
+        client,
+        handler: Callable[[EventUpdate], Any],
+        decoder: Optional[EventDecoder] = None,
+        queue_size: int = QUEUE_SIZE,
+        consumers: int = 1,
+        stream_url: str = STREAM_URL,
+        keepalive_interval: float = KEEPALIVE_INTERVAL,
+        reconcile: Optional[Reconciler] = None,
+    ):
+        """Create a listener, which does nothing until `run` is awaited
+
+        :param client: binance.client.Client used to manage the listenKey
+        :param handler: called with each decoded event, in a worker thread
+        :param decoder: EventDecoder for raw messages (optional)
+        :param queue_size: maximum number of events waiting for a consumer. When
+            the queue is full, reading pauses until a consumer catches up
+        :param consumers: number of events handled concurrently. With the default
+            of 1, events are handled in the order they were received
+        :param stream_url: base websocket URL the listenKey is appended to
+        :param keepalive_interval: seconds between listenKey keepalives
+        :param reconcile: called in a worker thread after each reconnect to recover
+            fills that happened while disconnected (optional)
+        """
+
+        self.log = Logger(__name__.split(".", 1)[-1])
+        self.client = client
+        self.handler = handler
+        self.decoder = decoder or EventDecoder()
+        self.queue_size = queue_size
+        self.consumers = consumers
+        self.stream_url = stream_url
+        self.keepalive_interval = keepalive_interval
+        self.reconcile = reconcile
+
+        self.listen_key: Optional[str] = None
+        # Last (trade id, trade time) seen on the stream for each symbol
+        self.last_trades: Dict[str, Tuple[int, int]] = {}
+        # Local time of the last message, and of the last detected disconnect
+        self._last_message_at: Optional[float] = None
+        self._disconnected_at: Optional[float] = None
+        self._reconciling: Optional[asyncio.Future] = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=consumers, thread_name_prefix="user-stream"
+        )
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._stats = {
+            "received": 0,
+            "processed": 0,
+            "errors": 0,
+            "reconnects": 0,
+            "reconciled": 0,
+            "max_queue_depth": 0,
+            "last_lag": 0.0,
+            "max_lag": 0.0,
+        }
+
+    @property
+    def metrics(self) -> Dict[str, Any]:
+        """Counters for the stream
+
+        :return: dict with the number of messages *received*, events *processed*,
+            handler *errors*, *reconnects* and trades *reconciled* after reconnecting,
+            the current and maximum queue depth,
+            and the last and maximum lag in seconds between an event's timestamp and
+            the end of its processing
+        """
+
+        metrics = dict(self._stats)
+        metrics["queue_depth"] = self._queue.qsize() if self._queue else 0
+        metrics.update(self.decoder.stats)
+        return metrics
+
+    async def run(self) -> None:
+        """Listen until `stop` is called, reconnecting whenever the stream drops"""
+
+        self._loop = asyncio.get_event_loop()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._stopping = asyncio.Event()
+
+        workers = [
+            asyncio.ensure_future(self._consume()) for _ in range(self.consumers)
+        ]
+        reader = asyncio.ensure_future(self._read_forever())
+        keepalive = asyncio.ensure_future(self._keepalive())
+
+        await self._stopping.wait()
+
+        for task in [reader, keepalive]:
+            task.cancel()
+        await asyncio.gather(reader, keepalive, return_exceptions=True)
+        if self._reconciling is not None:
+            await asyncio.gather(self._reconciling, return_exceptions=True)
+
+        # Let consumers finish every event that was already read
+        await self._queue.join()
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+        await self._close_listen_key()
+        self._executor.shutdown(wait=True)
+        self.log.notice(f"User stream stopped: {self.metrics}")
+
+    def stop(self) -> None:
+        """Ask a running listener to shut down. Safe to call from any thread"""
+
+        if self._loop is not None and self._stopping is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    async def _call(self, func: Callable, *args):
+        """Run a blocking client call in the default executor"""
+
+        return await self._loop.run_in_executor(None, func, *args)
+
+    async def _read_forever(self) -> None:
+        attempt = 0
+        while True:
+            try:
+                self.listen_key = await self._call(self.client.stream_get_listen_key)
+                url = self.stream_url + self.listen_key
+                async with websockets.connect(url) as socket:
+                    self.log.notice("Connected to user data stream")
+                    attempt = 0
+                    self._start_reconcile()
+                    await self._read(socket)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                if self._disconnected_at is None:
+                    self._disconnected_at = time.time()
+                delay = backoff_delay(attempt)
+                attempt += 1
+                self._stats["reconnects"] += 1
+                metrics.inc("user_stream_reconnects_total")
+                self.log.warning(
+                    f"User data stream disconnected ({exc!r}), "
+                    f"reconnecting in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+
+    async def _read(self, socket) -> None:
+        while True:
+            message = await socket.recv()
+            self._last_message_at = time.time()
+            self._stats["received"] += 1
+            metrics.inc("user_stream_messages_total")
+
+            payload = loads(message)
+            if payload.get("e") == "listenKeyExpired":
+                raise ListenKeyExpired(self.listen_key)
+
+            event = self.decoder.decode(payload)
+            if event is None:
+                continue
+            if isinstance(event, OrderUpdate) and event.is_trade_event:
+                self.last_trades[event.symbol] = (int(payload["t"]), int(payload["T"]))
+
+            if self._queue.full():
+                self.log.warning("Event queue is full, pausing the user data stream")
+            await self._queue.put(event)
+            depth = self._queue.qsize()
+            metrics.set_gauge("user_stream_queue_depth", depth)
+            if depth > self._stats["max_queue_depth"]:
+                self._stats["max_queue_depth"] = depth
+
+    def gap_start(self) -> Optional[int]:
+        """Time (ms since Epoch) from which events may have been missed, if any
+
+        That is the last message received, unless the connection was only found to be
+        dead more than *GAP_MARGIN* seconds later
+        """
+
+        if self._disconnected_at is None:
+            return None
+        start = self._disconnected_at - GAP_MARGIN
+        if self._last_message_at is not None:
+            start = max(start, self._last_message_at)
+        return int(start * 1000)
+
+    def _start_reconcile(self) -> None:
+        """Recover missed fills in the background after a reconnect"""
+
+        since = self.gap_start()
+        self._disconnected_at = None
+        if since is None or self.reconcile is None:
+            return
+
+        last_trades = dict(self.last_trades)
+        previous = self._reconciling
+
+        async def reconcile():
+            # Run one reconciliation at a time, in the order the gaps happened
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            try:
+                found = await self._call(self.reconcile, since, last_trades)
+                self._stats["reconciled"] += found or 0
+            except Exception as exc:
+                self.log.error(f"Could not reconcile missed trades: {exc!r}")
+
+        self._reconciling = asyncio.ensure_future(reconcile())
+
+    async def _consume(self) -> None:
+        while True:
+            event = await self._queue.get()
+            try:
+                with metrics.timer("user_stream_handler_seconds"):
+                    await self._loop.run_in_executor(
+                        self._executor, self.handler, event
+                    )
+                self._stats["processed"] += 1
+                metrics.inc("user_stream_events_total", type=event.event_type)
+            except Exception as exc:
+                self._stats["errors"] += 1
+                metrics.inc("user_stream_handler_errors_total")
+                self.log.error(f"Failed to handle {event.event_type}: {exc!r}")
+            finally:
+                lag = time.time() - event.event_timestamp / 1000
+                self._stats["last_lag"] = lag
+                self._stats["max_lag"] = max(self._stats["max_lag"], lag)
+                metrics.observe("user_stream_lag_seconds", lag)
+                self._queue.task_done()
+
+    async def _keepalive(self) -> None:
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            if self.listen_key is None:
+                continue
+            try:
+                await self._call(self.client.stream_keepalive, self.listen_key)
+                self.log.debug("Sent listenKey keepalive")
+            except Exception as exc:
+                self.log.warning(f"listenKey keepalive failed: {exc!r}")
+
+    async def _close_listen_key(self) -> None:
+        if self.listen_key is None:
+            return
+        try:
+            await self._call(self.client.stream_close, self.listen_key)
+        except Exception as exc:
+            self.log.warning(f"Could not close listenKey: {exc!r}")
+        self.listen_key = None
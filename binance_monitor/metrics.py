@@ -0,0 +1,305 @@
+# MIT License
+#
+# Copyright (C) 2019 Anson VanDoren
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+# to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next paragraph) shall
+# be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Runtime metrics for requests, user data stream events and the trade store
+
+Metrics are counters, gauges and histograms identified by a name and optional labels.
+They are exposed in the Prometheus text format by `serve`, and summarized in the log
+by `log_periodically`. Until `enable` is called every recording function returns
+immediately, so instrumented code pays only a function call.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+from logbook import Logger
+
+log = Logger(__name__.split(".", 1)[-1])
+
+# Upper bounds of histogram buckets for durations, in seconds
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Upper bounds of histogram buckets for sizes, e.g. rows written per flush
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+PORT = 9108
+
+SUMMARY_INTERVAL = 60.0
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class _Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+_enabled = False
+_lock = threading.Lock()
+_counters: Dict[Key, float] = {}
+_gauges: Dict[Key, float] = {}
+_histograms: Dict[Key, _Histogram] = {}
+
+
+def _key(name: str, labels: Dict[str, str]) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def enable() -> None:
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    """Forget every recorded value"""
+
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """Add *value* to a counter"""
+
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    """Set a gauge to its current *value*"""
+
+    if not _enabled:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(
+    name: str, value: float, buckets: Sequence[float] = SECONDS_BUCKETS, **labels
+) -> None:
+    """Record *value* in a histogram
+
+    :param name: metric name
+    :param value: observed value
+    :param buckets: bucket upper bounds, used when the histogram is first created
+    :param labels: label names and values
+    :return: None
+    """
+
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram(buckets)
+        histogram.observe(value)
+
+
+@contextmanager
+def _timer(name: str, labels: Dict[str, str]) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+@contextmanager
+def _null_timer() -> Iterator[None]:
+    yield
+
+
+def timer(name: str, **labels):
+    """Context manager recording the duration of its block in a histogram"""
+
+    if not _enabled:
+        return _null_timer()
+    return _timer(name, labels)
+
+
+def observe_response(response, *args, **kwargs) -> None:
+    """Response hook for `requests`, recording count, latency and used weight"""
+
+    if not _enabled:
+        return
+    endpoint = urlparse(response.url).path
+    inc("binance_requests_total", endpoint=endpoint, status=response.status_code)
+    observe(
+        "binance_request_seconds", response.elapsed.total_seconds(), endpoint=endpoint
+    )
+    used = response.headers.get("X-MBX-USED-WEIGHT-1M")
+    if used is not None:
+        set_gauge("binance_used_weight_1m", float(used))
+
+
+def attach(session) -> None:
+    """Record every response received through a requests.Session"""
+
+    session.hooks["response"].append(observe_response)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+
+    lines: List[str] = []
+    with _lock:
+        for kind, values in [("counter", _counters), ("gauge", _gauges)]:
+            for name in sorted({name for name, _ in values}):
+                lines.append(f"# TYPE {name} {kind}")
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+        for name in sorted({name for name, _ in _histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), histogram in sorted(_histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                bounds = [f"{b:g}" for b in histogram.buckets] + ["+Inf"]
+                for bound, count in zip(bounds, histogram.counts):
+                    cumulative += count
+                    le = _format_labels(labels, f'le="{bound}"')
+                    lines.append(f"{name}_bucket{le} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum:g}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+def summary(since: Optional[Dict[Key, float]] = None, seconds: float = 0.0) -> str:
+    """Short human-readable summary of the metrics
+
+    :param since: counter values at the start of the period, to report rates
+    :param seconds: length of the period
+    :return: one line per metric
+    """
+
+    lines = []
+    with _lock:
+        for (name, labels), value in sorted(_counters.items()):
+            line = f"{name}{_format_labels(labels)}={value:g}"
+            if since is not None and seconds > 0:
+                rate = (value - since.get((name, labels), 0)) / seconds
+                line += f" ({rate:.2f}/s)"
+            lines.append(line)
+        for (name, labels), value in sorted(_gauges.items()):
+            lines.append(f"{name}{_format_labels(labels)}={value:g}")
+        for (name, labels), histogram in sorted(_histograms.items()):
+            mean = histogram.sum / histogram.count if histogram.count else 0.0
+            lines.append(
+                f"{name}{_format_labels(labels)} count={histogram.count} "
+                f"mean={mean:.4g}"
+            )
+    return "\n".join(lines)
+
+
+def _counter_snapshot() -> Dict[Key, float]:
+    with _lock:
+        return dict(_counters)
+
+
+def log_periodically(interval: float = SUMMARY_INTERVAL) -> threading.Thread:
+    """Log a summary, with counter rates, every *interval* seconds
+
+    :param interval: seconds between summaries
+    :return: the daemon thread writing the summaries
+    """
+
+    def run():
+        since, last = _counter_snapshot(), time.monotonic()
+        while True:
+            time.sleep(interval)
+            now = time.monotonic()
+            text = summary(since, now - last)
+            if text:
+                log.info(f"Metrics summary:\n{text}")
+            since, last = _counter_snapshot(), now
+
+    thread = threading.Thread(target=run, name="metrics-summary", daemon=True)
+    thread.start()
+    return thread
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port: int = PORT, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Enable metrics and serve them at http://*host*:*port*/metrics
+
+    :param port: TCP port to listen on, or 0 to pick a free one
+    :param host: interface to listen on. Default is local connections only
+    :return: the server, running in a daemon thread
+    """
+
+    enable()
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="metrics-http", daemon=True
+    ).start()
+    log.notice(f"Serving metrics at http://{host}:{server.server_port}/metrics")
+    return server
@@ -20,29 +20,61 @@
 # OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 """Set up single-use or continuous monitors to the BinanceAPI"""
-import atexit
-import time
-from typing import Dict, List, Optional
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple, Union
 
 from binance.client import Client
-from binance.websockets import BinanceSocketManager
+from binance.exceptions import BinanceAPIException
 from logbook import Logger
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
-from binance_monitor import exchange, settings, store
-from binance_monitor.base import Asset
+from binance_monitor import exchange, metrics, profiling, ratelimit, settings, store
+from binance_monitor.costbasis import CostBasis
+from binance_monitor.events import EventDecoder, EventUpdate, OrderUpdate
+from binance_monitor.listener import UserStreamListener
 from binance_monitor.trade import TaxTrade
 
+# Number of symbols whose history is fetched concurrently
+MAX_WORKERS = 8
+
+# Request weight of GET /api/v3/myTrades
+MY_TRADES_WEIGHT = 5
+
+# Request weight of GET /api/v3/openOrders for all symbols
+OPEN_ORDERS_WEIGHT = 40
+
+# Limits counted per account rather than per IP
+ACCOUNT_LIMIT_TYPES = ["ORDERS"]
+
+# Times a request is retried after being rejected with HTTP 429/418
+MAX_RETRIES = 5
+
 
 class AccountMonitor(object):
-    def __init__(self, credentials=None, name="default"):
+    def __init__(
+        self,
+        credentials=None,
+        name="default",
+        exchange_info: Optional[exchange.Exchange] = None,
+        ip_limiter: Optional[ratelimit.RateLimiter] = None,
+        adapter: Optional[HTTPAdapter] = None,
+    ):
         """Create a Binance account monitor that can access account details
 
         If neither an initialized client nor valid credentials are passed, an attempt
         will be made to load credentials from cache, or prompt user for them.
 
+        Several monitors in one process should share *exchange_info*, *ip_limiter*
+        and *adapter*, see `supervisor.Supervisor`
+
         :param credentials: Binance API key and secret (optional)
         :param name: Nickname for this account. Optional, default value is "default"
+        :param exchange_info: exchange metadata to use instead of loading it
+        :param ip_limiter: limiter for the REQUEST limits shared by every account on
+            this IP. If given, this monitor only enforces its own ORDERS limits
+        :param adapter: HTTPAdapter (connection pool) to mount on the client session
         """
 
         self.log = Logger(__name__.split(".", 1)[-1])
@@ -51,73 +83,175 @@ class AccountMonitor(object):
             credentials = settings.get_credentials()
 
         self.client = Client(*credentials)
-        self.exchange_info = exchange.Exchange(self.client)
+        if adapter is not None:
+            self.client.session.mount("https://", adapter)
+        if exchange_info is None:
+            with profiling.span("exchange init"):
+                exchange_info = exchange.Exchange(self.client)
+        self.exchange_info = exchange_info
+        if ip_limiter is None:
+            self.limiter = ratelimit.RateLimiter(self.exchange_info.rate_limits)
+        else:
+            self.limiter = ratelimit.RateLimiter(
+                self.exchange_info.rate_limits,
+                limit_types=ACCOUNT_LIMIT_TYPES,
+                parent=ip_limiter,
+            )
+        self.limiter.attach(self.client.session)
+        metrics.attach(self.client.session)
         self.name = name
-        self.trade_store = store.TradeStore(name)
-        self.bsm: Optional[BinanceSocketManager] = None
-        self.conn_key = None
+        self.trade_store = store.open_store(
+            name, precisions=self.exchange_info.asset_precisions
+        )
+        self.decoder = EventDecoder()
+        self.listener: Optional[UserStreamListener] = None
+        # Set to book live trades as they are stored, see `costbasis`
+        self.cost_basis: Optional[CostBasis] = None
 
-        atexit.register(self._stop_user_monitor)
+    def run_user_monitor(self) -> None:
+        """Listen for account updates until interrupted with Ctrl+C"""
 
-    def start_user_monitor(self):
-        self.bsm = BinanceSocketManager(self.client)
-        self.conn_key = self.bsm.start_user_socket(self.process_user_update)
-        self.bsm.start()
         self.log.notice("Starting account monitor listener. Press Ctrl+C to exit.")
+        loop = asyncio.get_event_loop()
+        task = loop.create_task(self.listen())
+        try:
+            loop.run_until_complete(task)
+        except KeyboardInterrupt:
+            self.stop_user_monitor()
+            if not task.done():
+                loop.run_until_complete(task)
+        self.log.notice("Account monitor has been shutdown")
+
+    async def listen(self) -> None:
+        """Listen for account updates on the running event loop until stopped"""
+
+        self.listener = UserStreamListener(
+            self.client,
+            self.handle_event,
+            decoder=self.decoder,
+            reconcile=self.reconcile,
+        )
+        await self.listener.run()
 
-    def _stop_user_monitor(self):
-        if self.conn_key is not None:
-            self.bsm.stop_socket(self.conn_key)
-            self.conn_key = None
-            self.log.notice("Account monitor has been shutdown")
+    def stop_user_monitor(self) -> None:
+        if self.listener is not None:
+            self.listener.stop()
 
-    def process_user_update(self, msg: dict):
-        update = EventUpdate.create(msg)
-        if isinstance(update, OrderUpdate) and update.is_trade_event:
-            self.trade_store.add_trade(update.trade)
-            print(update.trade)
-            settings.Blacklist.remove(update.symbol)
+    def process_user_update(self, msg: Union[str, bytes, Dict]):
+        """Decode a raw user data stream message and handle the resulting event"""
 
-    def get_trade_history_for(self, symbols: List) -> None:
-        """Get full trade history from the API for each symbol in `symbols`
+        update = self.decoder.decode(msg)
+        if update is not None:
+            self.handle_event(update)
 
-        :param symbols: A single symbol pair, or a list of such pairs, which are listed
-            on Binance
-        :return: None
+    def handle_event(self, update: EventUpdate) -> None:
+        """Store (and book, if tracking cost basis) trades from a decoded user data
+        stream event
         """
 
-        # Get the minimum time to wait between requests to avoid being throttled/banned
-        wait_time = 1.0 / self.exchange_info.max_request_freq(req_weight=5)
-        limit = 1000
-        trades: List[Dict] = []
-        last_called = 0.0
+        if isinstance(update, OrderUpdate) and update.is_trade_event:
+            trade = update.trade
+            if not self.trade_store.add_trade(trade):
+                return
+            # So the next sync starts after this fill rather than fetching it again
+            self.trade_store.update_high_water_marks(
+                [
+                    {
+                        "symbol": update.symbol,
+                        "id": trade.mark,
+                        "time": update.payload["T"],
+                    }
+                ]
+            )
+            self.log.notice(f"New trade:\n{trade}")
+            if self.cost_basis is not None:
+                self.cost_basis.add(trade)
+            settings.Blacklist.remove(update.symbol)
 
-        for symbol in tqdm(symbols):
-            tqdm.write(symbol, end="")  # Print to console above the progress bar
+    def reconcile(self, since: int, last_trades: Dict[str, Tuple[int, int]]) -> int:
+        """Fetch trades that were missed while the user data stream was down
 
-            result = None
-            params = {"symbol": symbol, "limit": limit}
+        Only symbols that may have traded during the gap are queried: those with
+        trades seen on the stream, and those with open orders. A symbol whose last
+        trade id is known is requested from that id on, any other from *since*.
 
-            while result is None or len(result) == limit:
-                # Wait a while if needed to avoid hitting API rate limits
-                delta = time.perf_counter() - last_called
-                if delta < wait_time:
-                    time.sleep(wait_time - delta)
+        :param since: time (ms since Epoch) from which events may have been lost
+        :param last_trades: last (trade id, trade time) seen for each symbol
+        :return: number of trades recovered
+        """
 
-                if result is not None:
-                    next_end_time = result[0]["time"] - 1
-                    params.update({"endTime": next_end_time})
+        symbols = set(last_trades)
+        try:
+            open_orders = self._request(
+                self.client.get_open_orders, OPEN_ORDERS_WEIGHT, {}
+            )
+            symbols.update(order["symbol"] for order in open_orders)
+        except BinanceAPIException as exc:
+            self.log.warning(f"Could not get open orders to reconcile: {exc}")
 
-                last_called = time.perf_counter()
-                result = self.client.get_my_trades(**params)
+        trades: List[Dict] = []
+        for symbol in sorted(symbols):
+            if symbol in last_trades:
+                last_id = last_trades[symbol][0]
+                trades.extend(self._fetch_symbol_history(symbol, last_id=last_id))
+            else:
+                trades.extend(self._fetch_symbol_history(symbol, start_time=since))
+
+        self.log.notice(
+            f"Reconciled {len(symbols)} symbols after reconnect, "
+            f"found {len(trades)} missed trades"
+        )
+        if trades:
+            # Trades already stored (e.g. by a sync) are skipped by `update`
+            with profiling.span("convert"):
+                trade_df = TaxTrade.frame_from_historic_trades(
+                    trades, self.trade_store.scales
+                )
+            self.trade_store.update(trade_df)
+            self.trade_store.update_high_water_marks(trades)
+            self.trade_store.flush()
+            if self.cost_basis is not None:
+                self.cost_basis.catch_up()
+        return len(trades)
+
+    def get_trade_history_for(
+        self, symbols: List, full: bool = False, max_workers: int = MAX_WORKERS
+    ) -> None:
+        """Get trade history from the API for each symbol in `symbols`
+
+        Symbols are fetched concurrently by up to *max_workers* threads, which all
+        draw from the same rate limiter so the account stays within its request
+        weight budget.
 
-                if not result:
-                    break
+        :param symbols: A single symbol pair, or a list of such pairs, which are listed
+            on Binance
+        :param full: if True, download the complete history of every symbol. Otherwise
+            only trades newer than the store's high-water mark for each symbol are
+            requested, falling back to the complete history for unknown symbols
+        :param max_workers: maximum number of symbols to fetch at the same time
+        :return: None
+        """
 
-                trades.extend(result)
-                tqdm.write(f" : {len(result)}", end="")
+        if isinstance(symbols, str):
+            symbols = [symbols]
 
-            tqdm.write("")
+        self.log.info(f"Fetching {len(symbols)} symbols with {self.limiter}")
+        trades: List[Dict] = []
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(
+                    self._fetch_symbol_history,
+                    symbol,
+                    None if full else self.trade_store.high_water_mark(symbol),
+                ): symbol
+                for symbol in symbols
+            }
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                result = future.result()
+                # Print to console above the progress bar
+                tqdm.write(f"{futures[future]} : {len(result)}")
+                trades.extend(result)
 
         if not trades:
             self.log.notice("No trades received for given symbols")
@@ -129,14 +263,19 @@ class AccountMonitor(object):
             settings.Blacklist.remove(symbols_found)
 
         # Write results to the store
-        tax_trades = [TaxTrade.from_historic_trades(result) for result in trades]
-        self.trade_store.update(tax_trades)
+        with profiling.span("convert"):
+            trade_df = TaxTrade.frame_from_historic_trades(
+                trades, self.trade_store.scales
+            )
+        self.trade_store.update(trade_df)
+        self.trade_store.update_high_water_marks(trades)
         self.log.notice(f"{len(trades)} trades retrieved and stored on disk")
 
-    def get_all_trades(self, force_all=False):
+    def get_all_trades(self, force_all=False, full=False):
         """Pull trade history for all symbols on Binance that are not blacklisted.
 
-        If *force_all* is True, pull history regardless of blacklist
+        If *force_all* is True, pull history regardless of blacklist. If *full* is
+        True, rebuild the complete history instead of syncing only new trades
         """
 
         blacklist = settings.Blacklist.get() if not force_all else None
@@ -144,60 +283,77 @@ class AccountMonitor(object):
 
         if blacklist is not None:
             self.log.info(f"Skipping {blacklist} while getting all trades")
-            all_active = [pair for pair in all_active if pair not in blacklist]
-
-        self.get_trade_history_for(all_active)
-
-
-class EventUpdate:
-    def __init__(self, api_payload: Dict):
-        if not isinstance(api_payload, dict):
-            raise ValueError(
-                f"EventUpdate expected as a dict but got {type(api_payload)}"
-            )
-        self.payload = api_payload
-        self.event_timestamp = int(api_payload["E"])
-        self.event_type = self.__class__.__name__
-
-    @staticmethod
-    def create(api_payload):
-        event_types = {
-            "outboundAccountInfo": AccountUpdate,
-            "executionReport": OrderUpdate,
-        }
-        return event_types[api_payload["e"]](api_payload)
+            all_active = [
+                pair for pair in all_active if not settings.Blacklist.contains(pair)
+            ]
+
+        self.get_trade_history_for(all_active, full=full)
+
+    def _fetch_symbol_history(
+        self,
+        symbol: str,
+        last_id: Optional[int] = None,
+        start_time: Optional[int] = None,
+    ) -> List[Dict]:
+        """Page through the trade history of a single symbol
+
+        Without *last_id* or *start_time*, page backwards from the present using
+        `endTime` until the full history has been retrieved. With *last_id*, page
+        forwards using `fromId` so that only trades after the high-water mark are
+        requested. With *start_time* only, the first page starts at that time and
+        later pages follow on using `fromId`.
+
+        :param symbol: symbol pair listed on Binance
+        :param last_id: id of the last trade already stored for *symbol* (optional)
+        :param start_time: only request trades from this time (ms since Epoch) on
+        :return: list of raw trade dicts as returned by the API
+        """
 
+        limit = 1000
+        trades: List[Dict] = []
+        params = {"symbol": symbol, "limit": limit}
+        forward = last_id is not None or start_time is not None
+        if last_id is not None:
+            params.update({"fromId": last_id + 1})
+        elif start_time is not None:
+            params.update({"startTime": start_time})
+
+        with profiling.span("fetch"):
+            while True:
+                result = self._request(
+                    self.client.get_my_trades, MY_TRADES_WEIGHT, params
+                )
+                trades.extend(result)
 
-class AccountUpdate(EventUpdate):
-    def __init__(self, api_payload: Dict):
-        super().__init__(api_payload)
+                if len(result) < limit:
+                    return trades
 
-        self.last_updated_timestamp = int(api_payload["u"])
-        self.balances = [Asset(asset) for asset in api_payload["B"]]
+                if not forward:
+                    params.update({"endTime": result[0]["time"] - 1})
+                else:
+                    params.pop("startTime", None)
+                    params.update({"fromId": result[-1]["id"] + 1})
 
+    def _request(self, method, weight: int, params: Dict):
+        """Call a `Client` method once the rate limiter permits it
 
-class OrderUpdate(EventUpdate):
-    def __init__(self, api_payload: Dict):
-        super().__init__(api_payload)
+        Requests rejected with HTTP 429 (rate limited) or 418 (IP banned) are
+        retried once the back-off requested by the server has elapsed.
 
-        self.symbol = api_payload["s"]
-        print(
-            f"OrderUpdate: executionType={api_payload['x']}\texecutionStatus={api_payload['X']}"
-        )
+        :param method: bound method of `self.client`
+        :param weight: request weight of the endpoint
+        :param params: keyword arguments for *method*
+        :return: decoded API response
+        """
 
-    @property
-    def trade(self) -> TaxTrade:
-        if not self.is_trade_event:
-            raise AttributeError("This order update is not a trade event")
-
-        return TaxTrade.from_order_update(self.payload)
-
-    @property
-    def is_trade_event(self) -> bool:
-        is_trade = self.payload["x"] == "TRADE" and self.payload["X"] in [
-            "PARTIALLY_FILLED",
-            "FILLED",
-        ]
-        did_execute = float(self.payload["l"]) > 0 and float(self.payload["L"]) > 0
-        has_trade_id = self.payload["t"] != -1
-        return is_trade and did_execute and has_trade_id
+        for attempt in range(MAX_RETRIES + 1):
+            self.limiter.acquire(weight)
+            metrics.inc("binance_request_weight_total", weight, call=method.__name__)
+            try:
+                with profiling.span("http"):
+                    return method(**params)
+            except BinanceAPIException as exc:
+                if exc.status_code not in (418, 429) or attempt == MAX_RETRIES:
+                    raise
+                metrics.inc("binance_request_retries_total", call=method.__name__)
+                self.log.warning(f"{method.__name__} rejected: {exc}, retrying")
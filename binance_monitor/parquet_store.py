@@ -0,0 +1,390 @@
+# MIT License
+#
+# Copyright (C) 2019 Anson VanDoren
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+# to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next paragraph) shall
+# be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Trade store backed by a Parquet dataset partitioned by symbol and month
+
+Trades are written below `<account>.parquet/` as hive-style partitions, e.g.
+`symbol=ETHBTC/month=2019-01/part-<id>-0.parquet`. Each save adds a file to the
+partitions it touches, and `compact` rewrites every partition as a single file.
+Queries by symbol or time only open the matching partitions, and files are read
+through memory maps. Currency and other repetitive string columns are dictionary
+encoded, on disk and in memory, so they load as pandas categoricals.
+
+Select this backend with `store_backend = "parquet"` in preferences.toml, and copy
+an existing HDF5 store across once with `migrate`. Requires pyarrow.
+"""
+import glob
+import json
+import os
+import shutil
+import uuid
+from typing import Dict, Iterator, List, Optional, Set, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+from binance_monitor import amounts, profiling, store
+from binance_monitor.store import KEY_COL, SYMBOL_COL, TradeStore
+from binance_monitor.trade import TaxTrade
+
+MONTH_COL = "month"
+
+DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+
+# Schema of the data files. *SYMBOL_COL* and *MONTH_COL* are only stored in the
+# directory names
+SCHEMA = pa.schema(
+    [
+        ("kind", DICTIONARY),
+        ("dtime", pa.timestamp("ns", tz="UTC")),
+        ("buy_currency", DICTIONARY),
+        ("buy_amount", pa.int64()),
+        ("sell_currency", DICTIONARY),
+        ("sell_amount", pa.int64()),
+        ("fee_currency", DICTIONARY),
+        ("fee_amount", pa.int64()),
+        ("exchange", DICTIONARY),
+        ("mark", pa.int64()),
+        ("comment", pa.string()),
+        (KEY_COL, pa.string()),
+    ]
+)
+
+PARTITION_SCHEMA = pa.schema([(SYMBOL_COL, pa.string()), (MONTH_COL, pa.string())])
+PARTITIONING = ds.partitioning(PARTITION_SCHEMA, flavor="hive")
+
+# Schema of a dataset as read, with the partition columns
+DATASET_SCHEMA = pa.unify_schemas([SCHEMA, PARTITION_SCHEMA])
+
+# Kept in the dataset folder; files starting with "_" are not read as data
+SYNC_STATE_FILE = "_sync_state.json"
+SCALES_FILE = "_asset_scales.json"
+
+# Local filesystem which memory-maps the files it opens
+_MMAP_FS = fs.LocalFileSystem(use_mmap=True)
+
+
+class ParquetTradeStore(TradeStore):
+    FILE_EXTENSION = ".parquet"
+
+    def _recover_rewrite(self) -> None:
+        """Put the old dataset back if `_rewrite` stopped between moving it aside
+        and moving the new one in
+        """
+
+        old_path = self.file_path + ".old"
+        if os.path.exists(old_path) and not os.path.exists(self.file_path):
+            os.replace(old_path, self.file_path)
+            self.log.warning(f"Restored {self.file_path} after interrupted compaction")
+
+    def _load_sync_state(self) -> Dict[str, Dict[str, int]]:
+        try:
+            with open(os.path.join(self.file_path, SYNC_STATE_FILE), "r") as state:
+                return json.load(state)
+        except (IOError, ValueError):
+            self.log.info(f"No sync state in {self.file_path}, full history required")
+            return {}
+
+    def _load_scales(self) -> Dict[str, int]:
+        try:
+            with open(os.path.join(self.file_path, SCALES_FILE), "r") as scales:
+                return json.load(scales)
+        except (IOError, ValueError):
+            return {}
+
+    def _write_state(self, folder: str) -> None:
+        """Write the sync state and asset scales to files in *folder*"""
+
+        for name, state in [
+            (SYNC_STATE_FILE, self.sync_state),
+            (SCALES_FILE, self.scales),
+        ]:
+            if not state:
+                continue
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, name)
+            with open(path + ".tmp", "w") as state_file:
+                json.dump(state, state_file)
+            os.replace(path + ".tmp", path)
+
+    def _dataset(self) -> ds.Dataset:
+        # The schema is read from the files, which may predate the current *SCHEMA*
+        return ds.dataset(
+            self.file_path,
+            format="parquet",
+            partitioning=PARTITIONING,
+            filesystem=_MMAP_FS,
+        )
+
+    def _has_trades_on_disk(self) -> bool:
+        pattern = os.path.join(self.file_path, "*", "*", "*.parquet")
+        return next(glob.iglob(pattern), None) is not None
+
+    def _read_trades(self, expression: Optional[ds.Expression] = None) -> pd.DataFrame:
+        table = self._dataset().to_table(filter=expression)
+        return _to_frame(table)
+
+    def _read_keys(self) -> Set[str]:
+        if not self._has_trades_on_disk():
+            return set()
+        keys = self._dataset().to_table(columns=[KEY_COL]).column(KEY_COL)
+        return set(keys.to_pylist())
+
+    def _is_legacy_format(self) -> bool:
+        """True if the dataset holds float amounts or string marks"""
+
+        if not self._has_trades_on_disk():
+            return False
+        schema = self._dataset().schema
+        return not all(
+            pa.types.is_integer(schema.field(col).type)
+            for col in ["buy_amount", "mark"]
+        )
+
+    def _save(self) -> None:
+        """Write trades added since the last save as new files in their partitions"""
+
+        if not self._format_current and self._is_legacy_format():
+            self._rewrite()
+            return
+
+        with profiling.span("save"):
+            if self._new is not None:
+                self._append()
+            self._write_state(self.file_path)
+
+    def _append(self) -> None:
+        new_rows = self._new
+        if not new_rows.empty:
+            self._write(new_rows, self.file_path)
+            self.log.info(f"Appended {len(new_rows)} trades to {self.file_path}")
+            if self._loaded is not None:
+                self._loaded = pd.concat([self._loaded, new_rows], ignore_index=True)
+        self._new = None
+
+    def _with_index_columns(self, trades: pd.DataFrame) -> pd.DataFrame:
+        # Strings can't be concatenated while they are categoricals
+        trades = trades.astype({col: object for col in _dictionary_columns(trades)})
+        trades = super()._with_index_columns(trades)
+        # Trade ids, as the HDF5 store keeps them
+        trades["mark"] = trades["mark"].astype("int64")
+        return trades
+
+    @staticmethod
+    def _write(trades: pd.DataFrame, path: str) -> None:
+        trades = trades.assign(**{MONTH_COL: _months(trades["dtime"])})
+        table = pa.Table.from_pandas(
+            trades,
+            schema=DATASET_SCHEMA,
+            preserve_index=False,
+        )
+        ds.write_dataset(
+            table,
+            path,
+            format="parquet",
+            partitioning=PARTITIONING,
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+
+    def _rewrite(self) -> None:
+        """Rewrite the dataset with one sorted, de-duplicated file per partition
+
+        The new dataset is written next to the old one and then swapped in
+        """
+
+        trades = self.trades
+        if trades is None:
+            return
+
+        with profiling.span("clean"):
+            trades = (
+                self._with_index_columns(trades)
+                .drop_duplicates(subset=KEY_COL)
+                .sort_values("dtime")
+                .reset_index(drop=True)
+            )
+
+        tmp_path = self.file_path + ".compact"
+        old_path = self.file_path + ".old"
+        # Either may be left by an interrupted compaction, the old dataset having
+        # been restored (see `_recover_rewrite`)
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        shutil.rmtree(old_path, ignore_errors=True)
+        with profiling.span("save"):
+            self._write(trades, tmp_path)
+            self._write_state(tmp_path)
+        if os.path.exists(self.file_path):
+            os.replace(self.file_path, old_path)
+        os.replace(tmp_path, self.file_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+        self._loaded = trades
+        self._new = None
+        self.log.notice(f"Compacted {self.file_path} to {len(trades)} trades")
+
+    def last_known_trade_timestamp(self) -> Optional[pd.Timestamp]:
+        """Return the time of the latest trade recorded
+
+        Only the *dtime* column is read from disk
+
+        :return: pandas.Timestamp of the latest trade recorded if there are any
+            records in the store, otherwise None
+        """
+
+        with self._lock:
+            self._merge_pending()
+            latest = []
+            if self._new is not None and not self._new.empty:
+                latest.append(self._new["dtime"].max())
+            if self._has_trades_on_disk():
+                dtimes = self._dataset().to_table(columns=["dtime"]).column("dtime")
+                if len(dtimes):
+                    latest.append(pc.max(dtimes).as_py())
+
+        return pd.Timestamp(max(latest)) if latest else None
+
+    def query(
+        self,
+        symbol: Union[str, List[str], None] = None,
+        currency: Union[str, List[str], None] = None,
+        start=None,
+        end=None,
+        trade_id: Union[int, List[int], None] = None,
+        chunksize: Optional[int] = None,
+    ) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+        """Read only the trades matching all of the given criteria from disk
+
+        Filters on *symbol* and time skip whole partitions, and the rest are applied
+        by Arrow while scanning. Any unsaved trades are saved first. Parameters are
+        as for `TradeStore.query`
+        """
+
+        terms = []
+        if symbol is not None:
+            terms.append(ds.field(SYMBOL_COL).isin(store._as_list(symbol)))
+        if currency is not None:
+            currencies = store._as_list(currency)
+            terms.append(
+                ds.field("buy_currency").isin(currencies)
+                | ds.field("sell_currency").isin(currencies)
+            )
+        if start is not None:
+            start = store._to_utc(start)
+            terms.append(ds.field(MONTH_COL) >= start.strftime("%Y-%m"))
+            terms.append(
+                ds.field("dtime") >= pa.scalar(start, SCHEMA.field("dtime").type)
+            )
+        if end is not None:
+            end = store._to_utc(end)
+            terms.append(ds.field(MONTH_COL) <= end.strftime("%Y-%m"))
+            terms.append(ds.field("dtime") < pa.scalar(end, SCHEMA.field("dtime").type))
+        if trade_id is not None:
+            marks = [int(i) for i in store._as_list(trade_id)]
+            terms.append(ds.field("mark").isin(marks))
+
+        expression = None
+        for term in terms:
+            expression = term if expression is None else expression & term
+
+        self.flush()
+        if chunksize is not None:
+            return self._select_chunks(expression, chunksize)
+
+        with self._lock:
+            if not self._has_trades_on_disk():
+                return pd.DataFrame(columns=self.col_names)
+            return self._read_trades(expression)
+
+    def _select_chunks(
+        self, expression: Optional[ds.Expression], chunksize: int
+    ) -> Iterator[pd.DataFrame]:
+        with self._lock:
+            if not self._has_trades_on_disk():
+                return
+            batches = self._dataset().to_batches(
+                filter=expression, batch_size=chunksize
+            )
+            for batch in batches:
+                if batch.num_rows:
+                    yield _to_frame(pa.Table.from_batches([batch]))
+
+
+def migrate(acct_name: str) -> ParquetTradeStore:
+    """Copy the trades, sync state and asset scales of an account's HDF5 store into
+    a Parquet store
+
+    The HDF5 file is left in place. Nothing is copied if the Parquet store already
+    holds trades
+
+    :param acct_name: account nickname
+    :return: the Parquet store
+    """
+
+    parquet = ParquetTradeStore(acct_name)
+    h5_path = os.path.join(store.ACCOUNT_STORE_FOLDER, acct_name) + ".h5"
+    if parquet._has_trades_on_disk():
+        parquet.log.notice(f"{parquet.file_path} already holds trades, not migrating")
+        return parquet
+    if not os.path.exists(h5_path):
+        parquet.log.notice(f"No {h5_path} to migrate")
+        return parquet
+
+    with pd.HDFStore(h5_path, mode="r") as h5:
+        keys = h5.keys()
+        if "/sync_state" in keys:
+            parquet.sync_state.update(h5["sync_state"].to_dict(orient="index"))
+        if "/asset_scales" in keys:
+            parquet.scales.update(h5["asset_scales"]["scale"].to_dict())
+        trades = h5["taxtrades"] if "/taxtrades" in keys else None
+
+    if trades is not None:
+        # Older files hold float amounts
+        trades = amounts.frame_to_units(
+            trades[TaxTrade.COL_NAMES].copy(), parquet.scales
+        )
+        parquet.update(trades)
+    parquet.flush()
+    parquet.log.notice(
+        f"Migrated {0 if trades is None else len(trades)} trades from {h5_path} "
+        f"to {parquet.file_path}"
+    )
+    return parquet
+
+
+def _months(dtimes: pd.Series) -> pd.Series:
+    return dtimes.dt.strftime("%Y-%m")
+
+
+def _dictionary_columns(frame: pd.DataFrame) -> List[str]:
+    return [
+        col
+        for col, dtype in frame.dtypes.items()
+        if isinstance(dtype, pd.CategoricalDtype)
+    ]
+
+
+def _to_frame(table: pa.Table) -> pd.DataFrame:
+    frame = table.drop([MONTH_COL]).to_pandas()
+    return frame[TaxTrade.COL_NAMES + [SYMBOL_COL, KEY_COL]]
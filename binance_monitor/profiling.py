@@ -0,0 +1,167 @@
+# MIT License
+#
+# Copyright (C) 2019 Anson VanDoren
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+# to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next paragraph) shall
+# be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Per-phase timing for profiling CLI runs
+
+Code is divided into named phases with `span`. Once `enable` has been called, the
+time spent in each phase is accumulated and `report` prints a breakdown. Phases run
+by several threads at once (e.g. fetching symbols) are summed across threads, so
+their total may exceed the wall time. When disabled, `span` does nothing.
+
+`start_cprofile` additionally profiles every function call, in all threads, for
+analysis with pstats or flame graph tools such as snakeviz or flameprof.
+"""
+import cProfile
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from logbook import Logger
+
+log = Logger(__name__.split(".", 1)[-1])
+
+_enabled = False
+_started = time.perf_counter()
+_lock = threading.Lock()
+# Phase name -> [calls, total seconds, longest call in seconds]
+_spans: Dict[str, List[float]] = {}
+
+_profiles: List[cProfile.Profile] = []
+_cprofile_path: Optional[str] = None
+
+
+def enable() -> None:
+    global _enabled, _started
+    _enabled = True
+    _started = time.perf_counter()
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def reset() -> None:
+    """Forget every recorded phase"""
+
+    with _lock:
+        _spans.clear()
+
+
+@contextmanager
+def _span(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            stats = _spans.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+
+@contextmanager
+def _null_span() -> Iterator[None]:
+    yield
+
+
+def span(name: str):
+    """Context manager adding the time spent in its block to phase *name*"""
+
+    if not _enabled:
+        return _null_span()
+    return _span(name)
+
+
+def report() -> str:
+    """Table of the time spent in each phase, longest first"""
+
+    wall = time.perf_counter() - _started
+    lines = [
+        f"{'phase':<20}{'calls':>8}{'total s':>10}{'mean ms':>10}{'max ms':>10}"
+        f"{'% wall':>8}"
+    ]
+    with _lock:
+        spans = sorted(_spans.items(), key=lambda item: item[1][1], reverse=True)
+    for name, (calls, total, longest) in spans:
+        lines.append(
+            f"{name:<20}{calls:>8.0f}{total:>10.3f}{total / calls * 1000:>10.1f}"
+            f"{longest * 1000:>10.1f}{total / wall:>8.1%}"
+        )
+    lines.append(f"{'wall time':<20}{'':>8}{wall:>10.3f}")
+    return "\n".join(lines)
+
+
+def _profile_thread(frame, event, arg) -> None:
+    # Runs once at the start of each new thread, and replaces itself with a
+    # profiler for that thread
+    profile = cProfile.Profile()
+    with _lock:
+        _profiles.append(profile)
+    profile.enable()
+
+
+def start_cprofile(path: str) -> None:
+    """Profile all function calls until `stop_cprofile`, then write stats to *path*
+
+    :param path: output file, in the binary format read by `pstats.Stats`
+    :return: None
+    """
+
+    global _cprofile_path
+    _cprofile_path = path
+    # Before Python 3.12 a profiler only sees the thread that enabled it
+    if sys.version_info < (3, 12):
+        threading.setprofile(_profile_thread)
+    profile = cProfile.Profile()
+    _profiles.append(profile)
+    profile.enable()
+
+
+def stop_cprofile() -> None:
+    """Write the stats of every profiled thread to the `start_cprofile` path"""
+
+    global _cprofile_path
+    if _cprofile_path is None:
+        return
+    threading.setprofile(None)
+    main, *threads = _profiles
+    main.disable()
+    stats = pstats.Stats(main)
+    for profile in threads:
+        stats.add(profile)
+    stats.dump_stats(_cprofile_path)
+    log.notice(f"Wrote profile of {1 + len(threads)} threads to {_cprofile_path}")
+    _profiles.clear()
+    _cprofile_path = None
+
+
+def finish() -> None:
+    """Log the phase breakdown and write any cProfile stats"""
+
+    stop_cprofile()
+    if _enabled:
+        log.notice(f"Time spent per phase:\n{report()}")
@@ -0,0 +1,329 @@
+# MIT License
+#
+# Copyright (C) 2019 Anson VanDoren
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+# to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next paragraph) shall
+# be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""Client-side rate limiting shared by every thread talking to the Binance API
+
+Limits are enforced with one token bucket per limit published in exchangeInfo
+`rateLimits`. Buckets pace requests on their own, and are re-anchored to the usage
+the server reports in its X-MBX-USED-WEIGHT-* and X-MBX-ORDER-COUNT-* response
+headers whenever those are seen, so that weight spent by other clients on the same
+IP or account is accounted for, and any weight left unused in a window can be spent.
+"""
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+
+from logbook import Logger
+
+# Seconds per interval unit as reported in exchangeInfo `rateLimits`
+INTERVAL_SECONDS = {"SECOND": 1, "MINUTE": 60, "HOUR": 60 * 60, "DAY": 60 * 60 * 24}
+
+# Fraction of each limit that may be spent as an immediate burst. The remainder
+# refills continuously, so that no fixed-length window can ever see more than the
+# full limit (burst + rate * interval == limit)
+BURST_FRACTION = 0.1
+
+# Seconds to stay blocked after a 429/418 response that carries no Retry-After
+DEFAULT_RETRY_AFTER = 60
+
+USAGE_HEADER = re.compile(r"^x-mbx-(used-weight|order-count)(?:-(\d+)([smhd]))?$")
+HEADER_LIMIT_TYPES = {"used-weight": "REQUEST_WEIGHT", "order-count": "ORDERS"}
+
+
+def limit_name(limit_type: str, interval_num: int, interval: str) -> str:
+    """Build a key such as "REQUEST_WEIGHT_1M" for a limit
+
+    :param limit_type: e.g. "REQUEST_WEIGHT", "ORDERS" or "RAW_REQUESTS"
+    :param interval_num: number of *interval* units in the window
+    :param interval: e.g. "SECOND", "MINUTE", "DAY", or just the first letter
+    :return: name of the limit
+    """
+
+    return f"{limit_type}_{interval_num}{interval[0].upper()}"
+
+
+class TokenBucket:
+    """Thread-safe token bucket that hands out reservations in arrival order"""
+
+    def __init__(self, rate: float, capacity: float):
+        """Create a bucket which starts full
+
+        :param rate: tokens added to the bucket per second
+        :param capacity: maximum number of tokens the bucket can hold
+        """
+
+        if rate <= 0 or capacity <= 0:
+            raise ValueError("TokenBucket rate and capacity must both be positive")
+
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        # Tokens granted above capacity by `set_tokens` are kept, but not added to
+        if self._tokens < self.capacity:
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._last) * self.rate
+            )
+        self._last = now
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """Take *tokens* out of the bucket, going into debt if necessary
+
+        :param tokens: number of tokens to take
+        :return: number of seconds the caller must wait before using the tokens
+        """
+
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= tokens
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def set_tokens(self, tokens: float) -> None:
+        """Overwrite the current token count, which may exceed *capacity*"""
+
+        with self._lock:
+            self._last = time.monotonic()
+            self._tokens = tokens
+
+    @property
+    def available(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+class _Limit:
+    """A single published limit, with the bucket that enforces it"""
+
+    def __init__(self, limit: int, interval: int, burst_fraction: float):
+        self.limit = limit
+        self.interval = interval
+        capacity = limit * burst_fraction
+        self.bucket = TokenBucket((limit - capacity) / interval, capacity)
+        # Last usage reported by the server, and the window it was reported for
+        self.used: Optional[int] = None
+        self.window: Optional[int] = None
+        # Weight of requests sent but not yet answered
+        self.in_flight: deque = deque()
+
+    def current_window(self, now: float) -> int:
+        # Binance windows are aligned to the wall clock (e.g. whole minutes)
+        return int(now // self.interval)
+
+    def seconds_left(self, now: float) -> float:
+        return self.interval - (now % self.interval)
+
+
+class RateLimiter:
+    """Token buckets for each limit published by the exchange
+
+    REQUEST_WEIGHT limits are charged the weight of the request, ORDERS limits are
+    charged the number of orders placed, and any other REQUEST limit (e.g.
+    RAW_REQUESTS) is charged 1 per call.
+
+    Attach the limiter to a requests session with `attach` so that it can follow
+    the usage reported by the server and back off on 429/418 responses.
+
+    Request limits are counted per IP address while order limits are counted per
+    account, so several accounts sharing one IP should each use a limiter for their
+    ORDERS limits with a single shared *parent* limiter for the REQUEST limits.
+    """
+
+    def __init__(
+        self,
+        rate_limits: List[Dict],
+        burst_fraction: float = BURST_FRACTION,
+        limit_types: Optional[Iterable[str]] = None,
+        parent: Optional["RateLimiter"] = None,
+    ):
+        """Create buckets for the published *rate_limits*
+
+        :param rate_limits: `rateLimits` from exchangeInfo
+        :param burst_fraction: fraction of each limit that may be spent at once
+        :param limit_types: only enforce limits of these types, e.g. ["ORDERS"].
+            Default is all published limits
+        :param parent: limiter that every request must also acquire from, and which
+            is shown every response. It handles 429/418 back-off for both
+        """
+
+        self.log = Logger(__name__.split(".", 1)[-1])
+        self.parent = parent
+        self._limits: Dict[str, _Limit] = {}
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+        for limit in rate_limits:
+            if limit_types is not None and limit["rateLimitType"] not in limit_types:
+                continue
+            interval_num = int(limit.get("intervalNum", 1))
+            interval = interval_num * INTERVAL_SECONDS[limit["interval"]]
+            name = limit_name(limit["rateLimitType"], interval_num, limit["interval"])
+            self._limits[name] = _Limit(int(limit["limit"]), interval, burst_fraction)
+
+    def _charge(self, name: str, weight: int, orders: int) -> int:
+        if name.startswith("REQUEST_WEIGHT"):
+            return weight
+        if name.startswith("ORDERS"):
+            return orders
+        return 1
+
+    def acquire(self, weight: int = 1, orders: int = 0) -> float:
+        """Block until a request of the given *weight* can be sent
+
+        :param weight: weight assigned to this type of request
+        :param orders: number of orders the request will place
+        :return: number of seconds spent waiting
+        """
+
+        waited = self.parent.acquire(weight, orders) if self.parent else 0.0
+        blocked = self._blocked_until - time.time()
+        if blocked > 0:
+            time.sleep(blocked)
+            waited += blocked
+
+        wait = 0.0
+        for name, limit in self._limits.items():
+            tokens = self._charge(name, weight, orders)
+            if not tokens:
+                continue
+            with self._lock:
+                limit.in_flight.append(tokens)
+            wait = max(wait, limit.bucket.reserve(tokens))
+
+        if wait > 0:
+            time.sleep(wait)
+        return waited + wait
+
+    def observe(self, status_code: int, headers: Mapping[str, str]) -> None:
+        """Update the limiter from the status and headers of an API response
+
+        :param status_code: HTTP status code of the response
+        :param headers: HTTP response headers
+        :return: None
+        """
+
+        if self.parent is not None:
+            self.parent.observe(status_code, headers)
+
+        now = time.time()
+        with self._lock:
+            for limit in self._limits.values():
+                if limit.in_flight:
+                    limit.in_flight.popleft()
+
+            for header, value in headers.items():
+                match = USAGE_HEADER.match(header.lower())
+                if match is None:
+                    continue
+                kind, num, unit = match.groups()
+                # Older API versions report used weight without an interval suffix
+                name = limit_name(HEADER_LIMIT_TYPES[kind], int(num or 1), unit or "M")
+                if name in self._limits:
+                    self._sync(self._limits[name], int(value), now)
+
+        if status_code in (418, 429) and self.parent is None:
+            retry_after = headers.get("Retry-After")
+            self.block(int(retry_after) if retry_after else DEFAULT_RETRY_AFTER)
+            self.log.warning(
+                f"Received HTTP {status_code} from server, "
+                f"requests blocked for {self.blocked_for:.0f}s"
+            )
+
+    def _sync(self, limit: _Limit, used: int, now: float) -> None:
+        """Re-anchor a bucket so it spends exactly the server-reported headroom by
+        the end of the current window, taking requests still in flight into account
+        """
+
+        # Requests in flight are kept across windows: those still waiting on the
+        # bucket will be counted in the new window once they are sent
+        limit.window = limit.current_window(now)
+        limit.used = used
+
+        headroom = limit.limit - used - sum(limit.in_flight)
+        refill = limit.bucket.rate * limit.seconds_left(now)
+        limit.bucket.set_tokens(min(limit.limit, headroom - refill))
+
+    def block(self, seconds: float) -> None:
+        """Stop all requests for *seconds*, e.g. after a 429 Retry-After
+
+        :param seconds: how long to block for
+        :return: None
+        """
+
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.time() + seconds)
+        for limit in self._limits.values():
+            limit.bucket.set_tokens(0)
+
+    @property
+    def blocked_for(self) -> float:
+        parent_blocked = self.parent.blocked_for if self.parent else 0.0
+        return max(0.0, parent_blocked, self._blocked_until - time.time())
+
+    def budget(self) -> Dict[str, Dict[str, Any]]:
+        """Report the current state of every limit
+
+        :return: dict keyed by limit name (e.g. "REQUEST_WEIGHT_1M"), with the
+            published *limit*, the server-reported *used* count for the current
+            window (None if unknown), the *remaining* count, the number of tokens
+            *available* to send right now, and *resets_in* seconds
+        """
+
+        now = time.time()
+        budget = self.parent.budget() if self.parent else {}
+        with self._lock:
+            for name, limit in self._limits.items():
+                used = limit.used if limit.window == limit.current_window(now) else None
+                budget[name] = {
+                    "limit": limit.limit,
+                    "used": used,
+                    "remaining": limit.limit - (used or 0),
+                    "available": limit.bucket.available,
+                    "resets_in": limit.seconds_left(now),
+                }
+        return budget
+
+    def hook(self, response, *args, **kwargs) -> None:
+        """Response hook for `requests`, see `attach`"""
+
+        self.observe(response.status_code, response.headers)
+
+    def attach(self, session) -> None:
+        """Observe every response received through a requests.Session
+
+        :param session: requests.Session, e.g. `binance.client.Client.session`
+        :return: None
+        """
+
+        session.hooks["response"].append(self.hook)
+
+    def __repr__(self) -> str:
+        limits = ", ".join(
+            f"{name}={limit.limit}/{limit.interval}s"
+            for name, limit in self._limits.items()
+        )
+        if self.parent is not None:
+            return f"RateLimiter({limits}, parent={self.parent!r})"
+        return f"RateLimiter({limits})"
@@ -17,9 +17,12 @@
 # FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
 # OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
+import atexit
 import json
 import os
-from typing import Any, Dict, List, Tuple
+import threading
+import time
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
 
 import toml
 from logbook import Logger
@@ -30,85 +33,217 @@ from binance_monitor.util import is_yes_response
 USER_FOLDER = os.path.join(os.path.expanduser("~"), ".binance-monitor")
 LOG_FILENAME = os.path.join(USER_FOLDER, "logs", "app.log")
 API_KEY_FILENAME = os.path.join(USER_FOLDER, "config", "api_cred.json")
+PROFILES_FILENAME = os.path.join(USER_FOLDER, "config", "profiles.json")
 ACCOUNT_STORE_FOLDER = os.path.join(USER_FOLDER, "account_data")
 PREFERENCES = os.path.join(USER_FOLDER, "preferences.toml")
+EXCHANGE_INFO_CACHE = os.path.join(USER_FOLDER, "cache", "exchange_info.json.gz")
 
-log = Logger(__name__.split(".", 1)[-1])
-
+# Default age in seconds after which cached exchange metadata is refreshed
+EXCHANGE_INFO_TTL = 6 * 60 * 60
 
-def _load_prefs() -> Dict[str, Any]:
-    """Load user preferences from TOML and return as a dict
+# Ways of storing trades on disk, see `store.open_store`. The first is the default
+STORE_BACKENDS = ["hdf", "parquet"]
 
-    :return: dict containing user preferences
-    """
+# Changes are written to disk this many seconds after the first unsaved change, so
+# that bursts of changes result in a single write
+WRITE_DELAY = 1.0
 
-    try:
-        return dict(toml.load(PREFERENCES))
-    except (IOError, toml.TomlDecodeError):
-        log.info(f"{PREFERENCES} could not be opened or decoded for preferences")
-        return {"title": "binance-monitor preferences"}
+# Minimum seconds between checks of whether the file was changed by another process
+RELOAD_CHECK_INTERVAL = 2.0
 
+log = Logger(__name__.split(".", 1)[-1])
 
-def _save_prefs(prefs: dict) -> None:
-    """Save a dictionary with user preferences to TOML
 
-    Current preferences file will be overwritten with no checking
+class Preferences:
+    """Process-wide, in-memory copy of the preferences TOML file
 
-    :param prefs: dictionary containing new user preferences
-    :return: None
+    Reads are served from memory. The file is re-read if another process changes
+    it, and changes made here are written back in batches, atomically, by writing
+    a temporary file and renaming it over the original
     """
-    with open(PREFERENCES, "w") as toml_file:
-        toml.dump(prefs, toml_file)
+
+    def __init__(self, path: str, write_delay: float = WRITE_DELAY):
+        self.path = path
+        self.write_delay = write_delay
+        self._lock = threading.RLock()
+        self._prefs: Optional[Dict[str, Any]] = None
+        self._blacklist: Optional[FrozenSet[str]] = None
+        self._mtime: Optional[float] = None
+        self._last_check = 0.0
+        self._dirty = False
+        self._write_timer: Optional[threading.Timer] = None
+        atexit.register(self.flush)
+
+    @property
+    def lock(self) -> threading.RLock:
+        """Hold this to make a read-modify-write of several values atomic"""
+
+        return self._lock
+
+    def _load(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.path)
+            prefs = dict(toml.load(self.path))
+        except (IOError, toml.TomlDecodeError):
+            log.info(f"{self.path} could not be opened or decoded for preferences")
+            mtime, prefs = None, {"title": "binance-monitor preferences"}
+        self._mtime = mtime
+        self._set_prefs(prefs)
+
+    def _set_prefs(self, prefs: Dict[str, Any]) -> None:
+        self._prefs = prefs
+        blacklist = prefs.get("blacklist", None)
+        self._blacklist = None if blacklist is None else frozenset(blacklist)
+
+    def _current(self) -> Dict[str, Any]:
+        """Return the in-memory preferences, loading or reloading them if needed"""
+
+        now = time.monotonic()
+        if self._prefs is None:
+            self._load()
+        elif not self._dirty and now - self._last_check > RELOAD_CHECK_INTERVAL:
+            try:
+                mtime: Optional[float] = os.path.getmtime(self.path)
+            except OSError:
+                mtime = None
+            if mtime != self._mtime:
+                log.info(f"{self.path} changed on disk, reloading preferences")
+                self._load()
+        self._last_check = now
+        return self._prefs
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            return self._current().get(key, default)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._current())
+
+    def blacklist(self) -> Optional[FrozenSet[str]]:
+        """The blacklist as a set, or None if no blacklist has been set"""
+
+        with self._lock:
+            self._current()
+            return self._blacklist
+
+    def update(self, changes: Dict[str, Any]) -> None:
+        """Change values in memory, and schedule a write to disk
+
+        :param changes: dict of new values
+        :return: None
+        """
+
+        with self._lock:
+            prefs = dict(self._current())
+            prefs.update(changes)
+            self._set_prefs(prefs)
+            self._dirty = True
+            if self._write_timer is None:
+                self._write_timer = threading.Timer(self.write_delay, self.flush)
+                self._write_timer.daemon = True
+                self._write_timer.start()
+
+    def flush(self) -> None:
+        """Write any unsaved changes to disk now"""
+
+        with self._lock:
+            if self._write_timer is not None:
+                self._write_timer.cancel()
+                self._write_timer = None
+            if not self._dirty:
+                return
+
+            tmp_path = util.ensure_dir(self.path) + ".tmp"
+            with open(tmp_path, "w") as toml_file:
+                toml.dump(self._prefs, toml_file)
+            os.replace(tmp_path, self.path)
+            self._mtime = os.path.getmtime(self.path)
+            self._dirty = False
+
+
+_preferences = Preferences(PREFERENCES)
 
 
 def write_symbols(active_symbols: List, inactive_symbols: List) -> None:
-    prefs = _load_prefs()
-    prefs.update(
+    _preferences.update(
         {
             "active_symbols": active_symbols,
             "inactive_symbols": inactive_symbols,
             "all_symbols": active_symbols + inactive_symbols,
         }
     )
-    _save_prefs(prefs)
+
+
+def exchange_info_ttl() -> int:
+    """Seconds before cached exchange metadata is refreshed, which can be set with
+    `exchange_info_ttl` in preferences.toml
+    """
+
+    return int(_preferences.get("exchange_info_ttl", EXCHANGE_INFO_TTL))
+
+
+def store_backend() -> str:
+    """How trades are stored, which can be set with `store_backend` in
+    preferences.toml to one of *STORE_BACKENDS*
+    """
+
+    backend = _preferences.get("store_backend", STORE_BACKENDS[0])
+    if backend not in STORE_BACKENDS:
+        raise ValueError(f"store_backend must be one of {STORE_BACKENDS}: {backend}")
+    return backend
+
+
+def set_store_backend(backend: str) -> None:
+    if backend not in STORE_BACKENDS:
+        raise ValueError(f"store_backend must be one of {STORE_BACKENDS}: {backend}")
+    _preferences.update({"store_backend": backend})
 
 
 def read_symbols(which_symbols="ALL"):
     if which_symbols.upper() not in ["ACTIVE", "INACTIVE", "ALL"]:
         raise ValueError("Must specify which symbols to read (active, inactive, all)")
     key = f"{which_symbols}_symbols"
-    return _load_prefs()[key]
+    symbols = _preferences.get(key)
+    if symbols is None:
+        raise KeyError(f"{key} not found in preferences")
+    return list(symbols)
 
 
 class Blacklist:
     @staticmethod
     def get():
-        return _load_prefs().get("blacklist", None)
+        blacklist = _preferences.blacklist()
+        return None if blacklist is None else sorted(blacklist)
+
+    @staticmethod
+    def contains(symbol: str) -> bool:
+        blacklist = _preferences.blacklist()
+        return blacklist is not None and symbol in blacklist
 
     @staticmethod
     def set(new_blacklist):
-        prefs = _load_prefs()
-        prefs.update({"blacklist": new_blacklist})
-        _save_prefs(prefs)
+        _preferences.update({"blacklist": sorted(set(new_blacklist))})
         log.info(f"Set new blacklist: {new_blacklist}")
 
     @staticmethod
     def remove(to_remove):
         if not isinstance(to_remove, list):
             to_remove = [to_remove]
-        to_remove = set(to_remove)
-        current = set(Blacklist.get())
 
-        if to_remove and current:
-            Blacklist.set(list(current - to_remove))
-            log.info(f"Removed from blacklist: {to_remove}")
+        with _preferences.lock:
+            removed = (_preferences.blacklist() or frozenset()) & set(to_remove)
+            if removed:
+                Blacklist.set(_preferences.blacklist() - removed)
+                log.info(f"Removed from blacklist: {removed}")
 
     @staticmethod
     def add(to_add):
         if not isinstance(to_add, list):
             to_add = [to_add]
-        new_blacklist = list(set(Blacklist.get() + to_add))
-        Blacklist.set(new_blacklist)
+
+        with _preferences.lock:
+            Blacklist.set((_preferences.blacklist() or frozenset()) | set(to_add))
         log.info(f"Added to blacklist: {to_add}")
 
 
@@ -151,6 +286,40 @@ def get_credentials() -> Tuple[str, str]:
         return _request_credentials()
 
 
+def load_profiles(names: Optional[List[str]] = None) -> Dict[str, Tuple[str, str]]:
+    """Load API credentials for several accounts
+
+    Profiles are stored in *PROFILES_FILENAME* as a JSON object keyed by account
+    name, where each value has the same "binance_key" and "binance_secret" fields as
+    the single-account credentials file
+
+    :param names: account names to load. Default is every profile in the file
+    :return: dict of account name to (API key, API secret)
+    :raises: IOError if the file cannot be read, or a profile is missing or invalid
+    """
+
+    cache_file = PROFILES_FILENAME
+
+    if not os.path.exists(cache_file):
+        raise IOError(f"Could not load credential profiles from {cache_file}")
+
+    with open(cache_file, "r") as profiles_file:
+        profiles = json.load(profiles_file)
+
+    names = list(profiles) if not names else names
+    credentials = {}
+    for name in names:
+        profile = profiles.get(name) or {}
+        api_key = profile.get("binance_key", None)
+        api_secret = profile.get("binance_secret", None)
+        if not api_key or not api_secret:
+            raise IOError(f"{cache_file} did not contain valid credentials for {name}")
+        credentials[name] = (api_key, api_secret)
+
+    log.info(f"Loaded credential profiles for {', '.join(credentials)}")
+    return credentials
+
+
 def _request_credentials() -> Tuple[str, str]:
     """Prompt user to enter API key and secret. Prompt user to save credentials
     to disk for future use (unencrypted)
@@ -18,107 +18,775 @@
 # OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 import atexit
+import gzip
+import json
 import os
-from typing import List, Optional
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
 import pandas as pd
 from logbook import Logger
 
-from binance_monitor import util
+from binance_monitor import amounts, metrics, profiling, settings, util
+from binance_monitor.amounts import AMOUNT_COLS
+from binance_monitor.journal import Checkpointer, TradeJournal
 from binance_monitor.settings import ACCOUNT_STORE_FOLDER
 from binance_monitor.trade import TaxTrade
 
-pd.set_option("precision", 9)
+pd.set_option("display.precision", 9)
+
+# Indexed column holding `TaxTrade.key`, from which the key index is loaded
+KEY_COL = "trade_key"
+SYMBOL_COL = "symbol"
+
+# Type of the dtime column in memory and on disk
+DTIME_DTYPE = "datetime64[ns, UTC]"
+
+# Columns written as indexed HDF data columns, which can be used in `query`
+DATA_COLUMNS = ["dtime", "buy_currency", "sell_currency", "mark", SYMBOL_COL, KEY_COL]
+
+# Width reserved for string columns, since a table cannot grow them after creation
+MIN_ITEMSIZE = {
+    "kind": 24,
+    "buy_currency": 16,
+    "sell_currency": 16,
+    "fee_currency": 16,
+    "exchange": 16,
+    "comment": 64,
+    SYMBOL_COL: 32,
+    KEY_COL: 64,
+}
+
+# Live trades are journaled and buffered until this many are waiting, or for at
+# most this many seconds, and then merged and written to disk as one batch by a
+# background checkpointer
+FLUSH_COUNT = 100
+FLUSH_INTERVAL = 5.0
+
+# Rows read from disk at a time by `to_csv`
+EXPORT_CHUNKSIZE = 50000
 
 
 class TradeStore:
+    """Trades of one account, kept in a single HDF5 table
+
+    Subclasses may store trades differently by overriding the methods which touch
+    the file, see `parquet_store.ParquetTradeStore`
+    """
+
     log = Logger(__name__.split(".", 1)[-1])
 
-    def __init__(self, acct_name):
+    # Appended to the account name to give `file_path`
+    FILE_EXTENSION = ".h5"
+
+    def __init__(
+        self,
+        acct_name,
+        flush_count: int = FLUSH_COUNT,
+        flush_interval: float = FLUSH_INTERVAL,
+        precisions: Optional[Dict[str, int]] = None,
+    ):
+        """Open the store of an account, creating it if needed
+
+        :param acct_name: account nickname, which names the file
+        :param flush_count: live trades buffered before they are saved
+        :param flush_interval: most seconds a live trade stays buffered
+        :param precisions: decimal places of each asset, used to choose the scale of
+            assets not stored before, see `exchange.Exchange.asset_precisions`
+        """
+
         self.nickname = acct_name
-        self.file_path = os.path.join(ACCOUNT_STORE_FOLDER, self.nickname) + ".h5"
+        self.file_path = (
+            os.path.join(ACCOUNT_STORE_FOLDER, self.nickname) + self.FILE_EXTENSION
+        )
         util.ensure_dir(self.file_path)
+        self._recover_rewrite()
 
-        self.trades: Optional[pd.DataFrame]
-        try:
-            self.trades: pd.DataFrame = pd.read_hdf(self.file_path, key="taxtrades")
-        except (KeyError, IOError) as exc:
-            self.trades = None
-            self.log.warn(f"Could not read {self.file_path} because {exc}")
+        # Trades are only read from disk when first needed (see `trades`). Trades
+        # added since the last save are kept separately until they are appended
+        self._loaded: Optional[pd.DataFrame] = None
+        self._new: Optional[pd.DataFrame] = None
+
+        # Per-symbol high-water marks: {symbol: {"id": last trade id, "time": ms}}
+        self.sync_state: Dict[str, Dict[str, int]] = self._load_sync_state()
+
+        # Amounts are stored as int64 units of 10**-scale of their currency
+        self.scales = amounts.AssetScales(self._load_scales(), precisions)
+
+        # Sync state and scales as last saved, so that checkpoints with nothing new
+        # leave the file alone, and whether the file is known to be in the current
+        # format (see `_is_legacy_format`)
+        self._saved_state = self._state_snapshot()
+        self._format_current = False
 
         self.col_names = TaxTrade.COL_NAMES
 
+        # Live trades waiting to be merged, as tuples in *col_names* order. Guarded
+        # by `_buffer_lock`, which is never held during disk I/O on the store
+        self._pending: List[tuple] = []
+
+        # `TaxTrade.key` of every trade in the store, saved or not, so that a trade
+        # already stored is rejected with one lookup. Read from disk when first
+        # needed (see `_load_keys`), so opening the store stays cheap. Also guarded
+        # by `_buffer_lock`
+        self._keys: Optional[Set[str]] = None
+        self.flush_count = flush_count
+        self.flush_interval = flush_interval
+        self._flush_stats = {"flushes": 0, "rows": 0, "last_rows": 0, "last_secs": 0.0}
+        self._lock = threading.RLock()
+        self._buffer_lock = threading.Lock()
+        # Serializes updates of `sync_state`
+        self._state_lock = threading.Lock()
+        self._checkpointer: Optional[Checkpointer] = None
+
+        journal_path = os.path.splitext(self.file_path)[0] + ".journal"
+        replayed = self._replay_journal(journal_path)
+        self.journal = TradeJournal(journal_path)
+        # Even if every trade replayed was stored already, so it is not replayed again
+        if replayed:
+            self.flush()
+
         atexit.register(self._save_on_exit)
 
+    def _recover_rewrite(self) -> None:
+        """Finish a `_rewrite` that was interrupted. An HDF5 file is replaced in one
+        step, so there is nothing to do
+        """
+
+    def _load_sync_state(self) -> Dict[str, Dict[str, int]]:
+        try:
+            state_df: pd.DataFrame = pd.read_hdf(self.file_path, key="sync_state")
+            return state_df.to_dict(orient="index")
+        except (KeyError, IOError):
+            self.log.info(f"No sync state in {self.file_path}, full history required")
+            return {}
+
+    def _load_scales(self) -> Dict[str, int]:
+        try:
+            scales_df: pd.DataFrame = pd.read_hdf(self.file_path, key="asset_scales")
+            return scales_df["scale"].to_dict()
+        except (KeyError, IOError):
+            return {}
+
+    def _state_snapshot(self) -> Tuple[Dict[str, Dict[str, int]], Dict[str, int]]:
+        return (
+            {symbol: dict(state) for symbol, state in self.sync_state.items()},
+            dict(self.scales),
+        )
+
+    def _write_state(self, store: pd.HDFStore) -> None:
+        """Write the sync state and asset scales, which are small and rewritten"""
+
+        if self.sync_state:
+            state_df = pd.DataFrame.from_dict(self.sync_state, orient="index")
+            store.put("sync_state", state_df.astype("int64"), format="table")
+        if self.scales:
+            scales_df = pd.DataFrame({"scale": pd.Series(self.scales, dtype="int64")})
+            store.put("asset_scales", scales_df, format="table")
+
+    def _replay_journal(self, journal_path: str) -> int:
+        """Buffer trades left in the journal by a process that did not exit cleanly
+
+        :return: number of records left in the journal
+        """
+
+        records = TradeJournal.replay(journal_path)
+        if records:
+            self._load_keys()
+        for record in records:
+            # Older journals hold dicts rather than rows in *COL_NAMES* order
+            trade = (
+                TaxTrade(**record) if isinstance(record, dict) else TaxTrade(*record)
+            )
+            if trade.key not in self._keys:
+                self._keys.add(trade.key)
+                self._pending.append(trade.as_tuple)
+        if self._pending:
+            self.log.notice(
+                f"Recovered {len(self._pending)} trades from {journal_path}"
+            )
+        return len(records)
+
+    @property
+    def trades(self) -> Optional[pd.DataFrame]:
+        """All trades, both on disk and not yet saved, loading the file if needed
+
+        Prefer `query` where possible, which only reads the rows it needs
+
+        :return: DataFrame of trades, or None if there are none
+        """
+
+        with self._lock:
+            self._merge_pending()
+            if self._loaded is None and self._has_trades_on_disk():
+                with profiling.span("store load"):
+                    # Files from before amounts were stored as units hold floats
+                    self._loaded = amounts.frame_to_units(
+                        self._read_trades(), self.scales
+                    )
+            if self._new is None:
+                return self._loaded
+            if self._loaded is None:
+                return self._new
+            return pd.concat([self._loaded, self._new], ignore_index=True, sort=False)
+
+    def _read_trades(self) -> pd.DataFrame:
+        return pd.read_hdf(self.file_path, key="taxtrades")
+
+    def _read_keys(self) -> Set[str]:
+        """Keys of the trades on disk, reading only the key column if possible"""
+
+        if not self._has_trades_on_disk():
+            return set()
+        if self._is_legacy_format():
+            return set(TaxTrade.keys_for(self._read_trades()))
+        with pd.HDFStore(self.file_path, mode="r") as store:
+            return set(store.select_column("taxtrades", KEY_COL))
+
+    def _load_keys(self) -> None:
+        """Read the key index from disk, if that has not been done yet"""
+
+        if self._keys is not None:
+            return
+        # Under the store lock, so that no flush writes while the keys are read.
+        # Nothing can be added before then, as adding trades needs the index
+        with self._lock:
+            if self._keys is None:
+                with profiling.span("key index"):
+                    keys = self._read_keys()
+                with self._buffer_lock:
+                    self._keys = keys
+
+    def _claim_keys(self, keys: Iterable[str]) -> List[bool]:
+        """Add *keys* to the key index
+
+        :param keys: `TaxTrade.key` of each trade to be added
+        :return: for each key, True if it was not already in the store or earlier
+            in *keys*
+        """
+
+        self._load_keys()
+        is_new = []
+        with self._buffer_lock:
+            for key in keys:
+                if key in self._keys:
+                    is_new.append(False)
+                else:
+                    self._keys.add(key)
+                    is_new.append(True)
+        return is_new
+
+    def _has_trades_on_disk(self) -> bool:
+        if not os.path.exists(self.file_path):
+            return False
+        with pd.HDFStore(self.file_path, mode="r") as store:
+            return "/taxtrades" in store.keys()
+
     def _save_on_exit(self):
         self.log.notice("Program terminated, saving data to disk")
-        self._clean()
-        self._save()
+        self.close()
+
+    def close(self) -> None:
+        """Save all trades and close the journal. The store must not be used after"""
+
+        atexit.unregister(self._save_on_exit)
+        if self._checkpointer is not None:
+            self._checkpointer.stop()
+        self.flush()
+        self.journal.close()
+
+    def save(self) -> None:
+        """Write any trades added since the last save to disk"""
+
+        self.flush()
+
+    def flush(self) -> None:
+        """Checkpoint: merge buffered live trades into `trades`, append new rows to
+        disk, and then drop the journaled copies of those trades
+        """
+
+        with self._lock:
+            start = time.perf_counter()
+            with self._buffer_lock:
+                rows, self._pending = self._pending, []
+                self.journal.rotate()
+
+            if rows:
+                try:
+                    self._merge(self._rows_to_frame(rows))
+                except Exception:
+                    with self._buffer_lock:
+                        self._pending = rows + self._pending
+                    raise
+
+            state = self._state_snapshot()
+            if self._new is None and state == self._saved_state:
+                # Nothing to write, as on most ticks of the checkpointer
+                self.journal.discard_checkpoint()
+                return
+
+            written = 0 if self._new is None else len(self._new)
+            self._save()
+            self._saved_state = state
+            self._format_current = True
+            self.journal.discard_checkpoint()
+
+            elapsed = time.perf_counter() - start
+            metrics.observe("store_flush_seconds", elapsed, account=self.nickname)
+            metrics.observe(
+                "store_flush_rows",
+                written,
+                buckets=metrics.SIZE_BUCKETS,
+                account=self.nickname,
+            )
+            metrics.set_gauge("store_rows", self._row_count(), account=self.nickname)
+
+            if rows:
+                self._flush_stats["flushes"] += 1
+                self._flush_stats["rows"] += len(rows)
+                self._flush_stats["last_rows"] = len(rows)
+                self._flush_stats["last_secs"] = elapsed
+
+    def _row_count(self) -> int:
+        """Number of trades held in memory"""
+
+        loaded = 0 if self._loaded is None else len(self._loaded)
+        return loaded + (0 if self._new is None else len(self._new))
+
+    def _rows_to_frame(self, rows: List[tuple]) -> pd.DataFrame:
+        batch = pd.DataFrame(rows, columns=self.col_names)
+        amounts.frame_to_units(batch, self.scales)
+        return self._with_index_columns(batch)
+
+    def _merge_pending(self) -> None:
+        """Merge buffered live trades into `trades` without writing to disk
+
+        The trades stay in the journal until the next checkpoint
+        """
+
+        with self._buffer_lock:
+            rows, self._pending = self._pending, []
+        if rows:
+            self._merge(self._rows_to_frame(rows))
+
+    @property
+    def trade_count(self) -> int:
+        """Number of trades in the store, saved or not"""
+
+        self._load_keys()
+        with self._buffer_lock:
+            return len(self._keys)
+
+    @property
+    def flush_stats(self) -> Dict[str, Any]:
+        """Counters for buffered live trades
+
+        :return: dict with the number of *flushes* so far, total *rows* flushed, the
+            size and duration of the last flush (*last_rows*, *last_secs*), and the
+            number of trades *pending* in the buffer
+        """
+
+        with self._buffer_lock:
+            pending = len(self._pending)
+        with self._lock:
+            return dict(self._flush_stats, pending=pending)
 
     def _save(self) -> None:
-        """Write out trade tax events to HDF file.
+        """Append trade tax events added since the last save to the HDF file.
 
-        This will overwrite any trade tax data already in the file, but will leave
-        any other HDFStore keys untouched
+        Duplicates were already rejected by `update` and `add_trade`. Other HDFStore
+        keys are left untouched, apart from the sync state which is small and rewritten.
+        A file written before keys were stored is compacted instead
         """
 
-        if self.trades is not None:
-            with pd.HDFStore(self.file_path, mode="a") as store:
-                store.put("taxtrades", self.trades, format="table", append=False)
+        if not self._format_current and self._is_legacy_format():
+            self._rewrite()
+            return
+
+        with profiling.span("save"), pd.HDFStore(self.file_path, mode="a") as store:
+            if self._new is not None:
+                self._append(store)
+            self._write_state(store)
 
-    def _clean(self) -> None:
-        """Remove duplicates from in-memory DataFrame, sort by *dtime*, and
-        reset the index
+    def _is_legacy_format(self) -> bool:
+        """True if the file holds trades written without the current data columns,
+        or with float amounts
         """
 
-        if self.trades is not None and not self.trades.empty:
-            self.trades = (
-                self.trades.drop_duplicates()
+        if not self._has_trades_on_disk():
+            return False
+        with pd.HDFStore(self.file_path, mode="r") as store:
+            data_columns = store.get_storer("taxtrades").data_columns or []
+            if not set(DATA_COLUMNS).issubset(data_columns):
+                return True
+            first = store.select("taxtrades", start=0, stop=1, columns=AMOUNT_COLS)
+        return not all(pd.api.types.is_integer_dtype(t) for t in first.dtypes)
+
+    def _with_index_columns(self, trades: pd.DataFrame) -> pd.DataFrame:
+        trades = trades[self.col_names].copy()
+        # Frames from different sources may differ in datetime resolution, and
+        # would not concatenate or append to the file as datetimes
+        trades["dtime"] = pd.to_datetime(trades["dtime"], utc=True).astype(DTIME_DTYPE)
+        trades[SYMBOL_COL] = TaxTrade.symbols_for(trades)
+        trades[KEY_COL] = TaxTrade.keys_for(trades)
+        return trades
+
+    def _append(self, store: pd.HDFStore) -> None:
+        new_rows = self._new
+        if not new_rows.empty:
+            store.append(
+                "taxtrades",
+                new_rows,
+                format="table",
+                data_columns=DATA_COLUMNS,
+                min_itemsize=MIN_ITEMSIZE,
+            )
+            self.log.info(f"Appended {len(new_rows)} trades to {self.file_path}")
+            if self._loaded is not None:
+                self._loaded = pd.concat([self._loaded, new_rows], ignore_index=True)
+        self._new = None
+
+    def compact(self) -> None:
+        """Rewrite the HDF file with all trades de-duplicated and sorted by time
+
+        Appending never reclaims space or re-orders rows on disk, so this should be
+        run occasionally. The file is written to a temporary copy and then moved
+        into place, so an interrupted compaction leaves the original intact
+        """
+
+        with self._lock:
+            self.flush()
+            self._rewrite()
+
+    def _rewrite(self) -> None:
+        trades = self.trades
+        if trades is None:
+            return
+
+        with profiling.span("clean"):
+            trades = (
+                self._with_index_columns(trades)
+                .drop_duplicates(subset=KEY_COL)
                 .sort_values("dtime")
                 .reset_index(drop=True)
             )
 
+        tmp_path = self.file_path + ".compact"
+        with profiling.span("save"), pd.HDFStore(tmp_path, mode="w") as new_store:
+            new_store.put(
+                "taxtrades",
+                trades,
+                format="table",
+                data_columns=DATA_COLUMNS,
+                min_itemsize=MIN_ITEMSIZE,
+            )
+            self._write_state(new_store)
+        os.replace(tmp_path, self.file_path)
+
+        self._loaded = trades
+        self._new = None
+        self.log.notice(f"Compacted {self.file_path} to {len(trades)} trades")
+
     def last_known_trade_timestamp(self) -> Optional[pd.Timestamp]:
-        """Return last known trade from in-memory DataFrame
+        """Return the time of the latest trade recorded
+
+        Only the *dtime* column is read from disk
 
         :return: pandas.Timestamp of the latest trade recorded if there are any
-            records in the DataFrame, otherwise None
+            records in the store, otherwise None
         """
 
-        if self.trades is not None and not self.trades.empty:
-            return self.trades["dtime"].max()
+        with self._lock:
+            self._merge_pending()
+            latest = []
+            if self._new is not None and not self._new.empty:
+                latest.append(self._new["dtime"].max())
+            if self._has_trades_on_disk():
+                with pd.HDFStore(self.file_path, mode="r") as store:
+                    dtimes = store.select_column("taxtrades", "dtime")
+                if not dtimes.empty:
+                    latest.append(dtimes.max())
 
-        return None
+        return max(latest) if latest else None
 
-    def update(self, trade_list: List[TaxTrade]) -> None:
-        new_trades = [trade.as_dict for trade in trade_list]
-        trade_df = pd.DataFrame(new_trades, columns=self.col_names)
+    def query(
+        self,
+        symbol: Union[str, List[str], None] = None,
+        currency: Union[str, List[str], None] = None,
+        start=None,
+        end=None,
+        trade_id: Union[int, List[int], None] = None,
+        chunksize: Optional[int] = None,
+    ) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+        """Read only the trades matching all of the given criteria from disk
 
-        for col in ["buy_amount", "sell_amount", "fee_amount"]:
-            trade_df[col] = pd.to_numeric(trade_df[col])
+        Selection is done by PyTables on the indexed data columns, so only matching
+        rows are read. Any unsaved trades are saved first.
 
-        if self.trades is not None:
-            self.trades = self.trades.append(
-                trade_df, ignore_index=True, verify_integrity=True, sort=True
+        :param symbol: symbol pair, or list of pairs, e.g. "ETHBTC"
+        :param currency: currency, or list of currencies, bought or sold
+        :param start: earliest trade time to include (anything pandas.Timestamp
+            accepts; naive times are taken as UTC)
+        :param end: trade time to stop before, as for *start*
+        :param trade_id: exchange trade ID, or list of IDs
+        :param chunksize: if given, return an iterator over DataFrames of at most
+            this many rows instead of a single DataFrame. The store is locked until
+            the iterator is exhausted or closed
+        :return: DataFrame (or iterator of DataFrames) of matching trades
+        """
+
+        terms = []
+        if symbol is not None:
+            terms.append(f"{SYMBOL_COL}={_as_list(symbol)!r}")
+        if currency is not None:
+            currencies = _as_list(currency)
+            terms.append(
+                f"(buy_currency={currencies!r} | sell_currency={currencies!r})"
             )
+        if start is not None:
+            terms.append(f"dtime>={_to_utc(start).isoformat()!r}")
+        if end is not None:
+            terms.append(f"dtime<{_to_utc(end).isoformat()!r}")
+        if trade_id is not None:
+            terms.append(f"mark={[int(i) for i in _as_list(trade_id)]!r}")
+
+        self.flush()
+        if chunksize is not None:
+            return self._select_chunks(terms, chunksize)
+
+        with self._lock:
+            if not self._has_trades_on_disk():
+                return pd.DataFrame(columns=self.col_names)
+            return pd.read_hdf(self.file_path, key="taxtrades", where=terms or None)
+
+    def _select_chunks(
+        self, terms: List[str], chunksize: int
+    ) -> Iterator[pd.DataFrame]:
+        with self._lock:
+            if not self._has_trades_on_disk():
+                return
+            with pd.HDFStore(self.file_path, mode="r") as store:
+                yield from store.select(
+                    "taxtrades", where=terms or None, chunksize=chunksize
+                )
+
+    def high_water_mark(self, symbol: str) -> Optional[int]:
+        """Return the id of the last trade stored for *symbol*
+
+        :param symbol: symbol pair listed on Binance
+        :return: trade id if any trades have been synced for *symbol*, otherwise None
+        """
+
+        state = self.sync_state.get(symbol)
+        return None if state is None else int(state["id"])
+
+    def update_high_water_marks(self, raw_trades: List[dict]) -> None:
+        """Advance per-symbol high-water marks from raw API trade dicts
+
+        Also called for each trade from the user data stream, so it does not wait
+        for a flush to finish
+
+        :param raw_trades: trades as returned by the `myTrades` endpoint, or with
+            the same "symbol", "id" and "time" fields
+        :return: None
+        """
+
+        with self._state_lock:
+            # Replaced rather than changed in place, so that a flush on another
+            # thread can write out the previous state
+            sync_state = dict(self.sync_state)
+            for trade in raw_trades:
+                state = sync_state.get(trade["symbol"])
+                if state is None or trade["id"] > state["id"]:
+                    sync_state[trade["symbol"]] = {
+                        "id": int(trade["id"]),
+                        "time": int(trade["time"]),
+                    }
+            self.sync_state = sync_state
+
+    def update(self, trade_list: Union[List[TaxTrade], pd.DataFrame]) -> None:
+        """Add trades to the in-memory DataFrame, skipping any already stored
+
+        :param trade_list: either a list of TaxTrade objects, or a DataFrame already
+            in store format such as from `TaxTrade.frame_from_historic_trades`,
+            with amounts as units at `scales`
+        :return: None
+        """
+
+        if isinstance(trade_list, pd.DataFrame):
+            trade_df = trade_list
         else:
-            self.trades = (
-                trade_df.drop_duplicates().sort_values("dtime").reset_index(drop=True)
-            )
+            new_trades = [trade.as_tuple for trade in trade_list]
+            trade_df = pd.DataFrame(new_trades, columns=self.col_names)
+            amounts.frame_to_units(trade_df, self.scales)
+
+        with profiling.span("clean"):
+            trade_df = self._with_index_columns(trade_df)
+            is_new = self._claim_keys(trade_df[KEY_COL])
+            if not all(is_new):
+                skipped = len(is_new) - sum(is_new)
+                self.log.info(f"Skipping {skipped} trades already in the store")
+                metrics.inc("store_duplicates_total", skipped, account=self.nickname)
+                trade_df = trade_df[is_new]
+
+        if not trade_df.empty:
+            with self._lock:
+                self._merge(trade_df)
+
+    def _merge(self, trade_df: pd.DataFrame) -> None:
+        """Add trades which are known not to be stored yet to `_new`
+
+        :param trade_df: trades with the columns added by `_with_index_columns`
+        """
+
+        if self._new is None:
+            self._new = trade_df.reset_index(drop=True)
+        else:
+            self._new = pd.concat([self._new, trade_df], ignore_index=True, sort=False)
+
+    def to_csv(
+        self,
+        symbol: Union[str, List[str], None] = None,
+        start=None,
+        end=None,
+        compress: bool = False,
+        incremental: bool = False,
+        chunksize: int = EXPORT_CHUNKSIZE,
+    ) -> str:
+        """Write trades out in ccGains CSV format, reading the store in chunks
+
+        The file is `<account>.csv`, or `<account>.csv.gz` if *compress* is set. Next
+        to it, a watermark file records the latest trade time written. With
+        *incremental*, trades up to the watermark are assumed to be in the file
+        already and only newer ones are appended, so the same filters should be
+        used every time. Trades which are stored later but with an earlier time,
+        e.g. by `--rebuild`, are only exported by a full export. Amounts are
+        written exactly, with the decimal places given by `scales`.
+
+        :param symbol: only export this symbol pair, or list of pairs
+        :param start: only export trades from this time on (see `query`)
+        :param end: only export trades before this time
+        :param compress: write gzip-compressed CSV
+        :param incremental: append to an earlier export instead of rewriting it
+        :param chunksize: number of trades read from disk at a time
+        :return: path of the CSV file
+        """
 
-    def to_csv(self):
-        if self.trades is None:
-            return
         csv_file = os.path.splitext(self.file_path)[0] + ".csv"
+        if compress:
+            csv_file += ".gz"
+        watermark_path = csv_file + ".watermark"
 
-        self.trades.to_csv(
-            csv_file, float_format="%.9f", index=False, columns=TaxTrade.COL_NAMES
-        )
-        self.log.notice(f"Wrote out trades to {csv_file}")
+        watermark, exported_keys = None, set()
+        if incremental and os.path.exists(csv_file):
+            watermark, exported_keys = _read_watermark(watermark_path)
+        if watermark is not None:
+            # Trades at the watermark time itself may not all have been exported
+            start = watermark if start is None else max(_to_utc(start), watermark)
 
-    def add_trade(self, new_trade: TaxTrade):
-        new_df = new_trade.to_dataframe()
-        self.trades = self.trades.append(
-            new_df, ignore_index=True, verify_integrity=True, sort=True
-        )
-        self.log.info(f"Added new tax trade to the store: {new_trade.as_dict}")
+        opener = gzip.open if compress else open
+        written = 0
+        latest, latest_keys = watermark, exported_keys
+        chunks = self.query(symbol=symbol, start=start, end=end, chunksize=chunksize)
+        with profiling.span("export"):
+            with opener(csv_file, "at" if watermark else "wt", newline="") as out:
+                if watermark is None:
+                    out.write(",".join(TaxTrade.COL_NAMES) + "\n")
+                for chunk in chunks:
+                    if exported_keys:
+                        chunk = chunk[~chunk[KEY_COL].isin(exported_keys)]
+                    if chunk.empty:
+                        continue
+                    amounts.frame_to_strings(chunk, self.scales).to_csv(
+                        out, header=False, index=False, columns=TaxTrade.COL_NAMES
+                    )
+                    written += len(chunk)
+
+                    chunk_latest = chunk["dtime"].max()
+                    at_latest = set(chunk.loc[chunk["dtime"] == chunk_latest, KEY_COL])
+                    if latest is None or chunk_latest > latest:
+                        latest, latest_keys = chunk_latest, at_latest
+                    elif chunk_latest == latest:
+                        latest_keys |= at_latest
+
+        if latest is not None:
+            _write_watermark(watermark_path, latest, latest_keys)
+        action = "Appended" if watermark else "Wrote out"
+        self.log.notice(f"{action} {written} trades to {csv_file}")
+        return csv_file
+
+    def add_trade(self, new_trade: TaxTrade) -> bool:
+        """Journal and buffer a live trade, to be saved at the next checkpoint
+
+        Only the journal write happens on the calling thread; merging and saving
+        are left to the background checkpointer
+
+        :return: False if the trade was already in the store, and was skipped
+        """
+
+        key = new_trade.key
+        row = new_trade.as_tuple
+        self._load_keys()
+        with self._buffer_lock:
+            if key in self._keys:
+                self.log.info(f"Skipping trade already in the store: {key}")
+                metrics.inc("store_duplicates_total", account=self.nickname)
+                return False
+            self._keys.add(key)
+            self.journal.append(row)
+            self._pending.append(row)
+            pending = len(self._pending)
+            if self._checkpointer is None:
+                self._checkpointer = Checkpointer(self.flush, self.flush_interval)
+                self._checkpointer.start()
+
+        metrics.set_gauge("store_pending_rows", pending, account=self.nickname)
+        if pending >= self.flush_count:
+            self._checkpointer.wake()
+        self.log.info(f"Added new tax trade to the store: {key}")
+        return True
+
+
+def open_store(acct_name: str, **kwargs) -> TradeStore:
+    """Open the trade store of an account with the backend set in preferences
+
+    :param acct_name: account nickname
+    :param kwargs: passed on to the store class
+    :return: `TradeStore`, or `parquet_store.ParquetTradeStore` if the
+        `store_backend` preference is "parquet"
+    """
+
+    if settings.store_backend() == "parquet":
+        from binance_monitor.parquet_store import ParquetTradeStore
+
+        return ParquetTradeStore(acct_name, **kwargs)
+    return TradeStore(acct_name, **kwargs)
+
+
+def _as_list(value) -> list:
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+
+def _read_watermark(path: str) -> Tuple[Optional[pd.Timestamp], Set[str]]:
+    """Time of the latest trade exported, and the keys of the trades at that time"""
+
+    try:
+        with open(path, "r") as watermark_file:
+            watermark = json.load(watermark_file)
+    except (IOError, ValueError):
+        return None, set()
+    return pd.Timestamp(watermark["dtime"]), set(watermark["keys"])
+
+
+def _write_watermark(path: str, dtime: pd.Timestamp, keys: Set[str]) -> None:
+    with open(path + ".tmp", "w") as watermark_file:
+        json.dump({"dtime": dtime.isoformat(), "keys": sorted(keys)}, watermark_file)
+    os.replace(path + ".tmp", path)
+
+
+def _to_utc(value) -> pd.Timestamp:
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        return timestamp.tz_localize("UTC")
+    return timestamp.tz_convert("UTC")
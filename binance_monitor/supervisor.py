@@ -0,0 +1,110 @@
+# MIT License
+#
+# Copyright (C) 2019 Anson VanDoren
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+# to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next paragraph) shall
+# be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Monitor several Binance accounts from a single process
+
+All accounts share one copy of the exchange metadata, one pool of HTTP connections
+and one limiter for the request limits that Binance counts per IP address. Each
+account keeps its own trade store and its own limiter for order limits, and the user
+data streams of every account are read on a single event loop.
+"""
+import asyncio
+from typing import Dict, List, Optional
+
+from binance.client import Client
+from logbook import Logger
+from requests.adapters import HTTPAdapter
+
+from binance_monitor import exchange, ratelimit, settings
+from binance_monitor.monitor import ACCOUNT_LIMIT_TYPES, AccountMonitor
+
+# Connections kept open to the API host, shared by every account
+POOL_SIZE = 32
+
+
+class Supervisor:
+    def __init__(
+        self, profiles: Optional[List[str]] = None, pool_size: int = POOL_SIZE
+    ):
+        """Create a monitor for each credential profile
+
+        :param profiles: names of the profiles to load from *PROFILES_FILENAME*.
+            Default is every profile
+        :param pool_size: maximum number of pooled connections to the API
+        :raises: ValueError if there are no profiles to monitor
+        """
+
+        self.log = Logger(__name__.split(".", 1)[-1])
+
+        credentials = settings.load_profiles(profiles)
+        if not credentials:
+            raise ValueError(f"No credential profiles in {settings.PROFILES_FILENAME}")
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+
+        # Exchange metadata is public, so any account's client can load it
+        first = next(iter(credentials.values()))
+        client = Client(*first)
+        client.session.mount("https://", self.adapter)
+        self.exchange_info = exchange.Exchange(client)
+
+        request_types = [
+            limit["rateLimitType"]
+            for limit in self.exchange_info.rate_limits
+            if limit["rateLimitType"] not in ACCOUNT_LIMIT_TYPES
+        ]
+        self.ip_limiter = ratelimit.RateLimiter(
+            self.exchange_info.rate_limits, limit_types=request_types
+        )
+
+        self.monitors: Dict[str, AccountMonitor] = {
+            name: AccountMonitor(
+                credentials=creds,
+                name=name,
+                exchange_info=self.exchange_info,
+                ip_limiter=self.ip_limiter,
+                adapter=self.adapter,
+            )
+            for name, creds in credentials.items()
+        }
+        self.log.notice(f"Supervising accounts: {', '.join(self.monitors)}")
+
+    async def listen(self) -> None:
+        """Listen to the user data streams of all accounts until stopped"""
+
+        await asyncio.gather(*[monitor.listen() for monitor in self.monitors.values()])
+
+    def stop(self) -> None:
+        for monitor in self.monitors.values():
+            monitor.stop_user_monitor()
+
+    def run(self) -> None:
+        """Listen to all accounts until interrupted with Ctrl+C"""
+
+        self.log.notice("Starting account monitor listeners. Press Ctrl+C to exit.")
+        loop = asyncio.get_event_loop()
+        task = loop.create_task(self.listen())
+        try:
+            loop.run_until_complete(task)
+        except KeyboardInterrupt:
+            self.stop()
+            if not task.done():
+                loop.run_until_complete(task)
+        self.log.notice("All account monitors have been shutdown")
@@ -1,13 +1,16 @@
 import datetime
+import sys
 from decimal import Decimal
 from typing import Optional, Union, List, Dict, Any
 from dateutil import tz
 
+from binance_monitor import amounts
 from binance_monitor.base import Symbol
 
+import numpy as np
 import pandas as pd
 
-pd.set_option("precision", 9)
+pd.set_option("display.precision", 9)
 
 
 class TaxTrade:
@@ -16,6 +19,20 @@ class TaxTrade:
     Based on https://github.com/probstj/ccGains.git project
     """
 
+    __slots__ = (
+        "kind",
+        "dtime",
+        "buycur",
+        "buyval",
+        "sellcur",
+        "sellval",
+        "feecur",
+        "feeval",
+        "exchange",
+        "mark",
+        "comment",
+    )
+
     def __init__(
         self,
         kind: str,
@@ -29,7 +46,7 @@ class TaxTrade:
         exchange: str = "",
         mark: str = "",
         comment: str = "",
-        default_timezone=Optional[datetime.tzinfo],
+        default_timezone: Optional[datetime.tzinfo] = None,
     ):
         """Create a trade object compatible with the ccGains tax library
 
@@ -108,6 +125,46 @@ class TaxTrade:
         # Internally, save as UTC
         self.dtime = self.dtime.tz_convert("UTC")
 
+    @classmethod
+    def from_exchange(
+        cls,
+        kind: str,
+        time_ms: int,
+        buy_currency: str,
+        buy_amount: Union[str, Decimal],
+        sell_currency: str,
+        sell_amount: Union[str, Decimal],
+        fee_currency: str,
+        fee_amount: Union[str, Decimal],
+        exchange: str = "Binance",
+        mark: Any = "",
+        comment: str = "",
+    ) -> "TaxTrade":
+        """Trusted constructor for trades reported by an exchange
+
+        Unlike `__init__`, amounts are not checked for sign (other than taking the
+        absolute fee) and the time is not parsed or localized, since exchange data is
+        already well-formed and timestamped in UTC
+
+        :param time_ms: milliseconds since Epoch (UTC), as reported by Binance
+        :return: new TaxTrade
+        """
+
+        trade = cls.__new__(cls)
+        # Only a handful of distinct kinds exist, e.g. "LIMIT BUY"
+        trade.kind = sys.intern(kind)
+        trade.dtime = pd.Timestamp(time_ms, unit="ms", tz="UTC")
+        trade.buycur = buy_currency
+        trade.buyval = Decimal(buy_amount)
+        trade.sellcur = sell_currency
+        trade.sellval = Decimal(sell_amount)
+        trade.feecur = fee_currency
+        trade.feeval = abs(Decimal(fee_amount))
+        trade.exchange = exchange
+        trade.mark = mark
+        trade.comment = comment
+        return trade
+
     COL_NAMES = [
         "kind",
         "dtime",
@@ -122,6 +179,24 @@ class TaxTrade:
         "comment",
     ]
 
+    @property
+    def as_tuple(self) -> tuple:
+        """Field values in *COL_NAMES* order"""
+
+        return (
+            self.kind,
+            self.dtime,
+            self.buycur,
+            self.buyval,
+            self.sellcur,
+            self.sellval,
+            self.feecur,
+            self.feeval,
+            self.exchange,
+            self.mark,
+            self.comment,
+        )
+
     @property
     def as_dict(self) -> Dict[str, Any]:
         return {
@@ -138,63 +213,78 @@ class TaxTrade:
             "comment": self.comment,
         }
 
-    def to_dataframe(self):
-        df = pd.DataFrame(self.as_dict, index=[0], columns=self.COL_NAMES)
-        for col in ["buy_amount", "sell_amount", "fee_amount"]:
-            df[col] = pd.to_numeric(df[col])
-        return df
+    @property
+    def symbol(self) -> str:
+        """Symbol pair of the trade (base + quote), e.g. "ETHBTC" """
+
+        if "BUY" in self.kind.upper():
+            return self.buycur + self.sellcur
+        return self.sellcur + self.buycur
+
+    @property
+    def key(self) -> str:
+        """Natural key of the trade, e.g. "Binance:ETHBTC:1234" for trade ID 1234"""
+
+        return f"{self.exchange}:{self.symbol}:{self.mark}"
+
+    @staticmethod
+    def symbols_for(frame: pd.DataFrame) -> pd.Series:
+        """Vectorized equivalent of `symbol` for a DataFrame with *COL_NAMES*"""
+
+        is_buy = frame["kind"].str.upper().str.contains("BUY")
+        buy_sell = frame["buy_currency"] + frame["sell_currency"]
+        sell_buy = frame["sell_currency"] + frame["buy_currency"]
+        return buy_sell.where(is_buy, sell_buy)
+
+    @staticmethod
+    def keys_for(frame: pd.DataFrame) -> pd.Series:
+        """Vectorized equivalent of `key` for a DataFrame with *COL_NAMES* columns"""
+
+        symbol = TaxTrade.symbols_for(frame)
+        return frame["exchange"] + ":" + symbol + ":" + frame["mark"].astype(str)
+
+    def to_dataframe(self, scales: Optional[amounts.AssetScales] = None):
+        """One-row DataFrame in store format, with amounts as int64 units
+
+        :param scales: decimal places of each asset. Default is
+            `amounts.DEFAULT_SCALE` for every asset
+        """
+
+        df = pd.DataFrame([self.as_tuple], columns=self.COL_NAMES)
+        if scales is None:
+            scales = amounts.AssetScales()
+        return amounts.frame_to_units(df, scales)
 
     def to_csv_line(self, delimiter=", ", end="\n") -> str:
-        strings = []
-        for val in self.as_dict.values():
-            if isinstance(val, Decimal):
-                strings.append(f"{float(val):0.8f}")
-            else:
-                strings.append(str(val))
+        strings = [
+            f"{float(val):0.8f}" if isinstance(val, Decimal) else str(val)
+            for val in self.as_tuple
+        ]
         return delimiter.join(strings) + end
 
     @property
     def csv_header(self) -> List[str]:
-        return list(self.as_dict.keys())
+        return list(self.COL_NAMES)
 
     @staticmethod
-    def from_order_update(payload: Dict[str, Any]):
+    def from_order_update(payload: Dict[str, Any]) -> "TaxTrade":
         is_buy = payload["S"] == "BUY"
         symbol = Symbol(payload["s"])
 
-        base_qty = Decimal(payload["l"])
-        quote_qty = Decimal(payload["Y"])
-
-        kind = f"{payload['o']} {payload['S']}"
-        dtime = pd.Timestamp(payload["T"], unit="ms", tzinfo=tz.tzutc())
-        exchange = "Binance"
-        mark = payload["t"]
-        comment = ""
-
-        buy_currency = symbol.base if is_buy else symbol.quote
-        buy_amount = base_qty if is_buy else quote_qty
-
-        sell_currency = symbol.quote if is_buy else symbol.base
-        sell_amount = quote_qty if is_buy else base_qty
-
-        fee_currency = payload["N"]
-        fee_amount = Decimal(payload["n"])
-
-        kwargs = {
-            "kind": kind,
-            "dtime": dtime,
-            "buy_currency": buy_currency,
-            "buy_amount": buy_amount,
-            "sell_currency": sell_currency,
-            "sell_amount": sell_amount,
-            "fee_currency": fee_currency,
-            "fee_amount": fee_amount,
-            "exchange": exchange,
-            "mark": mark,
-            "comment": comment,
-        }
-
-        return TaxTrade(**kwargs)
+        base_qty = payload["l"]
+        quote_qty = payload["Y"]
+
+        return TaxTrade.from_exchange(
+            kind=f"{payload['o']} {payload['S']}",
+            time_ms=payload["T"],
+            buy_currency=symbol.base if is_buy else symbol.quote,
+            buy_amount=base_qty if is_buy else quote_qty,
+            sell_currency=symbol.quote if is_buy else symbol.base,
+            sell_amount=quote_qty if is_buy else base_qty,
+            fee_currency=payload["N"],
+            fee_amount=payload["n"],
+            mark=payload["t"],
+        )
 
     @staticmethod
     def from_historic_trades(payload: Dict[str, Any]) -> "TaxTrade":
@@ -205,36 +295,88 @@ class TaxTrade:
         base_qty = Decimal(payload["qty"])
         quote_qty = base_qty * Decimal(payload["price"])
 
-        kind = "BUY" if is_buy else "SELL"
-        dtime = pd.Timestamp(payload["time"], unit="ms", tzinfo=tz.tzutc())
-        exchange = "Binance"
-        mark = payload["id"]
-        comment = ""
-
-        buy_currency = symbol.base if is_buy else symbol.quote
-        buy_amount = base_qty if is_buy else quote_qty
-
-        sell_currency = symbol.quote if is_buy else symbol.base
-        sell_amount = quote_qty if is_buy else base_qty
-
-        fee_currency = payload["commissionAsset"]
-        fee_amount = Decimal(payload["commission"])
-
-        kwargs = {
-            "kind": kind,
-            "dtime": dtime,
-            "buy_currency": buy_currency,
-            "buy_amount": buy_amount,
-            "sell_currency": sell_currency,
-            "sell_amount": sell_amount,
-            "fee_currency": fee_currency,
-            "fee_amount": fee_amount,
-            "exchange": exchange,
-            "mark": mark,
-            "comment": comment,
-        }
+        return TaxTrade.from_exchange(
+            kind="BUY" if is_buy else "SELL",
+            time_ms=payload["time"],
+            buy_currency=symbol.base if is_buy else symbol.quote,
+            buy_amount=base_qty if is_buy else quote_qty,
+            sell_currency=symbol.quote if is_buy else symbol.base,
+            sell_amount=quote_qty if is_buy else base_qty,
+            fee_currency=payload["commissionAsset"],
+            fee_amount=payload["commission"],
+            mark=payload["id"],
+        )
+
+    @staticmethod
+    def frame_from_historic_trades(
+        payload: List[Dict[str, Any]], scales: Optional[amounts.AssetScales] = None
+    ) -> pd.DataFrame:
+        """Convert a list of `myTrades` results directly to a DataFrame
+
+        The result is identical to building a TaxTrade per row with
+        `from_historic_trades` and converting those with `TradeStore.update`, but
+        without creating any per-row objects
+
+        :param payload: list of trade dicts as returned by the `myTrades` endpoint
+        :param scales: decimal places of each asset, normally
+            `TradeStore.scales`. Default is `amounts.DEFAULT_SCALE` for every asset
+        :return: DataFrame with *COL_NAMES* columns and amounts as int64 units
+        """
+
+        if scales is None:
+            scales = amounts.AssetScales()
+
+        raw = pd.DataFrame(
+            payload,
+            columns=[
+                "symbol",
+                "id",
+                "price",
+                "qty",
+                "commission",
+                "commissionAsset",
+                "time",
+                "isBuyer",
+            ],
+        )
+        is_buy = raw["isBuyer"].astype(bool).values
 
-        return TaxTrade(**kwargs)
+        unique_symbols = {name: Symbol(name) for name in raw["symbol"].unique()}
+        base = raw["symbol"].map({k: v.base for k, v in unique_symbols.items()})
+        quote = raw["symbol"].map({k: v.quote for k, v in unique_symbols.items()})
+
+        # The quote amount is multiplied exactly before rounding to its scale
+        base_qty = amounts.strings_to_units(raw["qty"], scales.of(base))
+        quote_qty = amounts.to_units(
+            (Decimal(q) * Decimal(p) for q, p in zip(raw["qty"], raw["price"])),
+            scales.of(quote),
+        )
+        fee_qty = np.abs(
+            amounts.strings_to_units(
+                raw["commission"], scales.of(raw["commissionAsset"])
+            )
+        )
+
+        frame = pd.DataFrame(
+            {
+                "kind": np.where(is_buy, "BUY", "SELL"),
+                "dtime": pd.to_datetime(raw["time"], unit="ms", utc=True),
+                "buy_currency": np.where(is_buy, base, quote),
+                "buy_amount": np.where(is_buy, base_qty, quote_qty),
+                "sell_currency": np.where(is_buy, quote, base),
+                "sell_amount": np.where(is_buy, quote_qty, base_qty),
+                "fee_currency": raw["commissionAsset"],
+                "fee_amount": fee_qty,
+                "exchange": "Binance",
+                "mark": raw["id"],
+                "comment": "",
+            },
+            columns=TaxTrade.COL_NAMES,
+        )
+        # np.where on strings produces fixed-width unicode; store as objects
+        for col in ["kind", "buy_currency", "sell_currency"]:
+            frame[col] = frame[col].astype(object)
+        return frame
 
     def __str__(self):
         is_buy = "BUY" in self.kind.upper()
@@ -0,0 +1,25 @@
+import pytest
+
+from binance_monitor import settings, store
+
+
+@pytest.fixture
+def store_folder(tmp_path, monkeypatch):
+    """Keep the stores opened by a test in its own temporary folder"""
+
+    folder = tmp_path / "account_data"
+    monkeypatch.setattr(store, "ACCOUNT_STORE_FOLDER", str(folder))
+    return folder
+
+
+@pytest.fixture
+def user_settings(tmp_path, monkeypatch):
+    """Keep the preferences and exchange info cache of a test in its own folder"""
+
+    folder = tmp_path / "user"
+    folder.mkdir()
+    preferences = settings.Preferences(str(folder / "preferences.toml"))
+    monkeypatch.setattr(settings, "_preferences", preferences)
+    cache = folder / "cache" / "exchange_info.json.gz"
+    monkeypatch.setattr(settings, "EXCHANGE_INFO_CACHE", str(cache))
+    return folder
@@ -0,0 +1,40 @@
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from binance_monitor import amounts
+
+
+def test_units_round_trip_exactly():
+    values = ["0.1", "0.00000001", "92233720.36854775", "12", "-3.5"]
+    scales = [8, 8, 8, 0, 1]
+    units = amounts.to_units(values, scales)
+    assert units.tolist() == [10000000, 1, 9223372036854775, 12, -35]
+    assert amounts.to_strings(units, scales) == [
+        "0.10000000",
+        "0.00000001",
+        "92233720.36854775",
+        "12",
+        "-3.5",
+    ]
+    # Three float tenths do not sum to 0.3, but three units of 0.1 do
+    assert units[0] * 3 == amounts.to_units([Decimal("0.3")], [8])[0]
+
+
+def test_strings_to_units_matches_decimal_path():
+    values = pd.Series(["1.5", "0.123456785", "0.123456795", "7", "20000000.00000001"])
+    scales = np.array([8, 8, 8, 2, 8])
+    expected = amounts.to_units(values, scales)
+    assert amounts.strings_to_units(values, scales).tolist() == expected.tolist()
+    # Digits beyond the scale are rounded half to even
+    assert expected[1:3].tolist() == [12345678, 12345680]
+
+
+def test_asset_scales_fix_new_assets_at_their_precision():
+    scales = amounts.AssetScales({"BTC": 8}, precisions={"BTC": 6, "SHIB": 2})
+    assert scales["BTC"] == 8
+    assert scales["SHIB"] == 2
+    assert scales["XYZ"] == amounts.DEFAULT_SCALE
+    assert scales.of(pd.Series(["SHIB", "BTC", "SHIB"])).tolist() == [2, 8, 2]
+    assert dict(scales) == {"BTC": 8, "SHIB": 2, "XYZ": amounts.DEFAULT_SCALE}
@@ -0,0 +1,66 @@
+import pytest
+
+from binance_monitor.base import Symbol
+
+EXCHANGE_SYMBOLS = [
+    {"symbol": "ETHBTC", "baseAsset": "ETH", "quoteAsset": "BTC"},
+    {"symbol": "BTCBUSD", "baseAsset": "BTC", "quoteAsset": "BUSD"},
+    {"symbol": "BTCEUR", "baseAsset": "BTC", "quoteAsset": "EUR"},
+    {"symbol": "USDTTRY", "baseAsset": "USDT", "quoteAsset": "TRY"},
+]
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    """Start every test with no symbols registered"""
+
+    monkeypatch.setattr(Symbol, "_registry", {})
+
+
+def test_symbols_are_split_as_listed_in_exchange_info():
+    Symbol.load(EXCHANGE_SYMBOLS)
+
+    for info in EXCHANGE_SYMBOLS:
+        symbol = Symbol(info["symbol"])
+        assert (symbol.base, symbol.quote) == (info["baseAsset"], info["quoteAsset"])
+        assert str(symbol) == info["symbol"]
+
+
+def test_symbols_are_interned():
+    Symbol.load(EXCHANGE_SYMBOLS)
+
+    assert Symbol("ETHBTC") is Symbol("ETHBTC")
+    assert Symbol("BNBBTC") is Symbol("BNBBTC")
+    assert {Symbol("ETHBTC"): 1}[Symbol("ETHBTC")] == 1
+    with pytest.raises(AttributeError):
+        Symbol("ETHBTC").quote = "ETH"
+
+
+@pytest.mark.parametrize(
+    "name, base, quote",
+    [
+        ("ETHBTC", "ETH", "BTC"),
+        ("BNBUSDT", "BNB", "USDT"),
+        ("BTCTUSD", "BTC", "TUSD"),
+        ("XRPBNB", "XRP", "BNB"),
+    ],
+)
+def test_unlisted_symbols_are_split_by_their_suffix(name, base, quote):
+    symbol = Symbol(name)
+
+    assert (symbol.base, symbol.quote) == (base, quote)
+    assert Symbol(name) is symbol
+
+
+@pytest.mark.parametrize("info", EXCHANGE_SYMBOLS[1:], ids=lambda info: info["symbol"])
+def test_unknown_quote_assets_need_exchange_info(info):
+    with pytest.raises(KeyError, match="Could not find a quote asset"):
+        Symbol(info["symbol"])
+
+    Symbol.load([info])
+    assert Symbol(info["symbol"]).quote == info["quoteAsset"]
+
+
+def test_a_quote_asset_alone_is_not_a_symbol():
+    with pytest.raises(KeyError):
+        Symbol("BTC")
@@ -0,0 +1,129 @@
+from decimal import Decimal
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from binance_monitor import amounts, store
+from binance_monitor.costbasis import Book, CostBasis
+from binance_monitor.store import KEY_COL, SYMBOL_COL
+from binance_monitor.trade import TaxTrade
+
+
+def _trades(count: int) -> pd.DataFrame:
+    rng = np.random.RandomState(7)
+    is_buy = rng.rand(count) < 0.6
+    # Starting with a sale, so that some is unmatched
+    is_buy[0] = False
+    qty = rng.randint(1, 1000, count)
+    quote = qty * rng.randint(90, 110, count)
+    return pd.DataFrame(
+        {
+            "kind": np.where(is_buy, "BUY", "SELL"),
+            "dtime": pd.date_range("2019-01-01", periods=count, freq="min", tz="UTC"),
+            "buy_currency": np.where(is_buy, "ETH", "USDT"),
+            "buy_amount": np.where(is_buy, qty, quote),
+            "sell_currency": np.where(is_buy, "USDT", "ETH"),
+            "sell_amount": np.where(is_buy, quote, qty),
+            "fee_currency": "BNB",
+            "fee_amount": 0,
+            SYMBOL_COL: "ETHUSDT",
+            KEY_COL: [f"ETHUSDT-{num}" for num in range(count)],
+        }
+    )
+
+
+def _store(trades: pd.DataFrame, path) -> SimpleNamespace:
+    # Only what `CostBasis` uses of a `TradeStore`
+    return SimpleNamespace(
+        file_path=str(path),
+        scales=amounts.AssetScales(),
+        trade_count=len(trades),
+        query=lambda start=None: trades[
+            trades["dtime"] >= (start or trades["dtime"][0])
+        ],
+    )
+
+
+def test_book_matches_lots_by_method():
+    for method, cost in [("FIFO", 100), ("LIFO", 200), ("HIFO", 300)]:
+        book = Book(method, "ETH", "USDT")
+        book.acquire(1, 10, 100)
+        book.acquire(2, 10, 300)
+        book.acquire(3, 10, 200)
+        assert book.dispose(10, 250) == 250 - cost
+    # Selling more than is held realizes only the matched part
+    book = Book("FIFO", "ETH", "USDT")
+    book.acquire(1, 10, 100)
+    assert book.dispose(20, 400) == 100
+    assert book.unmatched == 10
+    assert book.lots == []
+
+
+def test_vectorized_fifo_matches_sequential(tmp_path):
+    trades = _trades(2000)
+    vectorized = CostBasis(_store(trades, tmp_path / "a.h5"), "FIFO")
+    vectorized.rebuild()
+    sequential = CostBasis(_store(trades, tmp_path / "b.h5"), "FIFO")
+    sequential._book_frame(trades, vectorized=False)
+    book, other = vectorized.books["ETHUSDT"], sequential.books["ETHUSDT"]
+    assert book.realized == other.realized != 0
+    assert book.unmatched == other.unmatched != 0
+    assert book.lots == other.lots
+
+    # Saved lots are loaded, and trades after the watermark booked from there
+    resumed = CostBasis(vectorized.store, "FIFO")
+    assert resumed.books["ETHUSDT"].lots == vectorized.books["ETHUSDT"].lots
+    assert resumed.catch_up() == 0
+
+
+def _trade(kind: str, minute: int, eth: str, usdt: str, mark: int) -> TaxTrade:
+    is_buy = kind == "BUY"
+    return TaxTrade.from_exchange(
+        kind=kind,
+        time_ms=1546300800000 + minute * 60000,
+        buy_currency="ETH" if is_buy else "USDT",
+        buy_amount=eth if is_buy else usdt,
+        sell_currency="USDT" if is_buy else "ETH",
+        sell_amount=usdt if is_buy else eth,
+        fee_currency="BNB",
+        fee_amount="0",
+        exchange="Binance",
+        mark=mark,
+    )
+
+
+@pytest.mark.parametrize("method", ["LIFO", "HIFO"])
+def test_saved_lots_resume_booking(tmp_path, method):
+    trades = _trades(500)
+    booked = CostBasis(_store(trades, tmp_path / "acct.h5"), method)
+    booked.rebuild()
+    resumed = CostBasis(booked.store, method)
+    assert resumed.books["ETHUSDT"].lots == booked.books["ETHUSDT"].lots
+
+    later = [_trade("BUY", 600, "3", "270", 1), _trade("SELL", 601, "5", "600", 2)]
+    for trade in later:
+        assert resumed.add(trade) == booked.add(trade)
+    book, other = resumed.books["ETHUSDT"], booked.books["ETHUSDT"]
+    assert (book.realized, book.unmatched) == (other.realized, other.unmatched)
+    assert book.lots == other.lots
+
+
+def test_fills_reconciled_out_of_order_are_booked_in_order(store_folder):
+    trade_store = store.TradeStore("acct")
+    cost_basis = CostBasis(trade_store, "FIFO")
+    # A buy and a later sell are seen on the user data stream...
+    for trade in [_trade("BUY", 1, "1", "100", 1), _trade("SELL", 3, "1", "130", 3)]:
+        assert trade_store.add_trade(trade)
+        cost_basis.add(trade)
+    # ...and a buy between them only when the stream is reconciled
+    trade_store.update([_trade("BUY", 2, "1", "120", 2)])
+    trade_store.flush()
+    assert cost_basis.catch_up() == 3
+
+    summary = cost_basis.summary().iloc[0]
+    assert Decimal(summary["open_qty"]) == 1
+    assert Decimal(summary["open_cost"]) == 120
+    assert Decimal(summary["realized"]) == 30
+    trade_store.close()
@@ -0,0 +1,87 @@
+import pytest
+
+from benchmarks import generators
+from binance_monitor.events import (
+    AccountUpdate,
+    EventDecoder,
+    EventUpdate,
+    OrderUpdate,
+)
+
+
+@pytest.fixture
+def events():
+    return generators.execution_reports(400, trade_fraction=0.3)
+
+
+def test_only_fills_are_decoded(events):
+    decoder = EventDecoder()
+    decoded = [decoder.decode(message) for message in generators.raw_messages(events)]
+
+    fills = [event["t"] for event in events if event["x"] == "TRADE"]
+    updates = [update for update in decoded if update is not None]
+    assert [update.trade.mark for update in updates] == fills
+    assert all(isinstance(update, OrderUpdate) for update in updates)
+    assert all(update.is_trade_event for update in updates)
+    assert decoder.stats == {
+        "decoded": len(fills),
+        "rejected": len(events) - len(fills),
+        "unknown": 0,
+    }
+
+
+def test_rejected_reports_never_become_events(events, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("OrderUpdate created for a rejected report")
+
+    monkeypatch.setattr(OrderUpdate, "__init__", fail)
+    fill = next(event for event in events if event["x"] == "TRADE")
+    not_fills = [
+        next(event for event in events if event["x"] != "TRADE"),
+        dict(fill, t=-1),
+        dict(fill, X="NEW"),
+        dict(fill, l="0.00000000"),
+    ]
+
+    decoder = EventDecoder()
+    for event in not_fills:
+        assert not OrderUpdate.accepts(event)
+        assert decoder.decode(event) is None
+    assert decoder.stats["rejected"] == len(not_fills)
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        b'{"e": "balanceUpdate", "E": 1, "a": "BTC", "d": "1.0"}',
+        '{"e": "listStatus", "E": 1}',
+        {"E": 1},
+    ],
+)
+def test_unknown_event_types_decode_to_none(message):
+    decoder = EventDecoder()
+
+    assert decoder.decode(message) is None
+    assert decoder.stats == {"decoded": 0, "rejected": 0, "unknown": 1}
+
+
+def test_registered_handlers_decode_their_event_type():
+    class BalanceUpdate(EventUpdate):
+        pass
+
+    decoder = EventDecoder()
+    decoder.register("balanceUpdate", BalanceUpdate)
+    account = {
+        "e": "outboundAccountInfo",
+        "E": 2,
+        "u": 2,
+        "B": [{"a": "BTC", "f": "1.0", "l": "0.0"}],
+    }
+
+    balance = decoder.decode({"e": "balanceUpdate", "E": 1})
+    assert isinstance(balance, BalanceUpdate)
+    assert balance.event_timestamp == 1
+    update = decoder.decode(account)
+    assert isinstance(update, AccountUpdate)
+    assert [asset.asset for asset in update.balances] == ["BTC"]
+    assert decoder.stats == {"decoded": 2, "rejected": 0, "unknown": 0}
@@ -0,0 +1,79 @@
+import gzip
+import json
+import time
+
+import pytest
+
+from benchmarks.fake_binance import exchange_info
+
+exchange = pytest.importorskip("binance_monitor.exchange")
+
+SYMBOLS = ["ETHBTC", "BNBBTC"]
+
+
+class Client:
+    """The exchangeInfo call of `binance.client.Client`, counted"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_exchange_info(self):
+        self.calls += 1
+        return exchange_info(SYMBOLS)
+
+
+def test_cache_is_used_until_it_expires(user_settings):
+    client = Client()
+    exchange.Exchange(client, ttl=60)
+    cached = exchange.Exchange(client, ttl=60)
+    assert client.calls == 1
+    assert [s["symbol"] for s in cached.symbols] == SYMBOLS
+
+    # An expired cache is still used, and refreshed in the background
+    stale = exchange.Exchange(client, ttl=0)
+    assert [s["symbol"] for s in stale.symbols] == SYMBOLS
+    stale._refresh_thread.join()
+    assert client.calls == 2
+
+
+def write_cache(path, content: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+
+
+def gzipped(cache) -> bytes:
+    return gzip.compress(json.dumps(cache).encode("utf-8"))
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        gzipped({"version": exchange.CACHE_VERSION, "fetched": 0})[:-12],
+        gzipped({"version": exchange.CACHE_VERSION, "fetched": time.time()}),
+        gzipped({"version": exchange.CACHE_VERSION - 1, "data": {}, "fetched": 0}),
+        gzipped({"version": exchange.CACHE_VERSION})[:10] + b"\x00" * 40,
+        b"not gzip at all",
+    ],
+    ids=["truncated", "no data", "old version", "corrupt", "not gzip"],
+)
+def test_unusable_cache_is_fetched_again(user_settings, content):
+    cache_path = user_settings / "cache" / "exchange_info.json.gz"
+    write_cache(cache_path, content)
+
+    client = Client()
+    info = exchange.Exchange(client, ttl=60)
+    assert client.calls == 1
+    assert [s["symbol"] for s in info.symbols] == SYMBOLS
+    # And the cache is rewritten
+    exchange.Exchange(client, ttl=60)
+    assert client.calls == 1
+
+
+def test_fetch_errors_keep_their_cause(user_settings):
+    class Offline:
+        def get_exchange_info(self):
+            raise RuntimeError("Network is unreachable")
+
+    with pytest.raises(IOError, match="Network is unreachable") as raised:
+        exchange.Exchange(Offline(), ttl=60)
+    assert isinstance(raised.value.__cause__, RuntimeError)
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from benchmarks import generators
+from benchmarks.fake_binance import FakeBinance
+from binance_monitor.listener import UserStreamListener
+
+
+@pytest.fixture
+def fake():
+    trades = generators.my_trades(2500, symbols=["ETHBTC"])
+    with FakeBinance(trades, symbols=["ETHBTC"]) as server:
+        yield server
+
+
+def get(url, method="GET"):
+    request = urllib.request.Request(url, method=method)
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read()), response.headers
+
+
+class StreamClient:
+    """The listenKey calls of `binance.client.Client`, against the fake server"""
+
+    def __init__(self, rest_url):
+        self.url = rest_url + "/v1/userDataStream"
+
+    def stream_get_listen_key(self):
+        return get(self.url, "POST")[0]["listenKey"]
+
+    def stream_keepalive(self, listen_key):
+        get(f"{self.url}?listenKey={listen_key}", "PUT")
+
+    def stream_close(self, listen_key):
+        get(f"{self.url}?listenKey={listen_key}", "DELETE")
+
+
+def test_my_trades_pages_like_binance(fake):
+    url = fake.rest_url + "/v3/myTrades?symbol=ETHBTC&limit=1000"
+
+    newest, headers = get(url)
+    assert [t["id"] for t in newest] == list(range(1500, 2500))
+    assert headers["X-MBX-USED-WEIGHT-1M"] == "5"
+
+    older, _ = get(f"{url}&endTime={newest[0]['time'] - 1}")
+    assert [t["id"] for t in older] == list(range(500, 1500))
+
+    after, _ = get(f"{url}&fromId=2400")
+    assert [t["id"] for t in after] == list(range(2400, 2500))
+
+    since, _ = get(f"{url}&startTime={newest[0]['time']}")
+    assert since[0]["id"] == 1500 and len(since) == 1000
+
+
+def test_rejected_requests_get_retry_after(fake):
+    fake.reject_next(1, retry_after=7)
+    with pytest.raises(urllib.error.HTTPError) as exc_info:
+        get(fake.rest_url + "/v1/ping")
+    assert exc_info.value.code == 429
+    assert exc_info.value.headers["Retry-After"] == "7"
+    assert get(fake.rest_url + "/v1/ping")[0] == {}
+
+
+def test_listener_reconnects_and_receives_every_fill(fake):
+    events = generators.execution_reports(200, trade_fraction=0.5)
+    fills = [event["t"] for event in events if event["t"] != -1]
+    handled = []
+
+    async def wait_for_connection():
+        while fake.connections == 0:
+            await asyncio.sleep(0.01)
+
+    async def main():
+        loop = asyncio.get_event_loop()
+        listener = UserStreamListener(
+            StreamClient(fake.rest_url),
+            lambda event: handled.append(event.payload["t"]),
+            stream_url=fake.stream_url,
+        )
+        task = asyncio.ensure_future(listener.run())
+
+        await asyncio.wait_for(wait_for_connection(), 5)
+        await loop.run_in_executor(None, fake.replay, events[:100])
+        await loop.run_in_executor(None, fake.disconnect)
+        await asyncio.wait_for(wait_for_connection(), 5)
+        await loop.run_in_executor(None, fake.replay, events[100:], 2000)
+
+        while len(handled) < len(fills):
+            await asyncio.sleep(0.01)
+        listener.stop()
+        await task
+        return listener.metrics
+
+    metrics = asyncio.run(asyncio.wait_for(main(), 30))
+    assert handled == fills
+    assert metrics["reconnects"] == 1
+    assert metrics["rejected"] == len(events) - len(fills)
+    assert not fake.listen_keys
@@ -0,0 +1,44 @@
+import urllib.request
+
+import pytest
+
+from binance_monitor import metrics
+
+
+@pytest.fixture
+def enabled():
+    metrics.enable()
+    yield
+    metrics.disable()
+    metrics.reset()
+
+
+def test_disabled_metrics_record_nothing():
+    metrics.inc("requests_total")
+    metrics.observe("request_seconds", 0.2)
+    with metrics.timer("flush_seconds"):
+        pass
+    assert metrics.render() == "\n"
+
+
+def test_render_prometheus_text(enabled):
+    metrics.inc("requests_total", endpoint="/api/v3/myTrades", status=200)
+    metrics.inc("requests_total", 2, endpoint="/api/v3/myTrades", status=200)
+    for value in [0.003, 0.02, 20]:
+        metrics.observe("request_seconds", value, buckets=(0.01, 0.1))
+    metrics.set_gauge("queue_depth", 4)
+
+    server = metrics.serve(0)
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/metrics"
+        with urllib.request.urlopen(url) as response:
+            text = response.read().decode()
+    finally:
+        server.shutdown()
+
+    assert 'requests_total{endpoint="/api/v3/myTrades",status="200"} 3' in text
+    assert "queue_depth 4" in text
+    assert 'request_seconds_bucket{le="0.01"} 1' in text
+    assert 'request_seconds_bucket{le="0.1"} 2' in text
+    assert 'request_seconds_bucket{le="+Inf"} 3' in text
+    assert "request_seconds_count 3" in text
@@ -0,0 +1,188 @@
+import json
+
+import pytest
+from logbook import Logger
+
+from benchmarks import generators
+from benchmarks.fake_binance import FakeBinance
+from binance_monitor import settings, store
+from binance_monitor.events import EventDecoder, OrderUpdate
+from binance_monitor.trade import TaxTrade
+
+binance_client = pytest.importorskip("binance.client")
+monitor = pytest.importorskip("binance_monitor.monitor")
+supervisor = pytest.importorskip("binance_monitor.supervisor")
+
+SYMBOLS = ["BNBBTC", "ETHBTC", "LTCBTC"]
+
+
+@pytest.fixture
+def fake(store_folder, user_settings, monkeypatch):
+    trades = generators.my_trades(7500, symbols=SYMBOLS)
+    with FakeBinance(trades, symbols=SYMBOLS) as server:
+        monkeypatch.setattr(binance_client.Client, "API_URL", server.rest_url)
+        yield server
+
+
+def test_reconcile_fetches_only_the_symbols_that_may_have_traded(fake):
+    account = monitor.AccountMonitor(credentials=("key", "secret"), name="acct")
+    trade_store = account.trade_store
+    synced = [t for trades in fake.trades.values() for t in trades[:-1200]]
+    trade_store.update(TaxTrade.frame_from_historic_trades(synced, trade_store.scales))
+    trade_store.update_high_water_marks(synced)
+    trade_store.flush()
+
+    # Fills of ETHBTC were seen on the stream before it dropped, and LTCBTC has an
+    # order open: ETHBTC is fetched after its last id and LTCBTC from the time of
+    # the drop. BNBBTC is left alone
+    eth_last = fake.trades["ETHBTC"][-1201]
+    since = fake.trades["LTCBTC"][-1100]["time"]
+    fake.open_orders = [{"symbol": "LTCBTC", "orderId": 1}]
+    recovered = account.reconcile(since, {"ETHBTC": (eth_last["id"], eth_last["time"])})
+
+    assert recovered == 1200 + 1100
+    # One page of 1000 and a short one for each, besides the open orders
+    assert fake.requests["/api/v3/myTrades"] == 4
+    for symbol in ["ETHBTC", "LTCBTC"]:
+        assert trade_store.high_water_mark(symbol) == fake.trades[symbol][-1]["id"]
+    bnb_synced = fake.trades["BNBBTC"][-1201]["id"]
+    assert trade_store.high_water_mark("BNBBTC") == bnb_synced
+    assert len(trade_store.query()) == len(synced) + recovered
+    trade_store.close()
+
+
+def test_stream_fills_advance_the_high_water_marks(store_folder, user_settings):
+    # A monitor without a client, as only the stream is used
+    account = monitor.AccountMonitor.__new__(monitor.AccountMonitor)
+    account.log = Logger("test")
+    account.decoder = EventDecoder()
+    account.cost_basis = None
+    account.trade_store = store.TradeStore("acct")
+
+    events = generators.execution_reports(200, trade_fraction=0.5)
+    for message in generators.raw_messages(events):
+        account.process_user_update(message)
+    account.trade_store.close()
+
+    fills = [event for event in events if OrderUpdate.accepts(event)]
+    expected = {}
+    for fill in sorted(fills, key=lambda event: event["t"]):
+        expected[fill["s"]] = {"id": fill["t"], "time": fill["T"]}
+    assert store.TradeStore("acct").sync_state == expected
+
+
+@pytest.fixture
+def profiles(tmp_path, monkeypatch):
+    """Write *PROFILES_FILENAME* for the given account names"""
+
+    path = tmp_path / "profiles.json"
+    monkeypatch.setattr(settings, "PROFILES_FILENAME", str(path))
+
+    def write(*names):
+        creds = {"binance_key": "key", "binance_secret": "secret"}
+        path.write_text(json.dumps({name: creds for name in names}))
+
+    return write
+
+
+def test_supervised_monitors_share_exchange_info_and_ip_limits(fake, profiles):
+    profiles("main", "grid")
+    accounts = supervisor.Supervisor()
+
+    main, grid = accounts.monitors["main"], accounts.monitors["grid"]
+    assert main.exchange_info is grid.exchange_info is accounts.exchange_info
+    assert fake.requests["/api/v1/exchangeInfo"] == 1
+    # Request limits are counted per IP and order limits per account
+    assert main.limiter.parent is grid.limiter.parent is accounts.ip_limiter
+    assert main.limiter is not grid.limiter
+    for account in [main, grid]:
+        adapter = account.client.session.get_adapter("https://api.binance.com")
+        assert adapter is accounts.adapter
+        account.trade_store.close()
+
+
+def test_supervisor_needs_a_profile(store_folder, profiles):
+    profiles()
+    with pytest.raises(ValueError, match="No credential profiles"):
+        supervisor.Supervisor()
+
+
+def test_concurrent_backfill_keeps_within_the_weight_limit(
+    store_folder, user_settings, monkeypatch
+):
+    # A limit per second, so the backfill of 36 pages spans several windows
+    limits = [
+        {
+            "rateLimitType": "REQUEST_WEIGHT",
+            "interval": "SECOND",
+            "intervalNum": 1,
+            "limit": 60,
+        }
+    ]
+    symbols = SYMBOLS + ["XRPBTC", "ADABTC", "DOTBTC"]
+    trades = generators.my_trades(30000, symbols=symbols)
+    with FakeBinance(trades, symbols=symbols, rate_limits=limits) as fake:
+        monkeypatch.setattr(binance_client.Client, "API_URL", fake.rest_url)
+        account = monitor.AccountMonitor(credentials=("key", "secret"), name="acct")
+        account.get_trade_history_for(symbols, max_workers=6)
+
+    assert fake.requests["/api/v3/myTrades"] == sum(
+        pages(len(fake.trades[symbol])) for symbol in symbols
+    )
+    assert fake.rejected == 0
+    assert 0 < fake.peak_weight <= fake.weight_limit
+    assert len(account.trade_store.query()) == 30000
+    account.trade_store.close()
+
+
+def pages(count: int) -> int:
+    """Requests of 1000 trades needed to learn that there are no more"""
+
+    return count // 1000 + 1
+
+
+def test_sync_pages_back_once_then_only_requests_new_trades(fake):
+    account = monitor.AccountMonitor(credentials=("key", "secret"), name="acct")
+    account.get_trade_history_for(SYMBOLS, max_workers=1)
+    for symbol in SYMBOLS:
+        queries = [q for q in fake.trade_queries if q["symbol"] == symbol]
+        assert len(queries) == pages(len(fake.trades[symbol]))
+        assert "fromId" not in queries[0] and "endTime" not in queries[0]
+
+    # A few trades since, in every symbol
+    for num, symbol in enumerate(SYMBOLS):
+        last = fake.trades[symbol][-1]
+        fake.trades[symbol].extend(
+            dict(last, id=10**6 + 10 * num + i, time=last["time"] + 1000 * i)
+            for i in range(1, 6)
+        )
+    stored_marks = {
+        symbol: account.trade_store.high_water_mark(symbol) for symbol in SYMBOLS
+    }
+    fake.trade_queries.clear()
+    account.get_trade_history_for(SYMBOLS)
+
+    assert sorted(q["symbol"] for q in fake.trade_queries) == SYMBOLS
+    for query in fake.trade_queries:
+        assert int(query["fromId"]) == stored_marks[query["symbol"]] + 1
+    assert len(account.trade_store.query()) == 7500 + 15
+    account.trade_store.close()
+
+
+def test_full_sync_pages_backwards_through_all_history(fake):
+    account = monitor.AccountMonitor(credentials=("key", "secret"), name="acct")
+    account.get_trade_history_for(SYMBOLS[:1], max_workers=1)
+    fake.trade_queries.clear()
+    account.get_trade_history_for(SYMBOLS, full=True)
+
+    for symbol in SYMBOLS:
+        trades = fake.trades[symbol]
+        queries = [q for q in fake.trade_queries if q["symbol"] == symbol]
+        assert len(queries) == pages(len(trades))
+        # Each page ends just before the oldest trade of the page after it
+        end_times = [int(q["endTime"]) for q in queries[1:]]
+        page_starts = [trades[-1000 * n]["time"] - 1 for n in range(1, len(queries))]
+        assert end_times == page_starts
+        assert all("fromId" not in query for query in queries)
+    assert len(account.trade_store.query()) == 7500
+    account.trade_store.close()
@@ -0,0 +1,134 @@
+import pandas as pd
+import pytest
+
+from benchmarks import generators
+from binance_monitor import store
+from binance_monitor.store import KEY_COL
+from binance_monitor.trade import TaxTrade
+
+parquet_store = pytest.importorskip("binance_monitor.parquet_store")
+
+
+def by_key(trades: pd.DataFrame) -> pd.DataFrame:
+    """Trades in key order, with categorical and string columns as objects, which
+    differ between backends and pandas versions
+    """
+
+    strings = [
+        col
+        for col, dtype in trades.dtypes.items()
+        if isinstance(dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(dtype)
+    ]
+    trades = trades.astype({col: object for col in strings})
+    return trades.sort_values(KEY_COL).reset_index(drop=True)
+
+
+def stored(trade_store: store.TradeStore, count: int) -> pd.DataFrame:
+    trades = generators.my_trades(count)
+    frame = TaxTrade.frame_from_historic_trades(trades, trade_store.scales)
+    trade_store.update(frame)
+    trade_store.update_high_water_marks(trades)
+    trade_store.flush()
+    return frame
+
+
+def live_trades(count: int):
+    # Later than `generators.my_trades`, and with ids of their own
+    return [
+        TaxTrade.from_order_update(dict(event, T=event["T"] + 10**9, t=10**6 + num))
+        for num, event in enumerate(
+            generators.execution_reports(count, trade_fraction=1.0)
+        )
+    ]
+
+
+def test_round_trip_with_live_trades_and_compact(store_folder):
+    trade_store = parquet_store.ParquetTradeStore("acct")
+    stored(trade_store, 300)
+    trade_store.close()
+
+    reopened = parquet_store.ParquetTradeStore("acct")
+    assert len(reopened.trades) == 300
+    for trade in live_trades(20):
+        reopened.add_trade(trade)
+    reopened.flush()
+    expected = by_key(reopened.trades)
+    assert str(expected["dtime"].dtype) == store.DTIME_DTYPE
+    assert expected["mark"].dtype == "int64"
+
+    reopened.compact()
+    reopened.close()
+    compacted = parquet_store.ParquetTradeStore("acct")
+    pd.testing.assert_frame_equal(by_key(compacted.trades), expected)
+    assert len(list((store_folder / "acct.parquet").glob("symbol=*/month=*/*"))) == (
+        expected.groupby(["symbol", expected["dtime"].dt.strftime("%Y-%m")]).ngroups
+    )
+    compacted.close()
+
+
+def test_query_prunes_by_symbol_time_and_id(store_folder):
+    trade_store = parquet_store.ParquetTradeStore("acct")
+    frame = by_key(trade_store._with_index_columns(stored(trade_store, 500)))
+    start = frame["dtime"].sort_values().iloc[100]
+    end = frame["dtime"].sort_values().iloc[400]
+
+    selected = trade_store.query(symbol=["ETHBTC", "LTCBTC"], start=start, end=end)
+    expected = frame[
+        frame["symbol"].isin(["ETHBTC", "LTCBTC"])
+        & (frame["dtime"] >= start)
+        & (frame["dtime"] < end)
+    ]
+    assert sorted(selected[KEY_COL]) == sorted(expected[KEY_COL])
+    assert sorted(trade_store.query(trade_id=[3, 4, 5])["mark"]) == [3, 4, 5]
+
+    chunks = list(trade_store.query(currency="BTC", chunksize=50))
+    assert all(len(chunk) <= 50 for chunk in chunks)
+    assert sum(len(chunk) for chunk in chunks) == len(
+        frame[(frame["buy_currency"] == "BTC") | (frame["sell_currency"] == "BTC")]
+    )
+    trade_store.close()
+
+
+def test_migrate_copies_trades_and_state(store_folder):
+    h5 = store.TradeStore("acct")
+    stored(h5, 400)
+    expected = by_key(h5.trades)
+    sync_state, scales = dict(h5.sync_state), dict(h5.scales)
+    h5.close()
+
+    migrated = parquet_store.migrate("acct")
+    pd.testing.assert_frame_equal(by_key(migrated.trades), expected)
+    assert migrated.sync_state == sync_state
+    assert dict(migrated.scales) == scales
+    migrated.close()
+
+    # The state is read back from the dataset, and a second migrate copies nothing
+    again = parquet_store.migrate("acct")
+    assert again.sync_state == sync_state
+    assert len(again.trades) == 400
+    again.close()
+
+
+def test_interrupted_compaction_is_recovered(store_folder):
+    trade_store = parquet_store.ParquetTradeStore("acct")
+    stored(trade_store, 300)
+    trade_store.close()
+
+    # Stopped after moving the dataset aside, before moving the new one in
+    dataset = store_folder / "acct.parquet"
+    dataset.rename(store_folder / "acct.parquet.old")
+    (store_folder / "acct.parquet.compact").mkdir()
+    recovered = parquet_store.ParquetTradeStore("acct")
+    assert len(recovered.trades) == 300
+    assert recovered.high_water_mark("ETHBTC") is not None
+
+    # A stale copy left next to the dataset does not stop the next compaction
+    stale = store_folder / "acct.parquet.old" / "symbol=ETHBTC"
+    stale.mkdir(parents=True)
+    (stale / "part.parquet").write_bytes(b"stale")
+    recovered.compact()
+    recovered.close()
+    assert not (store_folder / "acct.parquet.old").exists()
+    compacted = parquet_store.ParquetTradeStore("acct")
+    assert len(compacted.trades) == 300
+    compacted.close()
@@ -0,0 +1,49 @@
+import pstats
+import threading
+
+import pytest
+
+from binance_monitor import profiling
+
+
+@pytest.fixture
+def enabled():
+    profiling.enable()
+    yield
+    profiling.disable()
+    profiling.reset()
+
+
+def work():
+    sum(range(10000))
+
+
+def test_spans_accumulate_across_threads(enabled):
+    def fetch():
+        with profiling.span("fetch"):
+            work()
+
+    threads = [threading.Thread(target=fetch) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with profiling.span("save"):
+        work()
+
+    lines = profiling.report().splitlines()
+    assert lines[0].split()[:3] == ["phase", "calls", "total"]
+    calls = {line.split()[0]: line.split()[1] for line in lines[1:-1]}
+    assert calls == {"fetch": "4", "save": "1"}
+
+
+def test_cprofile_includes_worker_threads(tmp_path):
+    path = str(tmp_path / "run.prof")
+    profiling.start_cprofile(path)
+    thread = threading.Thread(target=work)
+    thread.start()
+    thread.join()
+    profiling.stop_cprofile()
+
+    functions = {name for _, _, name in pstats.Stats(path).stats}
+    assert "work" in functions
@@ -0,0 +1,109 @@
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from binance_monitor.ratelimit import RateLimiter
+
+RATE_LIMITS = [
+    {
+        "rateLimitType": "REQUEST_WEIGHT",
+        "interval": "MINUTE",
+        "intervalNum": 1,
+        "limit": 1200,
+    },
+    {"rateLimitType": "ORDERS", "interval": "SECOND", "intervalNum": 10, "limit": 50},
+]
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    used_weight = 0
+    retry_after = None
+
+    def do_GET(self):
+        if self.retry_after is not None:
+            self.send_response(429)
+            self.send_header("Retry-After", str(self.retry_after))
+        else:
+            self.send_response(200)
+        self.send_header("X-MBX-USED-WEIGHT-1M", str(self.used_weight))
+        self.send_header("X-MBX-ORDER-COUNT-10S", "3")
+        self.end_headers()
+        self.wfile.write(b"[]")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(("127.0.0.1", 0), FakeHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    FakeHandler.used_weight = 0
+    FakeHandler.retry_after = None
+
+
+@pytest.fixture
+def window_start(monkeypatch):
+    """Pin the wall clock one second into a window of the server, as those are
+    aligned to it, so that the headroom left in the window is known
+    """
+
+    now = (time.time() // 60 + 1) * 60 + 1
+    monkeypatch.setattr(time, "time", lambda: now)
+    return now
+
+
+def fetch(limiter, httpd, weight=1):
+    limiter.acquire(weight)
+    url = f"http://127.0.0.1:{httpd.server_port}/api/v3/myTrades"
+    try:
+        with urllib.request.urlopen(url) as response:
+            limiter.observe(response.status, response.headers)
+    except urllib.error.HTTPError as exc:
+        limiter.observe(exc.code, exc.headers)
+
+
+def test_budget_follows_server_headers(server, window_start):
+    limiter = RateLimiter(RATE_LIMITS)
+    FakeHandler.used_weight = 1000
+    fetch(limiter, server, weight=5)
+
+    budget = limiter.budget()
+    assert budget["REQUEST_WEIGHT_1M"]["used"] == 1000
+    assert budget["REQUEST_WEIGHT_1M"]["remaining"] == 200
+    assert budget["ORDERS_10S"]["used"] == 3
+    # Weight used elsewhere leaves less than the initial burst available
+    assert budget["REQUEST_WEIGHT_1M"]["available"] == pytest.approx(
+        200 - 18 * 59, abs=1
+    )
+
+
+def test_headroom_allows_more_than_burst(server, window_start):
+    limiter = RateLimiter(RATE_LIMITS)
+    FakeHandler.used_weight = 0
+    fetch(limiter, server, weight=5)
+
+    budget = limiter.budget()["REQUEST_WEIGHT_1M"]
+    assert budget["resets_in"] == 59
+    # All 1200 less what refills at (1200 - 120) / 60 per second until the reset
+    assert budget["available"] == pytest.approx(1200 - 18 * 59, abs=1)
+    assert budget["available"] > 120
+
+
+def test_retry_after_blocks_requests(server):
+    limiter = RateLimiter(RATE_LIMITS)
+    FakeHandler.retry_after = 1
+    fetch(limiter, server)
+    assert limiter.blocked_for > 0
+
+    FakeHandler.retry_after = None
+    start = time.time()
+    fetch(limiter, server)
+    assert time.time() - start >= 0.5
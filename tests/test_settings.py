@@ -0,0 +1,99 @@
+import os
+import threading
+
+import pytest
+import toml
+
+from binance_monitor import settings
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / "preferences.toml"
+    path.write_text(toml.dumps({"store_backend": "hdf"}))
+    return path
+
+
+@pytest.fixture
+def replaced(monkeypatch):
+    """Record the (source, destination) of every os.replace made by settings"""
+
+    calls = []
+    replace = os.replace
+
+    def recording_replace(src, dst):
+        calls.append((src, dst))
+        replace(src, dst)
+
+    monkeypatch.setattr(settings.os, "replace", recording_replace)
+    return calls
+
+
+def test_bursts_of_changes_are_written_once(path, replaced):
+    prefs = settings.Preferences(str(path), write_delay=0.1)
+    for ttl in range(10):
+        prefs.update({"exchange_info_ttl": ttl})
+    prefs.update({"store_backend": "parquet"})
+
+    assert toml.load(path) == {"store_backend": "hdf"}
+    assert prefs.get("exchange_info_ttl") == 9
+    prefs._write_timer.join()
+
+    assert replaced == [(f"{path}.tmp", str(path))]
+    assert toml.load(path) == {"store_backend": "parquet", "exchange_info_ttl": 9}
+    assert not os.path.exists(f"{path}.tmp")
+
+
+def test_failed_write_leaves_the_file_intact(path, replaced, monkeypatch):
+    prefs = settings.Preferences(str(path), write_delay=60)
+    prefs.update({"store_backend": "parquet"})
+
+    def interrupted_dump(data, toml_file):
+        toml_file.write("store_backend = ")
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(settings.toml, "dump", interrupted_dump)
+    with pytest.raises(OSError):
+        prefs.flush()
+
+    assert replaced == []
+    assert toml.load(path) == {"store_backend": "hdf"}
+
+
+def test_changes_by_another_process_are_reloaded(path, monkeypatch):
+    prefs = settings.Preferences(str(path))
+    assert prefs.get("store_backend") == "hdf"
+
+    path.write_text(toml.dumps({"store_backend": "parquet"}))
+    mtime = os.path.getmtime(path)
+    os.utime(path, (mtime + 5, mtime + 5))
+    # Not checked again until RELOAD_CHECK_INTERVAL has passed
+    assert prefs.get("store_backend") == "hdf"
+
+    monkeypatch.setattr(settings, "RELOAD_CHECK_INTERVAL", 0)
+    assert prefs.get("store_backend") == "parquet"
+    # Unchanged since, so not read again
+    monkeypatch.setattr(settings.toml, "load", None)
+    assert prefs.get("store_backend") == "parquet"
+
+
+def test_concurrent_blacklist_changes_are_not_lost(user_settings):
+    settings.Blacklist.set(["BNBBTC", "ETHBTC"])
+    start = threading.Barrier(8)
+
+    def change(num):
+        start.wait()
+        settings.Blacklist.add(f"SYM{num}BTC")
+        settings.Blacklist.remove("ETHBTC" if num == 0 else "NONE")
+
+    threads = [threading.Thread(target=change, args=(num,)) for num in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    added = [f"SYM{num}BTC" for num in range(8)]
+    assert settings.Blacklist.get() == sorted(["BNBBTC"] + added)
+    settings._preferences.flush()
+    saved = toml.load(user_settings / "preferences.toml")
+    assert saved["blacklist"] == sorted(["BNBBTC"] + added)
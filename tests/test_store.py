@@ -0,0 +1,207 @@
+import atexit
+import os
+
+import pandas as pd
+import pytest
+
+from benchmarks import generators
+from binance_monitor import amounts, store
+from binance_monitor.journal import TradeJournal
+from binance_monitor.trade import TaxTrade
+
+
+@pytest.fixture(params=["hdf", "parquet"])
+def store_class(request, store_folder):
+    if request.param == "parquet":
+        return pytest.importorskip("binance_monitor.parquet_store").ParquetTradeStore
+    return store.TradeStore
+
+
+def live_trades(count: int):
+    # With ids of their own, so that none is a duplicate of another, and after the
+    # generated trade history
+    return [
+        TaxTrade.from_order_update(dict(event, t=10**6 + num, T=event["T"] + 10**9))
+        for num, event in enumerate(
+            generators.execution_reports(count, trade_fraction=1.0)
+        )
+    ]
+
+
+def crash(trade_store: store.TradeStore) -> None:
+    """Drop a store as a killed process would, without saving anything"""
+
+    atexit.unregister(trade_store._save_on_exit)
+    if trade_store._checkpointer is not None:
+        trade_store._checkpointer.stop()
+    trade_store.journal.close()
+
+
+def test_journaled_trades_are_replayed_once_after_a_crash(store_folder):
+    trades = live_trades(30)
+    trade_store = store.TradeStore("acct", flush_count=100, flush_interval=3600)
+    for trade in trades[:10]:
+        trade_store.add_trade(trade)
+    trade_store.flush()
+    for trade in trades[10:]:
+        trade_store.add_trade(trade)
+    # A checkpoint which was cut short leaves its segment behind
+    trade_store.journal.rotate()
+    crash(trade_store)
+
+    recovered = store.TradeStore("acct")
+    assert sorted(recovered.trades["mark"]) == sorted(t.mark for t in trades)
+    crash(recovered)
+
+    # Replayed trades were saved and the journal cleared, so nothing is doubled
+    reopened = store.TradeStore("acct")
+    assert len(reopened.trades) == len(trades)
+    assert reopened._pending == []
+    reopened.close()
+
+
+def test_journals_of_dicts_and_of_rows_are_both_replayed(store_class):
+    trades = live_trades(6)
+    path = os.path.join(store.ACCOUNT_STORE_FOLDER, "acct.journal")
+    os.makedirs(store.ACCOUNT_STORE_FOLDER)
+    journal = TradeJournal(path)
+    # Journals written by older versions hold dicts
+    for trade in trades[:3]:
+        journal.append(trade.as_dict)
+    for trade in trades[3:]:
+        journal.append(trade.as_tuple)
+    journal.close()
+
+    trade_store = store_class("acct")
+    replayed = amounts.frame_to_decimals(
+        trade_store.query().sort_values("mark").reset_index(drop=True),
+        trade_store.scales,
+    )
+    expected = pd.DataFrame([trade.as_dict for trade in trades])
+    for column in ["mark", "dtime", "buy_amount", "fee_amount"]:
+        assert list(replayed[column]) == list(expected[column])
+    assert TradeJournal.replay(path) == []
+    trade_store.close()
+
+
+def test_stored_trades_are_rejected_by_every_path(store_class):
+    history = generators.my_trades(200)
+    trades = live_trades(10)
+    trade_store = store_class("acct")
+    trade_store.update(TaxTrade.frame_from_historic_trades(history, trade_store.scales))
+    trade_store.update(
+        TaxTrade.frame_from_historic_trades(history[150:], trade_store.scales)
+    )
+    assert [trade_store.add_trade(trade) for trade in trades + trades[:3]] == (
+        [True] * 10 + [False] * 3
+    )
+    trade_store.close()
+
+    # A journal left with a trade that was saved since is replayed without it
+    journal_path = os.path.splitext(trade_store.file_path)[0] + ".journal"
+    journal = TradeJournal(journal_path)
+    journal.append(trades[0].as_tuple)
+    journal.close()
+
+    reopened = store_class("acct")
+    assert len(reopened._keys) == 210
+    assert len(reopened.trades) == 210
+    # The index is rebuilt from the key column, so a full re-sync adds nothing
+    reopened.update(TaxTrade.frame_from_historic_trades(history, reopened.scales))
+    assert not reopened.add_trade(trades[5])
+    reopened.flush()
+    assert len(reopened.query()) == 210
+    reopened.close()
+
+    # Opening a store does not read the index, the first lookup does
+    unused = store_class("acct")
+    assert unused._keys is None
+    assert not unused.add_trade(trades[7])
+    assert unused.trade_count == 210
+    unused.close()
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_incremental_export_matches_a_full_one(store_folder, compress):
+    history = generators.my_trades(300)
+    trades = live_trades(20)
+    trade_store = store.TradeStore("acct")
+    trade_store.update(TaxTrade.frame_from_historic_trades(history, trade_store.scales))
+    csv_file = trade_store.to_csv(compress=compress, incremental=True, chunksize=64)
+
+    # One more trade at the time of the latest already exported
+    trades[0].dtime = trade_store.query()["dtime"].max()
+    for trade in trades:
+        trade_store.add_trade(trade)
+    trade_store.flush()
+    trade_store.to_csv(compress=compress, incremental=True, chunksize=64)
+    # Nothing new, so nothing is appended
+    trade_store.to_csv(compress=compress, incremental=True, chunksize=64)
+    incremental = pd.read_csv(csv_file, dtype=str)
+
+    trade_store.to_csv(compress=compress, chunksize=64)
+    full = pd.read_csv(csv_file, dtype=str)
+    trade_store.close()
+
+    assert len(full) == 320
+    assert not incremental.duplicated().any()
+    pd.testing.assert_frame_equal(
+        incremental.sort_values(["dtime", "mark"]).reset_index(drop=True),
+        full.sort_values(["dtime", "mark"]).reset_index(drop=True),
+    )
+
+
+def test_frame_from_historic_trades_matches_per_trade_conversion(store_folder):
+    payload = generators.my_trades(500, seed=3)
+    # Amounts as the API reports them for assets and symbols of other precisions
+    odd = [("7", "0.1"), ("0.1", "1234.5"), ("123.456", "0.00001234")]
+    for num, trade in enumerate(payload[::25]):
+        trade["qty"], trade["price"] = odd[num % len(odd)]
+    for trade in payload[1::40]:
+        trade["commission"] = "0.00000001"
+        trade["commissionAsset"] = "BNB"
+    assert {t["isBuyer"] for t in payload} == {True, False}
+
+    by_trade = store.TradeStore("by_trade")
+    by_trade.update([TaxTrade.from_historic_trades(trade) for trade in payload])
+    by_frame = store.TradeStore("by_frame")
+    by_frame.update(TaxTrade.frame_from_historic_trades(payload, by_frame.scales))
+    by_trade.flush()
+    by_frame.flush()
+
+    assert by_frame.scales == by_trade.scales
+    pd.testing.assert_frame_equal(
+        by_frame.query().reset_index(drop=True),
+        by_trade.query().reset_index(drop=True),
+    )
+    by_trade.close()
+    by_frame.close()
+
+
+def test_checkpoints_with_nothing_new_do_not_save(store_class, monkeypatch):
+    history = generators.my_trades(100)
+    trade_store = store_class("acct")
+    trade_store.update(TaxTrade.frame_from_historic_trades(history, trade_store.scales))
+    trade_store.flush()
+
+    saves = []
+    monkeypatch.setattr(trade_store, "_is_legacy_format", lambda: saves.append("x"))
+    save = trade_store._save
+    monkeypatch.setattr(trade_store, "_save", lambda: saves.append(save()))
+    trade_store.flush()
+    trade_store.flush()
+    assert saves == []
+
+    # A new high-water mark or trade is saved, without checking the format again
+    trade_store.update_high_water_marks(history[-1:])
+    trade_store.flush()
+    trade_store.update_high_water_marks(history[-1:])
+    trade_store.flush()
+    assert trade_store.add_trade(live_trades(1)[0])
+    trade_store.flush()
+    assert saves == [None, None]
+    trade_store.close()
+
+    reopened = store_class("acct")
+    assert len(reopened.query()) == 101
+    reopened.close()
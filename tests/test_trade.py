@@ -0,0 +1,69 @@
+import time
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+from dateutil import tz
+
+from binance_monitor.trade import TaxTrade
+
+
+@pytest.fixture
+def new_york(monkeypatch):
+    """Run with the local timezone set to America/New_York"""
+
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.mark.parametrize(
+    "kind, time_ms, fields",
+    [
+        ("LIMIT BUY", 1546300800123, ["ETH", "1.5", "BTC", "0.0525", "BNB", "-0.01"]),
+        ("MARKET SELL", 1561939200000, ["USDT", "3100.2", "BTC", "0.3", "USDT", "3.1"]),
+        (
+            "LIMIT SELL",
+            1577836799999,
+            ["BTC", "0.00001234", "XRP", "123.456", "BNB", "0"],
+        ),
+    ],
+)
+def test_trusted_constructor_matches_the_validating_one(kind, time_ms, fields):
+    trusted = TaxTrade.from_exchange(kind, time_ms, *fields, mark=1234)
+    dtime = pd.Timestamp(time_ms, unit="ms").isoformat() + "Z"
+    checked = TaxTrade(kind, dtime, *fields, exchange="Binance", mark=1234)
+
+    assert trusted.as_tuple == checked.as_tuple
+    assert [type(value) for value in trusted.as_tuple] == [
+        type(value) for value in checked.as_tuple
+    ]
+    assert trusted.dtime.tz == checked.dtime.tz
+    assert trusted.feeval == abs(Decimal(fields[-1]))
+
+
+def test_naive_times_are_local_unless_a_timezone_is_given(new_york):
+    fields = ["BTC", "1", "ETH", "30", "BNB", "0.01"]
+
+    local = TaxTrade("trade", "2019-07-01 12:00", *fields)
+    tokyo = TaxTrade(
+        "trade", "2019-07-01 12:00", *fields, default_timezone=tz.gettz("Asia/Tokyo")
+    )
+    aware = TaxTrade(
+        "trade",
+        "2019-07-01 12:00+01:00",
+        *fields,
+        default_timezone=tz.gettz("Asia/Tokyo"),
+    )
+
+    assert local.dtime == pd.Timestamp("2019-07-01 16:00", tz="UTC")
+    assert tokyo.dtime == pd.Timestamp("2019-07-01 03:00", tz="UTC")
+    assert aware.dtime == pd.Timestamp("2019-07-01 11:00", tz="UTC")
+    assert str(local.dtime.tz) == "UTC"
+
+
+def test_numeric_times_are_ambiguous():
+    with pytest.raises(ValueError, match="Ambiguity"):
+        TaxTrade("trade", 1546300800000, "BTC", "1", "ETH", "30", "BNB", "0.01")